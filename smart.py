@@ -25,6 +25,7 @@ if sys.version_info < (2, 3):
     sys.exit("error: Python 2.3 or later required")
 
 from smart import init, initDistro, initPlugins, initPycurl, initPsyco
+from smart import initHTTPKeepAlive
 from smart.const import VERSION, DATADIR
 from smart.option import OptionParser
 from smart import *
@@ -98,6 +99,9 @@ def parse_options(argv):
                       help=_("use the given interface"))
     parser.add_option("--ignore-locks", action="store_true",
                       help=_("don't respect locking"))
+    parser.add_option("--profile-solver", metavar=_("FILE"),
+                      help=_("append counters and timings of each "
+                             "transaction resolved to FILE"))
     parser.add_option("-o", "--option", action="append", default=[],
                       metavar=_("OPT"),
                       help=_("set the option given by a name=value pair"))
@@ -166,9 +170,12 @@ def main(argv):
                     loglevel=opts.log_level)
         if opts.option:
             set_config_options(opts.option)
+        if opts.profile_solver:
+            sysconf.set("profile-solver", opts.profile_solver, soft=True)
         initDistro(ctrl)
         initPlugins()
         initPycurl()
+        initHTTPKeepAlive()
         initPsyco()
         exitcode = iface.run(opts.command, opts.argv)
         if exitcode is None:
@@ -209,6 +209,10 @@ def initPycurl():
         # importing pycurl here segfaults
         hooks.call("enable-pycurl")
 
+def initHTTPKeepAlive():
+    if sysconf.get("http-keep-alive", False):
+        hooks.call("enable-http-keep-alive")
+
 def initPsyco():
     if sysconf.get("psyco", True):
         try:
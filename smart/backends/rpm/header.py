@@ -22,6 +22,7 @@
 #
 from smart.backends.rpm.rpmver import checkver, splitarch
 from smart.util.strtools import globdistance
+from smart.searchindex import getPathIndex, getPathRatios
 from smart.cache import Loader, PackageInfo
 from smart.channel import FileChannel
 from smart.backends.rpm.base import *
@@ -241,6 +242,16 @@ class RPMHeaderLoader(Loader):
         self._offsets.clear()
         self._groups.clear()
 
+    def loadFileProvides(self, fndict):
+        # The path index is saved with the loader, so once it's built
+        # the headers don't have to be read again.
+        index = getPathIndex(self)
+        packages = self._packages
+        bfp = self.buildFileProvides
+        for fn in fndict:
+            for i in index.getPackages(fn):
+                bfp(packages[i], (RPMProvides, fn, None))
+
     def load(self):
         CM = self.COMPMAP
         CF = self.COMPFLAGS
@@ -410,6 +421,15 @@ class RPMHeaderLoader(Loader):
 
     def search(self, searcher):
         ic = searcher.ignorecase
+        if searcher.path:
+            pathratios = getPathRatios(self, searcher)
+            if not (searcher.url or searcher.group or
+                    searcher.summary or searcher.description):
+                # Paths come from the index, so headers aren't needed.
+                for pkg in self._packages:
+                    if pkg in pathratios:
+                        searcher.addResult(pkg, pathratios[pkg])
+                return
         for h, offset in self.getHeaders(Progress()):
             pkg = self._offsets.get(offset)
             if not pkg:
@@ -429,18 +449,9 @@ class RPMHeaderLoader(Loader):
                 searcher.addResult(pkg, ratio)
                 continue
             if searcher.path:
-                paths = get_header_filenames(h)
-                if paths:
-                    for spath, cutoff in searcher.path:
-                        for path in paths:
-                            _, newratio = globdistance(spath, path, cutoff, ic)
-                            if newratio > ratio:
-                                ratio = newratio
-                                if ratio == 1:
-                                    break
-                        else:
-                            continue
-                        break
+                newratio = pathratios.get(pkg, 0)
+                if newratio > ratio:
+                    ratio = newratio
             if ratio == 1:
                 searcher.addResult(pkg, ratio)
                 continue
@@ -507,7 +518,6 @@ class RPMHeaderListLoader(RPMHeaderLoader):
 
             self.__class__.getHeaders = self.getHeadersHDL.im_func
             self.__class__.getHeader = self.getHeaderHDL.im_func
-            self.__class__.loadFileProvides = self.loadFileProvidesHDL.im_func
 
             self._hdl = rpm.readHeaderListFromFile(self._filename)
 
@@ -573,26 +583,6 @@ class RPMHeaderListLoader(RPMHeaderLoader):
     def getMD5(self, info):
         return None
 
-    def loadFileProvides(self, fndict):
-        file = open(self._filename)
-        h, offset = rpm.readHeaderFromFD(file.fileno())
-        bfp = self.buildFileProvides
-        while h:
-            for fn in get_header_filenames(h):
-                fn = fndict.get(fn)
-                if fn and offset in self._offsets:
-                    bfp(self._offsets[offset], (RPMProvides, fn, None))
-            h, offset = rpm.readHeaderFromFD(file.fileno())
-        file.close()
-
-    def loadFileProvidesHDL(self, fndict):
-        bfp = self.buildFileProvides
-        for offset, h in enumerate(self._hdl):
-            for fn in get_header_filenames(h):
-                fn = fndict.get(fn)
-                if fn and offset in self._offsets:
-                    bfp(self._offsets[offset], (RPMProvides, fn, None))
-
 class RPMPackageListLoader(RPMHeaderListLoader):
 
     def getFileName(self, info):
@@ -770,26 +760,6 @@ class RPMDirLoader(RPMHeaderLoader):
         # Could compute it now, but why?
         return None
 
-    def loadFileProvides(self, fndict):
-        ts = getTS()
-        bfp = self.buildFileProvides
-        for i, filename in enumerate(self._filenames):
-            if i not in self._offsets:
-                continue
-            filepath = os.path.join(self._dir, filename)
-            file = open(filepath)
-            try:
-                h = ts.hdrFromFdno(file.fileno())
-            except rpm.error, e:
-                file.close()
-                iface.error("%s: %s" % (os.path.basename(filepath), e))
-            else:
-                file.close()
-                for fn in get_header_filenames(h):
-                    fn = fndict.get(fn)
-                    if fn:
-                        bfp(self._offsets[i], (RPMProvides, fn, None))
-
 class RPMFileChannel(FileChannel):
 
     def fetch(self, fetcher, progress):
@@ -816,10 +786,8 @@ def enablePsyco(psyco):
     psyco.bind(RPMHeaderLoader.search)
     psyco.bind(RPMHeaderListLoader.getHeaders)
     psyco.bind(RPMHeaderListLoader.getHeadersHDL)
-    psyco.bind(RPMHeaderListLoader.loadFileProvides)
-    psyco.bind(RPMHeaderListLoader.loadFileProvidesHDL)
+    psyco.bind(RPMHeaderLoader.loadFileProvides)
     psyco.bind(RPMDirLoader.getHeaders)
-    psyco.bind(RPMDirLoader.loadFileProvides)
     psyco.bind(RPMDBLoader.getHeaders)
     psyco.bind(RPMDBLoader.loadFileProvides)
 
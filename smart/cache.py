@@ -20,12 +20,36 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 from smart.util.strtools import globdistance
-from smart.const import BLOCKSIZE
+from smart.util.filedigest import getFileDigests
+from smart.searchindex import getSearchPackages, getSearchProvides
+from smart.searchindex import getPathRatios
 from smart import *
 import os
 
 class StateVersionError(Error): pass
 
+def _removeItem(lst, item):
+    for i in range(len(lst)):
+        if lst[i] is item:
+            del lst[i]
+            break
+
+def _unindexItem(index, name, item):
+    lst = index.get(name)
+    if lst:
+        _removeItem(lst, item)
+        if not lst:
+            del index[name]
+
+def _indexNames(dep):
+    # Dependencies are indexed by the names they may match, and
+    # also by their own name, so that they may be looked up by it.
+    names = dep.getMatchNames()
+    if dep.name not in names:
+        names = list(names)
+        names.append(dep.name)
+    return names
+
 class Package(object):
 
     def __init__(self, name, version):
@@ -205,62 +229,34 @@ class PackageInfo(object):
                 raise Error, _("File not found")
 
             size = self.getSize(url)
-            if size:
-                lsize = os.path.getsize(localpath)
-                if lsize != size:
-                    raise Error, _("Unexpected size (expected %d, got %d)") % \
-                                 (size, lsize)
-
             filemd5 = self.getMD5(url)
-            if filemd5:
-                try:
-                    from hashlib import md5
-                except ImportError:
-                    from md5 import md5
-                digest = md5()
-                file = open(localpath)
-                data = file.read(BLOCKSIZE)
-                while data:
-                    digest.update(data)
-                    data = file.read(BLOCKSIZE)
-                lfilemd5 = digest.hexdigest()
-                if lfilemd5 != filemd5:
-                    raise Error, _("Invalid MD5 (expected %s, got %s)") % \
-                                 (filemd5, lfilemd5)
-
             filesha256 = self.getSHA256(url)
-            if filesha256:
-                try:
-                    from hashlib import sha256
-                except ImportError:
-                    from smart.util.sha256 import sha256
-                digest = sha256()
-                file = open(localpath)
-                data = file.read(BLOCKSIZE)
-                while data:
-                    digest.update(data)
-                    data = file.read(BLOCKSIZE)
-                lfilesha256 = digest.hexdigest()
-                if lfilesha256 != filesha256:
-                   raise Error, _("Invalid SHA256 (expected %s, got %s)") % \
-                                 (filesha256, lfilesha256)
+            filesha = not filesha256 and self.getSHA(url)
+            names = [name for name, value in (("md5", filemd5),
+                                              ("sha256", filesha256),
+                                              ("sha", filesha))
+                     if value]
+            if names:
+                digests = getFileDigests(localpath, names)
+                lsize = digests["size"]
             else:
-                filesha = self.getSHA(url)
-                if filesha:
-                    try:
-                        from hashlib import sha1 as sha
-                    except ImportError:
-                        from sha import sha
-                    digest = sha()
-                    file = open(localpath)
-                    data = file.read(BLOCKSIZE)
-                    while data:
-                        digest.update(data)
-                        data = file.read(BLOCKSIZE)
-                    lfilesha = digest.hexdigest()
-                    if lfilesha != filesha:
-                        raise Error, _("Invalid SHA (expected %s, got %s)") % \
-                                     (filesha, lfilesha)
+                lsize = os.path.getsize(localpath)
+
+            if size and lsize != size:
+                raise Error, _("Unexpected size (expected %d, got %d)") % \
+                             (size, lsize)
+
+            if filemd5 and digests["md5"] != filemd5:
+                raise Error, _("Invalid MD5 (expected %s, got %s)") % \
+                             (filemd5, digests["md5"])
+
+            if filesha256 and digests["sha256"] != filesha256:
+               raise Error, _("Invalid SHA256 (expected %s, got %s)") % \
+                             (filesha256, digests["sha256"])
+
+            if filesha and digests["sha"] != filesha:
+                raise Error, _("Invalid SHA (expected %s, got %s)") % \
+                             (filesha, digests["sha"])
         except Error, reason:
             if withreason:
                 return False, reason
@@ -367,6 +363,7 @@ class Loader(object):
         self._channel = None
         self._cache = None
         self._installed = False
+        self._searchindex = None
 
     def getPackages(self):
         return self._packages
@@ -397,6 +394,7 @@ class Loader(object):
 
     def reset(self):
         del self._packages[:]
+        self._searchindex = None
 
     def load(self):
         pass
@@ -501,6 +499,8 @@ class Loader(object):
 
         prv.packages.append(pkg)
         pkg.provides.append(prv)
+        if self._searchindex is not None:
+            self._searchindex.addProvides(prv.name)
 
         for req in pkg.requires[:]:
             if req.name == prv.name:
@@ -514,6 +514,8 @@ class Loader(object):
         # should use the fastest possible method. The one here is
         # generic, and should be replaced if possible.
         ic = searcher.ignorecase
+        if searcher.path:
+            pathratios = getPathRatios(self, searcher)
         for pkg in self._packages:
             info = self.getInfo(pkg)
             ratio = 0
@@ -532,16 +534,9 @@ class Loader(object):
                 searcher.addResult(pkg, ratio)
                 continue
             if searcher.path:
-                for spath, cutoff in searcher.path:
-                    for path in info.getPathList():
-                        _, newratio = globdistance(spath, path, cutoff, ic)
-                        if newratio > ratio:
-                            ratio = newratio
-                            if ratio == 1:
-                                break
-                    else:
-                        continue
-                    break
+                newratio = pathratios.get(pkg, 0)
+                if newratio > ratio:
+                    ratio = newratio
             if ratio == 1:
                 searcher.addResult(pkg, ratio)
                 continue
@@ -593,6 +588,14 @@ class Cache(object):
         self._upgrades = []
         self._conflicts = []
         self._objmap = {}
+        self._pkgnames = {}
+        self._prvnames = {}
+        self._reqnames = {}
+        self._recnames = {}
+        self._upgnames = {}
+        self._cnfnames = {}
+        self._removed = []
+        self._linked = False
 
     def reset(self):
         for prv in self._provides:
@@ -628,16 +631,30 @@ class Cache(object):
         del self._upgrades[:]
         del self._conflicts[:]
         self._objmap.clear()
+        self._pkgnames.clear()
+        self._prvnames.clear()
+        self._reqnames.clear()
+        self._recnames.clear()
+        self._upgnames.clear()
+        self._cnfnames.clear()
+        del self._removed[:]
+        self._linked = False
 
     def addLoader(self, loader):
         if loader:
             if loader not in self._loaders:
                 self._loaders.append(loader)
                 loader.setCache(self)
+                if loader._packages:
+                    # Packages built elsewhere can't be merged
+                    # incrementally. Relink everything on load.
+                    self._linked = False
 
     def removeLoader(self, loader):
         if loader:
             if loader in self._loaders:
+                if self._linked:
+                    self._removed.extend(loader._packages)
                 self._loaders.remove(loader)
                 loader.setCache(None)
                 loader.unload()
@@ -695,25 +712,47 @@ class Cache(object):
         self._conflicts[:] = conflicts.keys()
 
     def load(self):
-        self._reload()
+        # If the cache is already linked, only packages from removed
+        # loaders are unlinked, and only relations introduced by new
+        # loaders are linked. Otherwise everything is rebuilt.
+        linked = self._linked
+        if linked:
+            if self._removed:
+                self.unlinkPackages(self._removed)
+                del self._removed[:]
+            offsets = (len(self._packages), len(self._provides),
+                       len(self._requires), len(self._recommends),
+                       len(self._upgrades), len(self._conflicts))
+        else:
+            self.reset()
+            self._reload()
+        # Name indexes are out of date until linked again.
+        self._linked = False
         prog = iface.getProgress(self)
         prog.start()
         prog.setTopic(_("Updating cache..."))
         prog.set(0, 1)
         prog.show()
         total = 1
-        for loader in self._loaders:
-            if not loader._packages:
-                total += loader.getLoadSteps()
+        pending = [x for x in self._loaders if not x._packages]
+        for loader in pending:
+            total += loader.getLoadSteps()
         prog.set(0, total)
         prog.show()
-        for loader in self._loaders:
-            if not loader._packages:
+        jobs = sysconf.get("load-jobs", 1)
+        if jobs > 1 and len(pending) > 1:
+            from smart.loadpool import loadInParallel
+            loadInParallel(self, pending, jobs)
+        else:
+            for loader in pending:
                 loader.load()
         self.loadFileProvides()
         hooks.call("cache-loaded-pre-link", self)
-        self._objmap.clear()
-        self.linkDeps()
+        if linked:
+            self.linkNewDeps(*offsets)
+        else:
+            self.linkDeps()
+        self._linked = True
         prog.setDone()
         prog.show()
         prog.stop()
@@ -733,131 +772,292 @@ class Cache(object):
         for loader in self._loaders:
             loader.loadFileProvides(fndict)
 
-    def linkDeps(self):
-        reqnames = {}
+    def unlinkPackages(self, packages):
+        loaders = dict.fromkeys(self._loaders, True)
+        objmap = self._objmap
+        dead = {}
+        for pkg in packages:
+            if pkg in dead:
+                continue
+            for pkgloader in pkg.loaders.keys():
+                if pkgloader not in loaders:
+                    del pkg.loaders[pkgloader]
+            if pkg.loaders:
+                # Still available from another loader.
+                pkg.installed = False
+                for pkgloader in pkg.loaders:
+                    pkg.installed |= pkgloader._installed
+                continue
+            dead[pkg] = True
+            _unindexItem(self._pkgnames, pkg.name, pkg)
+            _unindexItem(objmap, pkg.getInitArgs(), pkg)
+            for prv in pkg.provides:
+                _removeItem(prv.packages, pkg)
+                if prv.packages:
+                    continue
+                dead[prv] = True
+                for attr in ("requiredby", "recommendedby",
+                             "upgradedby", "conflictedby"):
+                    lst = getattr(prv, attr)
+                    if lst:
+                        for dep in lst:
+                            _removeItem(dep.providedby, prv)
+                        del lst[:]
+                _unindexItem(self._prvnames, prv.name, prv)
+                args = prv.getInitArgs()
+                if objmap.get(args) is prv:
+                    del objmap[args]
+            for deps, names, attr in \
+                    ((pkg.requires, self._reqnames, "requiredby"),
+                     (pkg.recommends, self._recnames, "recommendedby"),
+                     (pkg.upgrades, self._upgnames, "upgradedby"),
+                     (pkg.conflicts, self._cnfnames, "conflictedby")):
+                for dep in deps:
+                    _removeItem(dep.packages, pkg)
+                    if dep.packages:
+                        continue
+                    dead[dep] = True
+                    if dep.providedby:
+                        for prv in dep.providedby:
+                            _removeItem(getattr(prv, attr), dep)
+                        del dep.providedby[:]
+                    for name in _indexNames(dep):
+                        _unindexItem(names, name, dep)
+                    args = dep.getInitArgs()
+                    if objmap.get(args) is dep:
+                        del objmap[args]
+        if dead:
+            for lst in (self._packages, self._provides, self._requires,
+                        self._recommends, self._upgrades, self._conflicts):
+                lst[:] = [x for x in lst if x not in dead]
+
+    def _linkDep(self, dep, prv, attr):
+        if dep.providedby:
+            dep.providedby.append(prv)
+        else:
+            dep.providedby = [prv]
+        lst = getattr(prv, attr)
+        if lst:
+            lst.append(dep)
+        else:
+            setattr(prv, attr, [dep])
+
+    def indexDeps(self):
+        pkgnames = self._pkgnames
+        pkgnames.clear()
+        for pkg in self._packages:
+            lst = pkgnames.get(pkg.name)
+            if lst:
+                lst.append(pkg)
+            else:
+                pkgnames[pkg.name] = [pkg]
+        prvnames = self._prvnames
+        prvnames.clear()
+        for prv in self._provides:
+            lst = prvnames.get(prv.name)
+            if lst:
+                lst.append(prv)
+            else:
+                prvnames[prv.name] = [prv]
+        reqnames = self._reqnames
+        reqnames.clear()
         for req in self._requires:
-            for name in req.getMatchNames():
+            for name in _indexNames(req):
                 lst = reqnames.get(name)
                 if lst:
                     lst.append(req)
                 else:
                     reqnames[name] = [req]
-        recnames = {}
+        recnames = self._recnames
+        recnames.clear()
         for rec in self._recommends:
-            for name in rec.getMatchNames():
+            for name in _indexNames(rec):
                 lst = recnames.get(name)
                 if lst:
                     lst.append(rec)
                 else:
                     recnames[name] = [rec]
-        upgnames = {}
+        upgnames = self._upgnames
+        upgnames.clear()
         for upg in self._upgrades:
-            for name in upg.getMatchNames():
+            for name in _indexNames(upg):
                 lst = upgnames.get(name)
                 if lst:
                     lst.append(upg)
                 else:
                     upgnames[name] = [upg]
-        cnfnames = {}
+        cnfnames = self._cnfnames
+        cnfnames.clear()
         for cnf in self._conflicts:
-            for name in cnf.getMatchNames():
+            for name in _indexNames(cnf):
                 lst = cnfnames.get(name)
                 if lst:
                     lst.append(cnf)
                 else:
                     cnfnames[name] = [cnf]
+
+    def linkDeps(self):
+        self.indexDeps()
+        reqnames = self._reqnames
+        recnames = self._recnames
+        upgnames = self._upgnames
+        cnfnames = self._cnfnames
         for prv in self._provides:
             lst = reqnames.get(prv.name)
             if lst:
                 for req in lst:
                     if req.matches(prv):
-                        if req.providedby:
-                            req.providedby.append(prv)
-                        else:
-                            req.providedby = [prv]
-                        if prv.requiredby:
-                            prv.requiredby.append(req)
-                        else:
-                            prv.requiredby = [req]
+                        self._linkDep(req, prv, "requiredby")
             lst = recnames.get(prv.name)
             if lst:
                 for rec in lst:
                     if rec.matches(prv):
-                        if rec.providedby:
-                            rec.providedby.append(prv)
-                        else:
-                            rec.providedby = [prv]
-                        if prv.recommendedby:
-                            prv.recommendedby.append(rec)
-                        else:
-                            prv.recommendedby = [rec]
+                        self._linkDep(rec, prv, "recommendedby")
             lst = upgnames.get(prv.name)
             if lst:
                 for upg in lst:
                     if upg.matches(prv):
-                        if upg.providedby:
-                            upg.providedby.append(prv)
-                        else:
-                            upg.providedby = [prv]
-                        if prv.upgradedby:
-                            prv.upgradedby.append(upg)
-                        else:
-                            prv.upgradedby = [upg]
+                        self._linkDep(upg, prv, "upgradedby")
             lst = cnfnames.get(prv.name)
             if lst:
                 for cnf in lst:
                     if cnf.matches(prv):
-                        if cnf.providedby:
-                            cnf.providedby.append(prv)
-                        else:
-                            cnf.providedby = [prv]
-                        if prv.conflictedby:
-                            prv.conflictedby.append(cnf)
-                        else:
-                            prv.conflictedby = [cnf]
+                        self._linkDep(cnf, prv, "conflictedby")
+
+    def linkNewDeps(self, pkgoff, prvoff, reqoff, recoff, upgoff, cnfoff):
+        # New packages and relations are at the end of the cache lists.
+        # First link new dependencies against the provides already
+        # known, and then link new provides against every dependency.
+        pkgnames = self._pkgnames
+        for pkg in self._packages[pkgoff:]:
+            lst = pkgnames.get(pkg.name)
+            if lst:
+                lst.append(pkg)
+            else:
+                pkgnames[pkg.name] = [pkg]
+        prvnames = self._prvnames
+        kinds = ((self._requires[reqoff:], self._reqnames, "requiredby"),
+                 (self._recommends[recoff:], self._recnames, "recommendedby"),
+                 (self._upgrades[upgoff:], self._upgnames, "upgradedby"),
+                 (self._conflicts[cnfoff:], self._cnfnames, "conflictedby"))
+        for deps, names, attr in kinds:
+            for dep in deps:
+                for name in _indexNames(dep):
+                    lst = prvnames.get(name)
+                    if lst:
+                        for prv in lst:
+                            if dep.matches(prv):
+                                self._linkDep(dep, prv, attr)
+                    lst = names.get(name)
+                    if lst:
+                        lst.append(dep)
+                    else:
+                        names[name] = [dep]
+        for prv in self._provides[prvoff:]:
+            lst = prvnames.get(prv.name)
+            if lst:
+                lst.append(prv)
+            else:
+                prvnames[prv.name] = [prv]
+            for deps, names, attr in kinds:
+                lst = names.get(prv.name)
+                if lst:
+                    for dep in lst:
+                        if dep.matches(prv):
+                            self._linkDep(dep, prv, attr)
 
     def getPackages(self, name=None):
         if not name:
             return self._packages
+        elif self._linked:
+            return self._pkgnames.get(name, [])[:]
         else:
             return [x for x in self._packages if x.name == name]
 
     def getProvides(self, name=None):
         if not name:
             return self._provides
+        elif self._linked:
+            return self._prvnames.get(name, [])[:]
         else:
             return [x for x in self._provides if x.name == name]
 
     def getRequires(self, name=None):
         if not name:
             return self._requires
+        elif self._linked:
+            return [x for x in self._reqnames.get(name, ()) if x.name == name]
         else:
             return [x for x in self._requires if x.name == name]
 
     def getRecommends(self, name=None):
         if not name:
             return self._recommends
+        elif self._linked:
+            return [x for x in self._recnames.get(name, ()) if x.name == name]
         else:
             return [x for x in self._recommends if x.name == name]
 
     def getUpgrades(self, name=None):
         if not name:
             return self._upgrades
+        elif self._linked:
+            return [x for x in self._upgnames.get(name, ()) if x.name == name]
         else:
             return [x for x in self._upgrades if x.name == name]
 
     def getConflicts(self, name=None):
         if not name:
             return self._conflicts
+        elif self._linked:
+            return [x for x in self._cnfnames.get(name, ()) if x.name == name]
         else:
             return [x for x in self._conflicts if x.name == name]
 
+    def _getByNames(self, objs, index, names):
+        result = {}
+        if self._linked:
+            for name in names:
+                if name in result:
+                    continue
+                lst = [x for x in index.get(name, ()) if x.name == name]
+                if lst:
+                    result[name] = lst
+        else:
+            names = dict.fromkeys(names)
+            for obj in objs:
+                if obj.name in names:
+                    lst = result.get(obj.name)
+                    if lst:
+                        lst.append(obj)
+                    else:
+                        result[obj.name] = [obj]
+        return result
+
+    def getPackagesByNames(self, names):
+        return self._getByNames(self._packages, self._pkgnames, names)
+
+    def getProvidesByNames(self, names):
+        return self._getByNames(self._provides, self._prvnames, names)
+
+    def getRequiresByNames(self, names):
+        return self._getByNames(self._requires, self._reqnames, names)
+
+    def getRecommendsByNames(self, names):
+        return self._getByNames(self._recommends, self._recnames, names)
+
+    def getUpgradesByNames(self, names):
+        return self._getByNames(self._upgrades, self._upgnames, names)
+
+    def getConflictsByNames(self, names):
+        return self._getByNames(self._conflicts, self._cnfnames, names)
+
     def search(self, searcher):
         if searcher.nameversion:
-            for pkg in self._packages:
+            for pkg in getSearchPackages(self, searcher):
                 pkg.search(searcher)
         if searcher.provides:
-            for prv in self._provides:
+            for prv in getSearchProvides(self, searcher):
                 prv.search(searcher)
         if searcher.requires:
             for prv in searcher.requires:
@@ -928,6 +1128,14 @@ class Cache(object):
         self._upgrades = upgrades.keys()
         self._conflicts = conflicts.keys()
         self._objmap = {}
+        self._pkgnames = {}
+        self._prvnames = {}
+        self._reqnames = {}
+        self._recnames = {}
+        self._upgnames = {}
+        self._cnfnames = {}
+        self._removed = []
+        self._linked = False
 
 from ccache import *
 
@@ -117,6 +117,7 @@ typedef struct {
     PyObject *_channel;
     PyObject *_cache;
     PyObject *_installed;
+    PyObject *_searchindex;
 } LoaderObject;
 
 typedef struct {
@@ -129,6 +130,14 @@ typedef struct {
     PyObject *_upgrades;
     PyObject *_conflicts;
     PyObject *_objmap;
+    PyObject *_pkgnames;
+    PyObject *_prvnames;
+    PyObject *_reqnames;
+    PyObject *_recnames;
+    PyObject *_upgnames;
+    PyObject *_cnfnames;
+    PyObject *_removed;
+    int _linked;
 } CacheObject;
 
 static PyObject *
@@ -159,6 +168,20 @@ getPkgConf(void)
     return pkgconf;
 }
 
+static PyObject *
+getSysConf(void)
+{
+    static PyObject *sysconf = NULL;
+    if (sysconf == NULL) {
+        PyObject *module = PyImport_ImportModule("smart");
+        if (module) {
+            sysconf = PyObject_GetAttrString(module, "sysconf");
+            Py_DECREF(module);
+        }
+    }
+    return sysconf;
+}
+
 static PyObject *
 getIface(void)
 {
@@ -187,6 +210,15 @@ getGlobDistance(void)
     return globdistance;
 }
 
+static PyObject *
+getSearchIndexModule(void)
+{
+    static PyObject *module = NULL;
+    if (module == NULL)
+        module = PyImport_ImportModule("smart.searchindex");
+    return module;
+}
+
 static PyObject *
 _(const char *str)
 {
@@ -1458,6 +1490,8 @@ Loader_init(LoaderObject *self, PyObject *args)
     self->_installed = Py_False;
     Py_INCREF(Py_None);
     self->_cache = Py_None;
+    Py_INCREF(Py_None);
+    self->_searchindex = Py_None;
     return 0;
 }
 
@@ -1467,6 +1501,7 @@ Loader_traverse(LoaderObject *self, visitproc visit, void *arg)
     Py_VISIT(self->_packages);
     Py_VISIT(self->_channel);
     Py_VISIT(self->_cache);
+    Py_VISIT(self->_searchindex);
     return 0;
 }
 
@@ -1476,6 +1511,7 @@ Loader_clear(LoaderObject *self)
     Py_CLEAR(self->_packages);
     Py_CLEAR(self->_channel);
     Py_CLEAR(self->_cache);
+    Py_CLEAR(self->_searchindex);
     return 0;
 }
 
@@ -1486,6 +1522,7 @@ Loader_dealloc(LoaderObject *self)
     Py_XDECREF(self->_packages);
     Py_XDECREF(self->_installed);
     Py_XDECREF(self->_cache);
+    Py_XDECREF(self->_searchindex);
     self->ob_type->tp_free((PyObject *)self);
 }
 
@@ -1571,6 +1608,9 @@ PyObject *
 Loader_reset(LoaderObject *self, PyObject *args)
 {
     LIST_CLEAR(self->_packages);
+    Py_INCREF(Py_None);
+    Py_XDECREF(self->_searchindex);
+    self->_searchindex = Py_None;
     Py_RETURN_NONE;
 }
 
@@ -2076,6 +2116,12 @@ Loader_buildFileProvides(LoaderObject *self, PyObject *args)
     /* pkg.provides.append(prv) */
     PyList_Append(pkgobj->provides, prv);
 
+    /* if self._searchindex is not None: */
+    if (self->_searchindex && self->_searchindex != Py_None) {
+        /* self._searchindex.addProvides(prv.name) */
+        CALLMETHOD(self->_searchindex, "addProvides", "O", prvobj->name);
+    }
+
     /* for req in pkg.requires[:]: */
     for (i = PyList_GET_SIZE(pkgobj->requires)-1; i != -1; i--) {
         DependsObject *reqobj;
@@ -2113,6 +2159,7 @@ Loader_search(LoaderObject *self, PyObject *searcher)
     PyObject *globdistance = getGlobDistance();
     PyObject *ratio = NULL;
     PyObject *ignorecase;
+    PyObject *pathratios = NULL;
     PyObject *pkg, *info;
     int i, j, k;
 
@@ -2123,6 +2170,33 @@ Loader_search(LoaderObject *self, PyObject *searcher)
     if (ignorecase == NULL)
         return NULL;
 
+    lst1 = PyObject_GetAttrString(searcher, "path");
+    if (lst1 == NULL || !PyList_Check(lst1)) {
+        PyErr_SetString(PyExc_TypeError, "Invalid path attribute");
+        return NULL;
+    }
+    if (PyList_GET_SIZE(lst1)) {
+        PyObject *module = getSearchIndexModule();
+        if (!module) {
+            Py_DECREF(lst1);
+            return NULL;
+        }
+        pathratios = PyObject_CallMethod(module, "getPathRatios", "OO",
+                                         self, searcher);
+        if (!pathratios) {
+            Py_DECREF(lst1);
+            return NULL;
+        }
+        if (!PyDict_Check(pathratios)) {
+            Py_DECREF(pathratios);
+            Py_DECREF(lst1);
+            PyErr_SetString(PyExc_TypeError,
+                            "getPathRatios() didn't return a dict");
+            return NULL;
+        }
+    }
+    Py_DECREF(lst1);
+
     for (i = 0; i != PyList_GET_SIZE(self->_packages); i++) {
         pkg = PyList_GET_ITEM(self->_packages, i);
         info = PyObject_CallMethod((PyObject *)self, "getInfo", "O", pkg);
@@ -2179,46 +2253,15 @@ Loader_search(LoaderObject *self, PyObject *searcher)
         }
 
 
-        lst1 = PyObject_GetAttrString(searcher, "path");
-        if (lst1 == NULL || !PyList_Check(lst1)) {
-            PyErr_SetString(PyExc_TypeError, "Invalid url attribute");
-            return NULL;
-        }
-        for (j = 0; j != PyList_GET_SIZE(lst1); j++) {
-            tup = PyList_GET_ITEM(lst1, j);
-            if (PyTuple_GET_SIZE(tup) != 2) {
-                PyErr_SetString(PyExc_ValueError, "Invalid url tuple size");
-                return NULL;
-            }
-            lst2 = PyObject_CallMethod(info, "getPathList", NULL);
-            if (lst2 == NULL)
-                return NULL;
-            for (k = 0; k != PyList_GET_SIZE(lst2); k++) {
-                res = PyObject_CallFunction(globdistance, "OOOO",
-                                            PyTuple_GET_ITEM(tup, 0),
-                                            PyList_GET_ITEM(lst2, k),
-                                            PyTuple_GET_ITEM(tup, 1),
-                                            ignorecase);
-                if (res == NULL)
-                    return NULL;
-                if (PyTuple_GET_SIZE(res) != 2 ||
-                    !PyFloat_Check(PyTuple_GET_ITEM(res, 1))) {
-                    PyErr_SetString(PyExc_ValueError, "Invalid globdistance "
-                                                      "answer size");
-                    return NULL;
-                }
-                if (ratio == NULL ||
-                    PyFloat_AS_DOUBLE(PyTuple_GET_ITEM(res, 1)) >
-                    PyFloat_AS_DOUBLE(ratio)) {
-                    Py_XDECREF(ratio);
-                    ratio = PyTuple_GET_ITEM(res, 1);
-                    Py_INCREF(ratio);
-                }
-                Py_DECREF(res);
+        if (pathratios) {
+            tmp = PyDict_GetItem(pathratios, pkg);
+            if (tmp && (ratio == NULL ||
+                        PyFloat_AS_DOUBLE(tmp) > PyFloat_AS_DOUBLE(ratio))) {
+                Py_XDECREF(ratio);
+                ratio = tmp;
+                Py_INCREF(ratio);
             }
-            Py_DECREF(lst2);
         }
-        Py_DECREF(lst1);
 
         if (ratio && PyFloat_AS_DOUBLE(ratio) == 1) {
             CALLMETHOD(searcher, "addResult", "OO", pkg, ratio);
@@ -2318,6 +2361,7 @@ Loader_search(LoaderObject *self, PyObject *searcher)
         Py_DECREF(info);
     }
     Py_DECREF(ignorecase);
+    Py_XDECREF(pathratios);
 
     Py_INCREF(Py_None);
     return Py_None;
@@ -2446,6 +2490,7 @@ static PyMemberDef Loader_members[] = {
     {"_cache", T_OBJECT, OFF(_cache), 0, 0},
     {"_packages", T_OBJECT, OFF(_packages), 0, 0},
     {"_installed", T_OBJECT, OFF(_installed), 0, 0},
+    {"_searchindex", T_OBJECT, OFF(_searchindex), 0, 0},
     {NULL}
 };
 #undef OFF
@@ -2507,6 +2552,14 @@ Cache_init(CacheObject *self, PyObject *args)
     self->_upgrades = PyList_New(0);
     self->_conflicts = PyList_New(0);
     self->_objmap = PyDict_New();
+    self->_pkgnames = PyDict_New();
+    self->_prvnames = PyDict_New();
+    self->_reqnames = PyDict_New();
+    self->_recnames = PyDict_New();
+    self->_upgnames = PyDict_New();
+    self->_cnfnames = PyDict_New();
+    self->_removed = PyList_New(0);
+    self->_linked = 0;
     return 0;
 }
 
@@ -2521,6 +2574,13 @@ Cache_traverse(CacheObject *self, visitproc visit, void *arg)
     Py_VISIT(self->_upgrades);
     Py_VISIT(self->_conflicts);
     Py_VISIT(self->_objmap);
+    Py_VISIT(self->_pkgnames);
+    Py_VISIT(self->_prvnames);
+    Py_VISIT(self->_reqnames);
+    Py_VISIT(self->_recnames);
+    Py_VISIT(self->_upgnames);
+    Py_VISIT(self->_cnfnames);
+    Py_VISIT(self->_removed);
     return 0;
 }
 
@@ -2535,6 +2595,13 @@ Cache_clear(CacheObject *self)
     Py_CLEAR(self->_upgrades);
     Py_CLEAR(self->_conflicts);
     Py_CLEAR(self->_objmap);
+    Py_CLEAR(self->_pkgnames);
+    Py_CLEAR(self->_prvnames);
+    Py_CLEAR(self->_reqnames);
+    Py_CLEAR(self->_recnames);
+    Py_CLEAR(self->_upgnames);
+    Py_CLEAR(self->_cnfnames);
+    Py_CLEAR(self->_removed);
     return 0;
 }
 
@@ -2549,6 +2616,13 @@ Cache_dealloc(CacheObject *self)
     Py_XDECREF(self->_upgrades);
     Py_XDECREF(self->_conflicts);
     Py_XDECREF(self->_objmap);
+    Py_XDECREF(self->_pkgnames);
+    Py_XDECREF(self->_prvnames);
+    Py_XDECREF(self->_reqnames);
+    Py_XDECREF(self->_recnames);
+    Py_XDECREF(self->_upgnames);
+    Py_XDECREF(self->_cnfnames);
+    Py_XDECREF(self->_removed);
     self->ob_type->tp_free((PyObject *)self);
 }
 
@@ -2619,6 +2693,14 @@ Cache_reset(CacheObject *self, PyObject *args)
     LIST_CLEAR(self->_upgrades);
     LIST_CLEAR(self->_conflicts);
     PyDict_Clear(self->_objmap);
+    PyDict_Clear(self->_pkgnames);
+    PyDict_Clear(self->_prvnames);
+    PyDict_Clear(self->_reqnames);
+    PyDict_Clear(self->_recnames);
+    PyDict_Clear(self->_upgnames);
+    PyDict_Clear(self->_cnfnames);
+    LIST_CLEAR(self->_removed);
+    self->_linked = 0;
     Py_RETURN_NONE;
 }
 
@@ -2634,6 +2716,12 @@ Cache_addLoader(CacheObject *self, PyObject *loader)
         if (i == len) {
             PyList_Append(self->_loaders, loader);
             CALLMETHOD(loader, "setCache", "O", self);
+            /*
+               if loader._packages:
+                   self._linked = False
+            */
+            if (PyList_GET_SIZE(((LoaderObject *)loader)->_packages) != 0)
+                self->_linked = 0;
         }
     }
     Py_RETURN_NONE;
@@ -2646,8 +2734,18 @@ Cache_removeLoader(CacheObject *self, PyObject *loader)
         int i, len;
         len = PyList_GET_SIZE(self->_loaders);
         for (i = len-1; i >= 0; i--)
-            if (PyList_GET_ITEM(self->_loaders, i) == loader)
+            if (PyList_GET_ITEM(self->_loaders, i) == loader) {
+                /*
+                   if self._linked:
+                       self._removed.extend(loader._packages)
+                */
+                if (self->_linked) {
+                    int rlen = PyList_GET_SIZE(self->_removed);
+                    PyList_SetSlice(self->_removed, rlen, rlen,
+                                    ((LoaderObject *)loader)->_packages);
+                }
                 PyList_SetSlice(self->_loaders, i, i+1, (PyObject *)NULL);
+            }
         if (i >= 0) {
             CALLMETHOD(loader, "setCache", "O", Py_None);
             CALLMETHOD(loader, "unload", NULL);
@@ -2926,14 +3024,40 @@ Cache_load(CacheObject *self, PyObject *args)
 {
     int i, len;
     int total = 1;
+    int linked = self->_linked;
+    int pkgoff = 0, prvoff = 0, reqoff = 0, recoff = 0, upgoff = 0;
+    int cnfoff = 0;
+    long jobs;
     PyObject *hooks;
+    PyObject *pending;
     PyObject *prog;
     PyObject *ret;
 
-    ret = Cache__reload(self, NULL);
-    if (ret == NULL)
-        return NULL;
-    Py_DECREF(ret);
+    /*
+       If the cache is already linked, only packages from removed
+       loaders are unlinked, and only relations introduced by new
+       loaders are linked. Otherwise everything is rebuilt.
+    */
+    if (linked) {
+        if (PyList_GET_SIZE(self->_removed) != 0) {
+            CALLMETHOD(self, "unlinkPackages", "O", self->_removed);
+            LIST_CLEAR(self->_removed);
+        }
+        pkgoff = PyList_GET_SIZE(self->_packages);
+        prvoff = PyList_GET_SIZE(self->_provides);
+        reqoff = PyList_GET_SIZE(self->_requires);
+        recoff = PyList_GET_SIZE(self->_recommends);
+        upgoff = PyList_GET_SIZE(self->_upgrades);
+        cnfoff = PyList_GET_SIZE(self->_conflicts);
+    } else {
+        CALLMETHOD(self, "reset", NULL);
+        ret = Cache__reload(self, NULL);
+        if (ret == NULL)
+            return NULL;
+        Py_DECREF(ret);
+    }
+    /* Name indexes are out of date until linked again. */
+    self->_linked = 0;
 
     prog = PyObject_CallMethod(getIface(), "getProgress", "OO",
                                self, Py_False);
@@ -2941,32 +3065,71 @@ Cache_load(CacheObject *self, PyObject *args)
     CALLMETHOD(prog, "setTopic", "O", _("Updating cache..."));
     CALLMETHOD(prog, "set", "ii", 0, 1);
     CALLMETHOD(prog, "show", NULL);
+    pending = PyList_New(0);
     len = PyList_GET_SIZE(self->_loaders);
     for (i = 0; i != len; i++) {
         PyObject *loader = PyList_GET_ITEM(self->_loaders, i);
         if (PyList_GET_SIZE(((LoaderObject *)loader)->_packages) == 0) {
             PyObject *res = PyObject_CallMethod(loader, "getLoadSteps", NULL);
             if (!res) {
+                Py_DECREF(pending);
                 Py_DECREF(prog);
                 return NULL;
             }
             total += PyInt_AsLong(res);
             Py_DECREF(res);
+            PyList_Append(pending, loader);
         }
     }
     CALLMETHOD(prog, "set", "ii", 0, total);
     CALLMETHOD(prog, "show", NULL);
-    len = PyList_GET_SIZE(self->_loaders);
-    for (i = 0; i != len; i++) {
-        PyObject *loader = PyList_GET_ITEM(self->_loaders, i);
-        if (PyList_GET_SIZE(((LoaderObject *)loader)->_packages) == 0)
-            CALLMETHOD(loader, "load", NULL);
+    ret = PyObject_CallMethod(getSysConf(), "get", "si", "load-jobs", 1);
+    if (!ret) {
+        Py_DECREF(pending);
+        Py_DECREF(prog);
+        return NULL;
     }
+    jobs = PyInt_AsLong(ret);
+    Py_DECREF(ret);
+    len = PyList_GET_SIZE(pending);
+    if (jobs > 1 && len > 1) {
+        PyObject *module = PyImport_ImportModule("smart.loadpool");
+        if (!module) {
+            Py_DECREF(pending);
+            Py_DECREF(prog);
+            return NULL;
+        }
+        ret = PyObject_CallMethod(module, "loadInParallel", "OOi",
+                                  self, pending, jobs);
+        Py_DECREF(module);
+        if (!ret) {
+            Py_DECREF(pending);
+            Py_DECREF(prog);
+            return NULL;
+        }
+        Py_DECREF(ret);
+    } else {
+        for (i = 0; i != len; i++) {
+            PyObject *loader = PyList_GET_ITEM(pending, i);
+            ret = PyObject_CallMethod(loader, "load", NULL);
+            if (!ret) {
+                Py_DECREF(pending);
+                Py_DECREF(prog);
+                return NULL;
+            }
+            Py_DECREF(ret);
+        }
+    }
+    Py_DECREF(pending);
     CALLMETHOD(self, "loadFileProvides", NULL);
     hooks = getHooks();
     CALLMETHOD(hooks, "call", "sO", "cache-loaded-pre-link", self);
-    PyDict_Clear(self->_objmap);
-    CALLMETHOD(self, "linkDeps", NULL);
+    if (linked)
+        CALLMETHOD(self, "linkNewDeps", "iiiiii",
+                   pkgoff, prvoff, reqoff, recoff, upgoff, cnfoff);
+    else
+        CALLMETHOD(self, "linkDeps", NULL);
+    self->_linked = 1;
     CALLMETHOD(prog, "setDone", NULL);
     CALLMETHOD(prog, "show", NULL);
     CALLMETHOD(prog, "stop", NULL);
@@ -3008,466 +3171,656 @@ Cache_loadFileProvides(CacheObject *self, PyObject *args)
     Py_RETURN_NONE;
 }
 
-PyObject *
-Cache_linkDeps(CacheObject *self, PyObject *args)
+static void
+list_remove_item(PyObject *lst, PyObject *item)
 {
-    int i, j, len;
-    PyObject *reqnames, *recnames, *upgnames, *cnfnames;
-    PyObject *lst;
-
-    /* reqnames = {} */
-    reqnames = PyDict_New();
-    /* for req in self._requires: */
-    len = PyList_GET_SIZE(self->_requires);
+    int i, len;
+    len = PyList_GET_SIZE(lst);
     for (i = 0; i != len; i++) {
-        PyObject *req = PyList_GET_ITEM(self->_requires, i);
-
-        /* for name in req.getMatchNames(): */
-        PyObject *names = PyObject_CallMethod(req, "getMatchNames", NULL);
-        PyObject *seq = PySequence_Fast(names, "getMatchNames() returned "
-                                               "non-sequence object");
-        int nameslen;
-        if (!seq) return NULL;
-        nameslen = PySequence_Fast_GET_SIZE(seq);
-        for (j = 0; j != nameslen; j++) {
-            PyObject *name = PySequence_Fast_GET_ITEM(seq, j);
-            
-            /* lst = reqnames.get(name) */
-            lst = PyDict_GetItem(reqnames, name);
-
-            /* 
-               if lst:
-                   lst.append(req)
-               else:
-                   reqnames[name] = [req]
-            */
-            if (lst) {
-                PyList_Append(lst, req);
-            } else {
-                lst = PyList_New(1);
-                Py_INCREF(req);
-                PyList_SET_ITEM(lst, 0, req);
-                PyDict_SetItem(reqnames, name, lst);
-                Py_DECREF(lst);
-            }
+        if (PyList_GET_ITEM(lst, i) == item) {
+            PyList_SetSlice(lst, i, i+1, (PyObject *)NULL);
+            break;
         }
+    }
+}
 
-        Py_DECREF(names);
-        Py_DECREF(seq);
+static void
+index_append(PyObject *index, PyObject *name, PyObject *obj)
+{
+    /* lst = index.get(name) */
+    PyObject *lst = PyDict_GetItem(index, name);
+    /*
+       if lst:
+           lst.append(obj)
+       else:
+           index[name] = [obj]
+    */
+    if (lst) {
+        PyList_Append(lst, obj);
+    } else {
+        lst = PyList_New(1);
+        Py_INCREF(obj);
+        PyList_SET_ITEM(lst, 0, obj);
+        PyDict_SetItem(index, name, lst);
+        Py_DECREF(lst);
     }
+}
 
-    /* recnames = {} */
-    recnames = PyDict_New();
-    /* for rec in self._recommends: */
-    len = PyList_GET_SIZE(self->_recommends);
-    for (i = 0; i != len; i++) {
-        PyObject *rec = PyList_GET_ITEM(self->_recommends, i);
-
-        /* for name in rec.getMatchNames(): */
-        PyObject *names = PyObject_CallMethod(rec, "getMatchNames", NULL);
-        PyObject *seq = PySequence_Fast(names, "getMatchNames() returned "
-                                               "non-sequence object");
-        int nameslen;
-        if (!seq) return NULL;
-        nameslen = PySequence_Fast_GET_SIZE(seq);
-        for (j = 0; j != nameslen; j++) {
-            PyObject *name = PySequence_Fast_GET_ITEM(seq, j);
-            
-            /* lst = recnames.get(name) */
-            lst = PyDict_GetItem(recnames, name);
-
-            /* 
-               if lst:
-                   lst.append(rec)
-               else:
-                   recnames[name] = [rec]
-            */
-            if (lst) {
-                PyList_Append(lst, rec);
-            } else {
-                lst = PyList_New(1);
-                Py_INCREF(rec);
-                PyList_SET_ITEM(lst, 0, rec);
-                PyDict_SetItem(recnames, name, lst);
-                Py_DECREF(lst);
-            }
-        }
+static void
+index_remove(PyObject *index, PyObject *name, PyObject *obj)
+{
+    /* lst = index.get(name) */
+    PyObject *lst = PyDict_GetItem(index, name);
+    /*
+       if lst:
+           lst.remove(obj)
+           if not lst:
+               del index[name]
+    */
+    if (lst) {
+        list_remove_item(lst, obj);
+        if (PyList_GET_SIZE(lst) == 0)
+            PyDict_DelItem(index, name);
+    }
+}
 
-        Py_DECREF(names);
-        Py_DECREF(seq);
+static PyObject *
+get_index_names(PyObject *dep)
+{
+    /*
+       Dependencies are indexed by the names they may match, and
+       also by their own name, so that they may be looked up by it.
+
+       names = list(dep.getMatchNames())
+       if dep.name not in names:
+           names.append(dep.name)
+    */
+    PyObject *name = ((DependsObject *)dep)->name;
+    PyObject *names, *lst;
+    int found;
+    names = PyObject_CallMethod(dep, "getMatchNames", NULL);
+    if (!names) return NULL;
+    lst = PySequence_List(names);
+    Py_DECREF(names);
+    if (!lst) return NULL;
+    found = PySequence_Contains(lst, name);
+    if (found == -1) {
+        Py_DECREF(lst);
+        return NULL;
     }
+    if (!found)
+        PyList_Append(lst, name);
+    return lst;
+}
 
-    /* upgnames = {} */
-    upgnames = PyDict_New();
-    /* for upg in self._upgrades: */
-    len = PyList_GET_SIZE(self->_upgrades);
-    for (i = 0; i != len; i++) {
-        PyObject *upg = PyList_GET_ITEM(self->_upgrades, i);
-
-        /* for name in upg.getMatchNames(): */
-        PyObject *names = PyObject_CallMethod(upg, "getMatchNames", NULL);
-        PyObject *seq = PySequence_Fast(names, "getMatchNames() returned "
-                                               "non-sequence object");
-        int nameslen;
-        if (!seq) return NULL;
-        nameslen = PySequence_Fast_GET_SIZE(seq);
-        for (j = 0; j != nameslen; j++) {
-            PyObject *name = PySequence_Fast_GET_ITEM(seq, j);
-            
-            /* lst = upgnames.get(name) */
-            lst = PyDict_GetItem(upgnames, name);
-
-            /* 
-               if lst:
-                   lst.append(upg)
-               else:
-                   upgnames[name] = [upg]
-            */
-            if (lst) {
-                PyList_Append(lst, upg);
-            } else {
-                lst = PyList_New(1);
-                Py_INCREF(upg);
-                PyList_SET_ITEM(lst, 0, upg);
-                PyDict_SetItem(upgnames, name, lst);
-                Py_DECREF(lst);
-            }
-        }
+static int
+index_depends(PyObject *index, PyObject *dep)
+{
+    /* for name in _indexNames(dep): */
+    PyObject *names = get_index_names(dep);
+    int j, nameslen;
+    if (!names) return -1;
+    nameslen = PyList_GET_SIZE(names);
+    for (j = 0; j != nameslen; j++)
+        index_append(index, PyList_GET_ITEM(names, j), dep);
+    Py_DECREF(names);
+    return 0;
+}
 
-        Py_DECREF(names);
-        Py_DECREF(seq);
+static int
+unindex_depends(PyObject *index, PyObject *dep)
+{
+    /* for name in _indexNames(dep): */
+    PyObject *names = get_index_names(dep);
+    int j, nameslen;
+    if (!names) return -1;
+    nameslen = PyList_GET_SIZE(names);
+    for (j = 0; j != nameslen; j++)
+        index_remove(index, PyList_GET_ITEM(names, j), dep);
+    Py_DECREF(names);
+    return 0;
+}
+
+/* Relation kinds, in the order they're linked. */
+#define KIND_REQUIRES   0
+#define KIND_RECOMMENDS 1
+#define KIND_UPGRADES   2
+#define KIND_CONFLICTS  3
+#define KIND_COUNT      4
+
+static PyObject **
+Provides_by(ProvidesObject *prv, int kind)
+{
+    switch (kind) {
+        case KIND_REQUIRES: return &prv->requiredby;
+        case KIND_RECOMMENDS: return &prv->recommendedby;
+        case KIND_UPGRADES: return &prv->upgradedby;
+        default: return &prv->conflictedby;
     }
+}
 
-    /* cnfnames = {} */
-    cnfnames = PyDict_New();
-    /* for cnf in self._conflicts: */
-    len = PyList_GET_SIZE(self->_conflicts);
-    for (i = 0; i != len; i++) {
-        PyObject *cnf = PyList_GET_ITEM(self->_conflicts, i);
-
-        /* for name in cnf.getMatchNames(): */
-        PyObject *names = PyObject_CallMethod(cnf, "getMatchNames", NULL);
-        PyObject *seq = PySequence_Fast(names, "getMatchNames() returned "
-                                               "non-sequence object");
-        int nameslen;
-        if (!seq) return NULL;
-        nameslen = PySequence_Fast_GET_SIZE(seq);
-        for (j = 0; j != nameslen; j++) {
-            PyObject *name = PySequence_Fast_GET_ITEM(seq, j);
-            
-            /* lst = cnfnames.get(name) */
-            lst = PyDict_GetItem(cnfnames, name);
-
-            /* 
-               if lst:
-                   lst.append(cnf)
-               else:
-                   cnfnames[name] = [cnf]
-            */
-            if (lst) {
-                PyList_Append(lst, cnf);
-            } else {
-                lst = PyList_New(1);
-                Py_INCREF(cnf);
-                PyList_SET_ITEM(lst, 0, cnf);
-                PyDict_SetItem(cnfnames, name, lst);
-                Py_DECREF(lst);
-            }
-        }
+static void
+link_depends(DependsObject *dep, ProvidesObject *prv, int kind)
+{
+    PyObject **by = Provides_by(prv, kind);
 
-        Py_DECREF(names);
-        Py_DECREF(seq);
+    /*
+       if dep.providedby:
+           dep.providedby.append(prv)
+       else:
+           dep.providedby = [prv]
+    */
+    if (PyList_Check(dep->providedby)) {
+        PyList_Append(dep->providedby, (PyObject *)prv);
+    } else {
+        PyObject *_lst = PyList_New(1);
+        Py_INCREF(prv);
+        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
+        Py_DECREF(dep->providedby);
+        dep->providedby = _lst;
     }
 
-    /* for prv in self._provides: */
-    len = PyList_GET_SIZE(self->_provides);
+    /*
+       if prv.requiredby:
+           prv.requiredby.append(dep)
+       else:
+           prv.requiredby = [dep]
+       (and likewise for recommendedby, upgradedby and conflictedby)
+    */
+    if (PyList_Check(*by)) {
+        PyList_Append(*by, (PyObject *)dep);
+    } else {
+        PyObject *_lst = PyList_New(1);
+        Py_INCREF(dep);
+        PyList_SET_ITEM(_lst, 0, (PyObject *)dep);
+        Py_DECREF(*by);
+        *by = _lst;
+    }
+}
+
+static int
+link_matching(PyObject *deps, ProvidesObject *prv, int kind)
+{
+    int j, len;
+    /* for dep in deps: */
+    len = PyList_GET_SIZE(deps);
+    for (j = 0; j != len; j++) {
+        DependsObject *dep = (DependsObject *)PyList_GET_ITEM(deps, j);
+        /* if dep.matches(prv): */
+        PyObject *ret = PyObject_CallMethod((PyObject *)dep, "matches",
+                                            "O", (PyObject *)prv);
+        if (!ret) return -1;
+        if (PyObject_IsTrue(ret))
+            link_depends(dep, prv, kind);
+        Py_DECREF(ret);
+    }
+    return 0;
+}
+
+PyObject *
+Cache_unlinkPackages(CacheObject *self, PyObject *packages)
+{
+    PyObject *deplists[KIND_COUNT];
+    PyObject *indexes[KIND_COUNT];
+    PyObject *caches[6];
+    PyObject *loaders, *dead, *seq;
+    int i, len, kind;
+
+    indexes[KIND_REQUIRES] = self->_reqnames;
+    indexes[KIND_RECOMMENDS] = self->_recnames;
+    indexes[KIND_UPGRADES] = self->_upgnames;
+    indexes[KIND_CONFLICTS] = self->_cnfnames;
+
+    /* loaders = dict.fromkeys(self._loaders, True) */
+    loaders = PyDict_New();
+    if (!loaders) return NULL;
+    len = PyList_GET_SIZE(self->_loaders);
+    for (i = 0; i != len; i++)
+        PyDict_SetItem(loaders, PyList_GET_ITEM(self->_loaders, i), Py_True);
+
+    /* dead = {} */
+    dead = PyDict_New();
+    if (!dead) {
+        Py_DECREF(loaders);
+        return NULL;
+    }
+
+    seq = PySequence_Fast(packages, "packages must be a sequence");
+    if (!seq) goto error;
+
+    /* for pkg in packages: */
+    len = PySequence_Fast_GET_SIZE(seq);
     for (i = 0; i != len; i++) {
-        ProvidesObject *prv;
-
-        prv = (ProvidesObject *)PyList_GET_ITEM(self->_provides, i);
-
-        /* lst = reqnames.get(prv.name) */
-        lst = PyDict_GetItem(reqnames, prv->name);
-
-        /* if lst: */
-        if (lst) {
-            /* for req in lst: */
-            int reqlen = PyList_GET_SIZE(lst);
-            for (j = 0; j != reqlen; j++) {
-                DependsObject *req = (DependsObject *)PyList_GET_ITEM(lst, j);
-                /* if req.matches(prv): */
-                PyObject *ret = PyObject_CallMethod((PyObject *)req, "matches",
-                                                    "O", (PyObject *)prv);
-                if (!ret) return NULL;
-                if (PyObject_IsTrue(ret)) {
-                    /*
-                       if req.providedby:
-                           req.providedby.append(prv)
-                       else:
-                           req.providedby = [prv]
-                    */
-                    if (PyList_Check(req->providedby)) {
-                        PyList_Append(req->providedby, (PyObject *)prv);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(prv);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
-                        Py_DECREF(req->providedby);
-                        req->providedby = _lst;
-                    }
+        PackageObject *pkg = (PackageObject *)PySequence_Fast_GET_ITEM(seq, i);
+        PyObject *keys, *args, *lst;
+        int j, jlen;
 
-                    /*
-                       if prv.requiredby:
-                           prv.requiredby.append(prv)
-                       else:
-                           prv.requiredby = [prv]
-                    */
-                    if (PyList_Check(prv->requiredby)) {
-                        PyList_Append(prv->requiredby, (PyObject *)req);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(req);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)req);
-                        Py_DECREF(prv->requiredby);
-                        prv->requiredby = _lst;
-                    }
+        if (!PyObject_IsInstance((PyObject *)pkg, (PyObject *)&Package_Type)) {
+            PyErr_SetString(PyExc_TypeError,
+                            "Package is not a Package instance");
+            goto error;
+        }
+
+        /* if pkg in dead: continue */
+        if (PyDict_GetItem(dead, (PyObject *)pkg))
+            continue;
+
+        /*
+           for pkgloader in pkg.loaders.keys():
+               if pkgloader not in loaders:
+                   del pkg.loaders[pkgloader]
+        */
+        keys = PyDict_Keys(pkg->loaders);
+        if (!keys) goto error;
+        jlen = PyList_GET_SIZE(keys);
+        for (j = 0; j != jlen; j++) {
+            PyObject *pkgloader = PyList_GET_ITEM(keys, j);
+            if (!PyDict_GetItem(loaders, pkgloader))
+                PyDict_DelItem(pkg->loaders, pkgloader);
+        }
+        Py_DECREF(keys);
+
+        /* if pkg.loaders: */
+        if (PyDict_Size(pkg->loaders) != 0) {
+            /*
+               pkg.installed = False
+               for pkgloader in pkg.loaders:
+                   pkg.installed |= pkgloader._installed
+            */
+            PyObject *installed = Py_False;
+            PyObject *pkgloader, *info;
+            Py_ssize_t pos = 0;
+            while (PyDict_Next(pkg->loaders, &pos, &pkgloader, &info)) {
+                if (((LoaderObject *)pkgloader)->_installed == Py_True) {
+                    installed = Py_True;
+                    break;
                 }
-                Py_DECREF(ret);
             }
+            Py_INCREF(installed);
+            Py_DECREF(pkg->installed);
+            pkg->installed = installed;
+            continue;
         }
 
-        /* lst = recnames.get(prv.name) */
-        lst = PyDict_GetItem(recnames, prv->name);
-
-        /* if lst: */
-        if (lst) {
-            /* for rec in lst: */
-            int reclen = PyList_GET_SIZE(lst);
-            for (j = 0; j != reclen; j++) {
-                DependsObject *rec = (DependsObject *)PyList_GET_ITEM(lst, j);
-                /* if rec.matches(prv): */
-                PyObject *ret = PyObject_CallMethod((PyObject *)rec, "matches",
-                                                    "O", (PyObject *)prv);
-                if (!ret) return NULL;
-                if (PyObject_IsTrue(ret)) {
-                    /*
-                       if rec.providedby:
-                           rec.providedby.append(prv)
-                       else:
-                           rec.providedby = [prv]
-                    */
-                    if (PyList_Check(rec->providedby)) {
-                        PyList_Append(rec->providedby, (PyObject *)prv);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(prv);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
-                        Py_DECREF(rec->providedby);
-                        rec->providedby = _lst;
-                    }
+        /* dead[pkg] = True */
+        PyDict_SetItem(dead, (PyObject *)pkg, Py_True);
 
-                    /*
-                       if prv.recommendedby:
-                           prv.recommendedby.append(prv)
-                       else:
-                           prv.recommendedby = [prv]
-                    */
-                    if (PyList_Check(prv->recommendedby)) {
-                        PyList_Append(prv->recommendedby, (PyObject *)rec);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(rec);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)rec);
-                        Py_DECREF(prv->recommendedby);
-                        prv->recommendedby = _lst;
-                    }
+        /* self._pkgnames[pkg.name].remove(pkg) */
+        index_remove(self->_pkgnames, pkg->name, (PyObject *)pkg);
+
+        /* objmap[pkg.getInitArgs()].remove(pkg) */
+        args = PyObject_CallMethod((PyObject *)pkg, "getInitArgs", NULL);
+        if (!args) goto error;
+        index_remove(self->_objmap, args, (PyObject *)pkg);
+        Py_DECREF(args);
+
+        /* for prv in pkg.provides: */
+        jlen = PyList_Check(pkg->provides) ?
+               PyList_GET_SIZE(pkg->provides) : 0;
+        for (j = 0; j != jlen; j++) {
+            ProvidesObject *prv =
+                (ProvidesObject *)PyList_GET_ITEM(pkg->provides, j);
+
+            /* prv.packages.remove(pkg) */
+            list_remove_item(prv->packages, (PyObject *)pkg);
+            if (PyList_GET_SIZE(prv->packages) != 0)
+                continue;
+
+            /* dead[prv] = True */
+            PyDict_SetItem(dead, (PyObject *)prv, Py_True);
+
+            /*
+               for dep in prv.requiredby:
+                   dep.providedby.remove(prv)
+               del prv.requiredby[:]
+               (and likewise for the other relation kinds)
+            */
+            for (kind = 0; kind != KIND_COUNT; kind++) {
+                PyObject *by = *Provides_by(prv, kind);
+                int k, klen;
+                if (!PyList_Check(by))
+                    continue;
+                klen = PyList_GET_SIZE(by);
+                for (k = 0; k != klen; k++) {
+                    DependsObject *dep =
+                        (DependsObject *)PyList_GET_ITEM(by, k);
+                    if (PyList_Check(dep->providedby))
+                        list_remove_item(dep->providedby, (PyObject *)prv);
                 }
-                Py_DECREF(ret);
+                LIST_CLEAR(by);
             }
+
+            /* self._prvnames[prv.name].remove(prv) */
+            index_remove(self->_prvnames, prv->name, (PyObject *)prv);
+
+            /*
+               if objmap.get(prv.getInitArgs()) is prv:
+                   del objmap[prv.getInitArgs()]
+            */
+            args = PyObject_CallMethod((PyObject *)prv, "getInitArgs", NULL);
+            if (!args) goto error;
+            if (PyDict_GetItem(self->_objmap, args) == (PyObject *)prv)
+                PyDict_DelItem(self->_objmap, args);
+            Py_DECREF(args);
         }
 
-        /* lst = upgnames.get(prv.name) */
-        lst = PyDict_GetItem(upgnames, prv->name);
-
-        /* if lst: */
-        if (lst) {
-
-            /* for upg in lst: */
-            int upglen = PyList_GET_SIZE(lst);
-            for (j = 0; j != upglen; j++) {
-                DependsObject *upg = (DependsObject *)PyList_GET_ITEM(lst, j);
-                /* if upg.matches(prv): */
-                PyObject *ret = PyObject_CallMethod((PyObject *)upg, "matches",
-                                                    "O", (PyObject *)prv);
-                if (!ret) return NULL;
-                if (PyObject_IsTrue(ret)) {
-                    /*
-                       if upg.providedby:
-                           upg.providedby.append(prv)
-                       else:
-                           upg.providedby = [prv]
-                    */
-                    if (PyList_Check(upg->providedby)) {
-                        PyList_Append(upg->providedby, (PyObject *)prv);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(prv);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
-                        Py_DECREF(upg->providedby);
-                        upg->providedby = _lst;
-                    }
+        deplists[KIND_REQUIRES] = pkg->requires;
+        deplists[KIND_RECOMMENDS] = pkg->recommends;
+        deplists[KIND_UPGRADES] = pkg->upgrades;
+        deplists[KIND_CONFLICTS] = pkg->conflicts;
+        for (kind = 0; kind != KIND_COUNT; kind++) {
+            /* for dep in pkg.requires: */
+            lst = deplists[kind];
+            jlen = PyList_Check(lst) ? PyList_GET_SIZE(lst) : 0;
+            for (j = 0; j != jlen; j++) {
+                DependsObject *dep = (DependsObject *)PyList_GET_ITEM(lst, j);
+                int k, klen;
+
+                /* dep.packages.remove(pkg) */
+                list_remove_item(dep->packages, (PyObject *)pkg);
+                if (PyList_GET_SIZE(dep->packages) != 0)
+                    continue;
+
+                /* dead[dep] = True */
+                PyDict_SetItem(dead, (PyObject *)dep, Py_True);
 
-                    /*
-                       if prv.upgradedby:
-                           prv.upgradedby.append(prv)
-                       else:
-                           prv.upgradedby = [prv]
-                    */
-                    if (PyList_Check(prv->upgradedby)) {
-                        PyList_Append(prv->upgradedby, (PyObject *)upg);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(upg);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)upg);
-                        Py_DECREF(prv->upgradedby);
-                        prv->upgradedby = _lst;
+                /*
+                   for prv in dep.providedby:
+                       prv.requiredby.remove(dep)
+                   del dep.providedby[:]
+                */
+                if (PyList_Check(dep->providedby)) {
+                    klen = PyList_GET_SIZE(dep->providedby);
+                    for (k = 0; k != klen; k++) {
+                        ProvidesObject *prv = (ProvidesObject *)
+                            PyList_GET_ITEM(dep->providedby, k);
+                        PyObject *by = *Provides_by(prv, kind);
+                        if (PyList_Check(by))
+                            list_remove_item(by, (PyObject *)dep);
                     }
+                    LIST_CLEAR(dep->providedby);
                 }
-                Py_DECREF(ret);
+
+                /*
+                   for name in _indexNames(dep):
+                       reqnames[name].remove(dep)
+                */
+                if (unindex_depends(indexes[kind], (PyObject *)dep) == -1)
+                    goto error;
+
+                /*
+                   if objmap.get(dep.getInitArgs()) is dep:
+                       del objmap[dep.getInitArgs()]
+                */
+                args = PyObject_CallMethod((PyObject *)dep,
+                                           "getInitArgs", NULL);
+                if (!args) goto error;
+                if (PyDict_GetItem(self->_objmap, args) == (PyObject *)dep)
+                    PyDict_DelItem(self->_objmap, args);
+                Py_DECREF(args);
             }
         }
+    }
 
-        /* lst = cnfnames.get(prv.name) */
-        lst = PyDict_GetItem(cnfnames, prv->name);
-
-        /* if lst: */
-        if (lst) {
-
-            /* for cnf in lst: */
-            int cnflen = PyList_GET_SIZE(lst);
-            for (j = 0; j != cnflen; j++) {
-                DependsObject *cnf = (DependsObject *)PyList_GET_ITEM(lst, j);
-                /* if cnf.matches(prv): */
-                PyObject *ret = PyObject_CallMethod((PyObject *)cnf, "matches",
-                                                    "O", (PyObject *)prv);
-                if (!ret) return NULL;
-                if (PyObject_IsTrue(ret)) {
-                    /*
-                       if cnf.providedby:
-                           cnf.providedby.append(prv)
-                       else:
-                           cnf.providedby = [prv]
-                    */
-                    if (PyList_Check(cnf->providedby)) {
-                        PyList_Append(cnf->providedby, (PyObject *)prv);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(prv);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
-                        Py_DECREF(cnf->providedby);
-                        cnf->providedby = _lst;
-                    }
-
-                    /*
-                       if prv.conflictedby:
-                           prv.conflictedby.append(prv)
-                       else:
-                           prv.conflictedby = [prv]
-                    */
-                    if (PyList_Check(prv->conflictedby)) {
-                        PyList_Append(prv->conflictedby, (PyObject *)cnf);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(cnf);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)cnf);
-                        Py_DECREF(prv->conflictedby);
-                        prv->conflictedby = _lst;
+    /*
+       if dead:
+           self._packages[:] = [x for x in self._packages if x not in dead]
+           (and likewise for the relation lists)
+    */
+    if (PyDict_Size(dead) != 0) {
+        caches[0] = self->_packages;
+        caches[1] = self->_provides;
+        caches[2] = self->_requires;
+        caches[3] = self->_recommends;
+        caches[4] = self->_upgrades;
+        caches[5] = self->_conflicts;
+        for (i = 0; i != 6; i++) {
+            PyObject *lst = caches[i];
+            int j, k, jlen;
+            jlen = PyList_GET_SIZE(lst);
+            for (j = 0, k = 0; j != jlen; j++) {
+                PyObject *item = PyList_GET_ITEM(lst, j);
+                if (!PyDict_GetItem(dead, item)) {
+                    if (j != k) {
+                        /* Move the reference down. */
+                        PyObject *old = PyList_GET_ITEM(lst, k);
+                        Py_INCREF(item);
+                        PyList_SET_ITEM(lst, k, item);
+                        Py_DECREF(old);
                     }
+                    k++;
                 }
-                Py_DECREF(ret);
             }
+            PyList_SetSlice(lst, k, jlen, (PyObject *)NULL);
         }
     }
 
-    Py_DECREF(reqnames);
-    Py_DECREF(recnames);
-    Py_DECREF(upgnames);
-    Py_DECREF(cnfnames);
-
+    Py_DECREF(seq);
+    Py_DECREF(loaders);
+    Py_DECREF(dead);
     Py_RETURN_NONE;
+
+error:
+    Py_XDECREF(seq);
+    Py_DECREF(loaders);
+    Py_DECREF(dead);
+    return NULL;
 }
 
 PyObject *
-Cache_getPackages(CacheObject *self, PyObject *args)
+Cache_indexDeps(CacheObject *self, PyObject *args)
 {
-    const char *name = NULL;
-    PyObject *lst;
-    int i, len;
-    if (!PyArg_ParseTuple(args, "|s", &name))
-        return NULL;
-    if (!name) {
-        Py_INCREF(self->_packages);
-        return self->_packages;
-    }
-    lst = PyList_New(0);
+    PyObject *deplists[KIND_COUNT];
+    PyObject *indexes[KIND_COUNT];
+    int i, len, kind;
+
+    deplists[KIND_REQUIRES] = self->_requires;
+    deplists[KIND_RECOMMENDS] = self->_recommends;
+    deplists[KIND_UPGRADES] = self->_upgrades;
+    deplists[KIND_CONFLICTS] = self->_conflicts;
+    indexes[KIND_REQUIRES] = self->_reqnames;
+    indexes[KIND_RECOMMENDS] = self->_recnames;
+    indexes[KIND_UPGRADES] = self->_upgnames;
+    indexes[KIND_CONFLICTS] = self->_cnfnames;
+
+    /*
+       pkgnames = self._pkgnames
+       pkgnames.clear()
+       for pkg in self._packages:
+           pkgnames.setdefault(pkg.name, []).append(pkg)
+    */
+    PyDict_Clear(self->_pkgnames);
     len = PyList_GET_SIZE(self->_packages);
     for (i = 0; i != len; i++) {
         PackageObject *pkg =
-            (PackageObject*)PyList_GET_ITEM(self->_packages, i);
-        if (strcmp(STR(pkg->name), name) == 0)
-            PyList_Append(lst, (PyObject *)pkg);
+            (PackageObject *)PyList_GET_ITEM(self->_packages, i);
+        index_append(self->_pkgnames, pkg->name, (PyObject *)pkg);
     }
-    return lst;
+
+    /*
+       prvnames = self._prvnames
+       prvnames.clear()
+       for prv in self._provides:
+           prvnames.setdefault(prv.name, []).append(prv)
+    */
+    PyDict_Clear(self->_prvnames);
+    len = PyList_GET_SIZE(self->_provides);
+    for (i = 0; i != len; i++) {
+        ProvidesObject *prv =
+            (ProvidesObject *)PyList_GET_ITEM(self->_provides, i);
+        index_append(self->_prvnames, prv->name, (PyObject *)prv);
+    }
+
+    /*
+       reqnames = self._reqnames
+       reqnames.clear()
+       for req in self._requires:
+           for name in _indexNames(req):
+               reqnames.setdefault(name, []).append(req)
+       (and likewise for recommends, upgrades and conflicts)
+    */
+    for (kind = 0; kind != KIND_COUNT; kind++) {
+        PyDict_Clear(indexes[kind]);
+        len = PyList_GET_SIZE(deplists[kind]);
+        for (i = 0; i != len; i++) {
+            if (index_depends(indexes[kind],
+                              PyList_GET_ITEM(deplists[kind], i)) == -1)
+                return NULL;
+        }
+    }
+
+    Py_RETURN_NONE;
 }
 
 PyObject *
-Cache_getProvides(CacheObject *self, PyObject *args)
+Cache_linkDeps(CacheObject *self, PyObject *args)
 {
-    const char *name = NULL;
-    PyObject *lst;
-    int i, len;
-    if (!PyArg_ParseTuple(args, "|s", &name))
-        return NULL;
-    if (!name) {
-        Py_INCREF(self->_provides);
-        return self->_provides;
-    }
-    lst = PyList_New(0);
+    PyObject *indexes[KIND_COUNT];
+    PyObject *ret;
+    int i, len, kind;
+
+    indexes[KIND_REQUIRES] = self->_reqnames;
+    indexes[KIND_RECOMMENDS] = self->_recnames;
+    indexes[KIND_UPGRADES] = self->_upgnames;
+    indexes[KIND_CONFLICTS] = self->_cnfnames;
+
+    /* self.indexDeps() */
+    ret = Cache_indexDeps(self, NULL);
+    if (!ret) return NULL;
+    Py_DECREF(ret);
+
+    /* for prv in self._provides: */
     len = PyList_GET_SIZE(self->_provides);
     for (i = 0; i != len; i++) {
         ProvidesObject *prv =
-            (ProvidesObject*)PyList_GET_ITEM(self->_provides, i);
-        if (strcmp(STR(prv->name), name) == 0)
-            PyList_Append(lst, (PyObject *)prv);
+            (ProvidesObject *)PyList_GET_ITEM(self->_provides, i);
+        /*
+           for req in reqnames.get(prv.name, ()):
+               if req.matches(prv):
+                   link req and prv
+           (and likewise for recommends, upgrades and conflicts)
+        */
+        for (kind = 0; kind != KIND_COUNT; kind++) {
+            PyObject *lst = PyDict_GetItem(indexes[kind], prv->name);
+            if (lst && link_matching(lst, prv, kind) == -1)
+                return NULL;
+        }
     }
-    return lst;
+
+    Py_RETURN_NONE;
 }
 
 PyObject *
-Cache_getRequires(CacheObject *self, PyObject *args)
+Cache_linkNewDeps(CacheObject *self, PyObject *args)
 {
-    const char *name = NULL;
-    PyObject *lst;
-    int i, len;
-    if (!PyArg_ParseTuple(args, "|s", &name))
+    PyObject *deplists[KIND_COUNT];
+    PyObject *indexes[KIND_COUNT];
+    int offsets[KIND_COUNT];
+    int pkgoff, prvoff;
+    int i, j, len, kind;
+
+    if (!PyArg_ParseTuple(args, "iiiiii", &pkgoff, &prvoff,
+                          &offsets[KIND_REQUIRES], &offsets[KIND_RECOMMENDS],
+                          &offsets[KIND_UPGRADES], &offsets[KIND_CONFLICTS]))
         return NULL;
-    if (!name) {
-        Py_INCREF(self->_requires);
-        return self->_requires;
+
+    deplists[KIND_REQUIRES] = self->_requires;
+    deplists[KIND_RECOMMENDS] = self->_recommends;
+    deplists[KIND_UPGRADES] = self->_upgrades;
+    deplists[KIND_CONFLICTS] = self->_conflicts;
+    indexes[KIND_REQUIRES] = self->_reqnames;
+    indexes[KIND_RECOMMENDS] = self->_recnames;
+    indexes[KIND_UPGRADES] = self->_upgnames;
+    indexes[KIND_CONFLICTS] = self->_cnfnames;
+
+    /*
+       New packages and relations are at the end of the cache lists.
+       First link new dependencies against the provides already
+       known, and then link new provides against every dependency.
+    */
+
+    /* for pkg in self._packages[pkgoff:]: */
+    len = PyList_GET_SIZE(self->_packages);
+    for (i = pkgoff; i < len; i++) {
+        PackageObject *pkg =
+            (PackageObject *)PyList_GET_ITEM(self->_packages, i);
+        /* pkgnames.setdefault(pkg.name, []).append(pkg) */
+        index_append(self->_pkgnames, pkg->name, (PyObject *)pkg);
     }
-    lst = PyList_New(0);
-    len = PyList_GET_SIZE(self->_requires);
-    for (i = 0; i != len; i++) {
-        DependsObject *req =
-            (DependsObject*)PyList_GET_ITEM(self->_requires, i);
-        if (strcmp(STR(req->name), name) == 0)
-            PyList_Append(lst, (PyObject *)req);
+
+    for (kind = 0; kind != KIND_COUNT; kind++) {
+        len = PyList_GET_SIZE(deplists[kind]);
+        /* for dep in self._requires[reqoff:]: */
+        for (i = offsets[kind]; i < len; i++) {
+            DependsObject *dep =
+                (DependsObject *)PyList_GET_ITEM(deplists[kind], i);
+            PyObject *seq;
+            int nameslen;
+
+            /* for name in _indexNames(dep): */
+            seq = get_index_names((PyObject *)dep);
+            if (!seq) return NULL;
+            nameslen = PyList_GET_SIZE(seq);
+            for (j = 0; j != nameslen; j++) {
+                PyObject *name = PyList_GET_ITEM(seq, j);
+                /*
+                   for prv in prvnames.get(name, ()):
+                       if dep.matches(prv):
+                           link dep and prv
+                */
+                PyObject *lst = PyDict_GetItem(self->_prvnames, name);
+                if (lst) {
+                    int k, klen = PyList_GET_SIZE(lst);
+                    for (k = 0; k != klen; k++) {
+                        ProvidesObject *prv =
+                            (ProvidesObject *)PyList_GET_ITEM(lst, k);
+                        PyObject *ret =
+                            PyObject_CallMethod((PyObject *)dep, "matches",
+                                                "O", (PyObject *)prv);
+                        if (!ret) {
+                            Py_DECREF(seq);
+                            return NULL;
+                        }
+                        if (PyObject_IsTrue(ret))
+                            link_depends(dep, prv, kind);
+                        Py_DECREF(ret);
+                    }
+                }
+                /* reqnames.setdefault(name, []).append(dep) */
+                index_append(indexes[kind], name, (PyObject *)dep);
+            }
+            Py_DECREF(seq);
+        }
     }
-    return lst;
+
+    /* for prv in self._provides[prvoff:]: */
+    len = PyList_GET_SIZE(self->_provides);
+    for (i = prvoff; i < len; i++) {
+        ProvidesObject *prv =
+            (ProvidesObject *)PyList_GET_ITEM(self->_provides, i);
+
+        /* prvnames.setdefault(prv.name, []).append(prv) */
+        index_append(self->_prvnames, prv->name, (PyObject *)prv);
+
+        for (kind = 0; kind != KIND_COUNT; kind++) {
+            PyObject *lst = PyDict_GetItem(indexes[kind], prv->name);
+            if (lst && link_matching(lst, prv, kind) == -1)
+                return NULL;
+        }
+    }
+
+    Py_RETURN_NONE;
 }
 
-PyObject *
-Cache_getRecommends(CacheObject *self, PyObject *args)
+/* Packages and relations all start with their name. */
+typedef struct {
+    PyObject_HEAD
+    PyObject *name;
+} NamedObject;
+
+static PyObject *
+Cache_getNamed(CacheObject *self, PyObject *args,
+               PyObject *objs, PyObject *index)
 {
     const char *name = NULL;
     PyObject *lst;
@@ -3475,64 +3828,169 @@ Cache_getRecommends(CacheObject *self, PyObject *args)
     if (!PyArg_ParseTuple(args, "|s", &name))
         return NULL;
     if (!name) {
-        Py_INCREF(self->_recommends);
-        return self->_recommends;
+        Py_INCREF(objs);
+        return objs;
     }
     lst = PyList_New(0);
-    len = PyList_GET_SIZE(self->_recommends);
+    if (self->_linked) {
+        /* objs = index.get(name, ()) */
+        PyObject *key = PyString_FromString(name);
+        if (!key) {
+            Py_DECREF(lst);
+            return NULL;
+        }
+        objs = PyDict_GetItem(index, key);
+        Py_DECREF(key);
+        if (!objs)
+            return lst;
+    }
+    /* return [x for x in objs if x.name == name] */
+    len = PyList_GET_SIZE(objs);
     for (i = 0; i != len; i++) {
-        DependsObject *rec =
-            (DependsObject*)PyList_GET_ITEM(self->_recommends, i);
-        if (strcmp(STR(rec->name), name) == 0)
-            PyList_Append(lst, (PyObject *)rec);
+        NamedObject *obj = (NamedObject *)PyList_GET_ITEM(objs, i);
+        if (strcmp(STR(obj->name), name) == 0)
+            PyList_Append(lst, (PyObject *)obj);
     }
     return lst;
 }
 
-PyObject *
-Cache_getUpgrades(CacheObject *self, PyObject *args)
+static PyObject *
+Cache_getByNames(CacheObject *self, PyObject *names,
+                 PyObject *objs, PyObject *index)
 {
-    const char *name = NULL;
-    PyObject *lst;
+    PyObject *result, *seq;
     int i, len;
-    if (!PyArg_ParseTuple(args, "|s", &name))
+
+    seq = PySequence_Fast(names, "names must be a sequence");
+    if (!seq) return NULL;
+    result = PyDict_New();
+    if (!result) {
+        Py_DECREF(seq);
         return NULL;
-    if (!name) {
-        Py_INCREF(self->_upgrades);
-        return self->_upgrades;
     }
-    lst = PyList_New(0);
-    len = PyList_GET_SIZE(self->_upgrades);
-    for (i = 0; i != len; i++) {
-        DependsObject *upg =
-            (DependsObject*)PyList_GET_ITEM(self->_upgrades, i);
-        if (strcmp(STR(upg->name), name) == 0)
-            PyList_Append(lst, (PyObject *)upg);
+
+    if (self->_linked) {
+        /* for name in names: */
+        len = PySequence_Fast_GET_SIZE(seq);
+        for (i = 0; i != len; i++) {
+            PyObject *name = PySequence_Fast_GET_ITEM(seq, i);
+            PyObject *lst = PyDict_GetItem(index, name);
+            int j, jlen;
+            /* if name in result: continue */
+            if (!lst || PyDict_GetItem(result, name))
+                continue;
+            /* lst = [x for x in index.get(name, ()) if x.name == name] */
+            jlen = PyList_GET_SIZE(lst);
+            for (j = 0; j != jlen; j++) {
+                NamedObject *obj = (NamedObject *)PyList_GET_ITEM(lst, j);
+                int cmp = PyObject_RichCompareBool(obj->name, name, Py_EQ);
+                if (cmp == -1)
+                    goto error;
+                if (cmp)
+                    index_append(result, name, (PyObject *)obj);
+            }
+        }
+    } else {
+        /* names = dict.fromkeys(names) */
+        PyObject *nameset = PyDict_New();
+        if (!nameset) goto error;
+        len = PySequence_Fast_GET_SIZE(seq);
+        for (i = 0; i != len; i++)
+            PyDict_SetItem(nameset, PySequence_Fast_GET_ITEM(seq, i),
+                           Py_None);
+        /*
+           for obj in objs:
+               if obj.name in names:
+                   result.setdefault(obj.name, []).append(obj)
+        */
+        len = PyList_GET_SIZE(objs);
+        for (i = 0; i != len; i++) {
+            NamedObject *obj = (NamedObject *)PyList_GET_ITEM(objs, i);
+            if (PyDict_GetItem(nameset, obj->name))
+                index_append(result, obj->name, (PyObject *)obj);
+        }
+        Py_DECREF(nameset);
     }
-    return lst;
+
+    Py_DECREF(seq);
+    return result;
+
+error:
+    Py_DECREF(seq);
+    Py_DECREF(result);
+    return NULL;
+}
+
+PyObject *
+Cache_getPackages(CacheObject *self, PyObject *args)
+{
+    return Cache_getNamed(self, args, self->_packages, self->_pkgnames);
+}
+
+PyObject *
+Cache_getProvides(CacheObject *self, PyObject *args)
+{
+    return Cache_getNamed(self, args, self->_provides, self->_prvnames);
+}
+
+PyObject *
+Cache_getRequires(CacheObject *self, PyObject *args)
+{
+    return Cache_getNamed(self, args, self->_requires, self->_reqnames);
+}
+
+PyObject *
+Cache_getRecommends(CacheObject *self, PyObject *args)
+{
+    return Cache_getNamed(self, args, self->_recommends, self->_recnames);
+}
+
+PyObject *
+Cache_getUpgrades(CacheObject *self, PyObject *args)
+{
+    return Cache_getNamed(self, args, self->_upgrades, self->_upgnames);
 }
 
 PyObject *
 Cache_getConflicts(CacheObject *self, PyObject *args)
 {
-    const char *name = NULL;
-    PyObject *lst;
-    int i, len;
-    if (!PyArg_ParseTuple(args, "|s", &name))
-        return NULL;
-    if (!name) {
-        Py_INCREF(self->_conflicts);
-        return self->_conflicts;
-    }
-    lst = PyList_New(0);
-    len = PyList_GET_SIZE(self->_conflicts);
-    for (i = 0; i != len; i++) {
-        DependsObject *cnf =
-            (DependsObject*)PyList_GET_ITEM(self->_conflicts, i);
-        if (strcmp(STR(cnf->name), name) == 0)
-            PyList_Append(lst, (PyObject *)cnf);
-    }
-    return lst;
+    return Cache_getNamed(self, args, self->_conflicts, self->_cnfnames);
+}
+
+PyObject *
+Cache_getPackagesByNames(CacheObject *self, PyObject *names)
+{
+    return Cache_getByNames(self, names, self->_packages, self->_pkgnames);
+}
+
+PyObject *
+Cache_getProvidesByNames(CacheObject *self, PyObject *names)
+{
+    return Cache_getByNames(self, names, self->_provides, self->_prvnames);
+}
+
+PyObject *
+Cache_getRequiresByNames(CacheObject *self, PyObject *names)
+{
+    return Cache_getByNames(self, names, self->_requires, self->_reqnames);
+}
+
+PyObject *
+Cache_getRecommendsByNames(CacheObject *self, PyObject *names)
+{
+    return Cache_getByNames(self, names, self->_recommends, self->_recnames);
+}
+
+PyObject *
+Cache_getUpgradesByNames(CacheObject *self, PyObject *names)
+{
+    return Cache_getByNames(self, names, self->_upgrades, self->_upgnames);
+}
+
+PyObject *
+Cache_getConflictsByNames(CacheObject *self, PyObject *names)
+{
+    return Cache_getByNames(self, names, self->_conflicts, self->_cnfnames);
 }
 
 PyObject *
@@ -3547,10 +4005,23 @@ Cache_search(CacheObject *self, PyObject *searcher)
         return NULL;
     }
     if (PyList_GET_SIZE(lst) != 0) {
-        for (i = 0; i != PyList_GET_SIZE(self->_packages); i++) {
-            PyObject *pkg = PyList_GET_ITEM(self->_packages, i);
+        PyObject *module = getSearchIndexModule();
+        PyObject *pkgs;
+        if (!module) return NULL;
+        pkgs = PyObject_CallMethod(module, "getSearchPackages", "OO",
+                                   self, searcher);
+        if (!pkgs) return NULL;
+        if (!PyList_Check(pkgs)) {
+            Py_DECREF(pkgs);
+            PyErr_SetString(PyExc_TypeError,
+                            "getSearchPackages() didn't return a list");
+            return NULL;
+        }
+        for (i = 0; i != PyList_GET_SIZE(pkgs); i++) {
+            PyObject *pkg = PyList_GET_ITEM(pkgs, i);
             CALLMETHOD(pkg, "search", "O", searcher);
         }
+        Py_DECREF(pkgs);
     }
     Py_DECREF(lst);
 
@@ -3560,10 +4031,23 @@ Cache_search(CacheObject *self, PyObject *searcher)
         return NULL;
     }
     if (PyList_GET_SIZE(lst) != 0) {
-        for (i = 0; i != PyList_GET_SIZE(self->_provides); i++) {
-            PyObject *prv = PyList_GET_ITEM(self->_provides, i);
+        PyObject *module = getSearchIndexModule();
+        PyObject *prvs;
+        if (!module) return NULL;
+        prvs = PyObject_CallMethod(module, "getSearchProvides", "OO",
+                                   self, searcher);
+        if (!prvs) return NULL;
+        if (!PyList_Check(prvs)) {
+            Py_DECREF(prvs);
+            PyErr_SetString(PyExc_TypeError,
+                            "getSearchProvides() didn't return a list");
+            return NULL;
+        }
+        for (i = 0; i != PyList_GET_SIZE(prvs); i++) {
+            PyObject *prv = PyList_GET_ITEM(prvs, i);
             CALLMETHOD(prv, "search", "O", searcher);
         }
+        Py_DECREF(prvs);
     }
     Py_DECREF(lst);
 
@@ -3874,6 +4358,15 @@ Cache__setstate__(CacheObject *self, PyObject *state)
 
     /* self._objmap = {} */
     self->_objmap = PyDict_New();
+
+    self->_pkgnames = PyDict_New();
+    self->_prvnames = PyDict_New();
+    self->_reqnames = PyDict_New();
+    self->_recnames = PyDict_New();
+    self->_upgnames = PyDict_New();
+    self->_cnfnames = PyDict_New();
+    self->_removed = PyList_New(0);
+    self->_linked = 0;
     
     Py_INCREF(Py_None);
     return Py_None;
@@ -3887,13 +4380,22 @@ static PyMethodDef Cache_methods[] = {
     {"load", (PyCFunction)Cache_load, METH_NOARGS, NULL},
     {"unload", (PyCFunction)Cache_unload, METH_NOARGS, NULL},
     {"loadFileProvides", (PyCFunction)Cache_loadFileProvides, METH_NOARGS, NULL},
+    {"unlinkPackages", (PyCFunction)Cache_unlinkPackages, METH_O, NULL},
+    {"indexDeps", (PyCFunction)Cache_indexDeps, METH_NOARGS, NULL},
     {"linkDeps", (PyCFunction)Cache_linkDeps, METH_VARARGS, NULL},
+    {"linkNewDeps", (PyCFunction)Cache_linkNewDeps, METH_VARARGS, NULL},
     {"getPackages", (PyCFunction)Cache_getPackages, METH_VARARGS, NULL},
     {"getProvides", (PyCFunction)Cache_getProvides, METH_VARARGS, NULL},
     {"getRequires", (PyCFunction)Cache_getRequires, METH_VARARGS, NULL},
     {"getRecommends", (PyCFunction)Cache_getRecommends, METH_VARARGS, NULL},
     {"getUpgrades", (PyCFunction)Cache_getUpgrades, METH_VARARGS, NULL},
     {"getConflicts", (PyCFunction)Cache_getConflicts, METH_VARARGS, NULL},
+    {"getPackagesByNames", (PyCFunction)Cache_getPackagesByNames, METH_O, NULL},
+    {"getProvidesByNames", (PyCFunction)Cache_getProvidesByNames, METH_O, NULL},
+    {"getRequiresByNames", (PyCFunction)Cache_getRequiresByNames, METH_O, NULL},
+    {"getRecommendsByNames", (PyCFunction)Cache_getRecommendsByNames, METH_O, NULL},
+    {"getUpgradesByNames", (PyCFunction)Cache_getUpgradesByNames, METH_O, NULL},
+    {"getConflictsByNames", (PyCFunction)Cache_getConflictsByNames, METH_O, NULL},
     {"search", (PyCFunction)Cache_search, METH_O, NULL},
     {"__getstate__", (PyCFunction)Cache__getstate__, METH_NOARGS, NULL},
     {"__setstate__", (PyCFunction)Cache__setstate__, METH_O, NULL},
@@ -3910,6 +4412,14 @@ static PyMemberDef Cache_members[] = {
     {"_upgrades", T_OBJECT, OFF(_upgrades), RO, 0},
     {"_conflicts", T_OBJECT, OFF(_conflicts), RO, 0},
     {"_objmap", T_OBJECT, OFF(_objmap), RO, 0},
+    {"_pkgnames", T_OBJECT, OFF(_pkgnames), RO, 0},
+    {"_prvnames", T_OBJECT, OFF(_prvnames), RO, 0},
+    {"_reqnames", T_OBJECT, OFF(_reqnames), RO, 0},
+    {"_recnames", T_OBJECT, OFF(_recnames), RO, 0},
+    {"_upgnames", T_OBJECT, OFF(_upgnames), RO, 0},
+    {"_cnfnames", T_OBJECT, OFF(_cnfnames), RO, 0},
+    {"_removed", T_OBJECT, OFF(_removed), RO, 0},
+    {"_linked", T_INT, OFF(_linked), 0, 0},
     {NULL}
 };
 #undef OFF
@@ -0,0 +1,116 @@
+#
+# Copyright (c) 2009 Smart Package Manager Team.
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart.loadpool import RECORD, Worker, readResults
+from smart.interface import Interface
+from smart import *
+import cPickle
+import signal
+import struct
+import os
+
+#
+# Workers are forked once the cache is loaded, so they share it with
+# the parent, and each one checks a contiguous slice of the checkset.
+# The problems found are written back with the same records used by
+# the load pool, with the slice position and the pickled problems.
+#
+
+def splitWeights(weights, parts):
+    """
+    Split positions of the weights list into at most parts contiguous
+    (start, end) slices with about the same total weight each.
+    """
+    total = sum(weights)
+    bounds = []
+    start = 0
+    acc = 0
+    for i, weight in enumerate(weights):
+        acc += weight
+        if acc*parts >= total*(len(bounds)+1) and len(bounds) < parts-1:
+            bounds.append((start, i+1))
+            start = i+1
+    if start < len(weights):
+        bounds.append((start, len(weights)))
+    return bounds
+
+def checkInParallel(check, weights, jobs, report):
+    """
+    Run check(start, end) over slices of the positions of weights,
+    using up to jobs worker processes, and return all the problems
+    in order, as if the whole range was checked at once. Unless
+    report is true, only the first problem found is needed.
+    """
+    bounds = splitWeights(weights, jobs)
+    if len(bounds) < 2 or not hasattr(os, "fork"):
+        return check(0, len(weights))
+
+    workers = {}
+    results = {}
+    try:
+        for i, (start, end) in enumerate(bounds):
+            r, w = os.pipe()
+            pid = os.fork()
+            if not pid:
+                status = 1
+                try:
+                    try:
+                        os.close(r)
+                        for fd in workers:
+                            os.close(fd)
+                        _work(check, i, start, end, w)
+                        status = 0
+                    except:
+                        pass
+                finally:
+                    os._exit(status)
+            os.close(w)
+            workers[r] = Worker(pid)
+        while workers:
+            readResults(workers, results)
+    finally:
+        for fd, worker in workers.items():
+            os.close(fd)
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except OSError:
+                pass
+            worker.wait()
+
+    problems = []
+    for i, (start, end) in enumerate(bounds):
+        data = results.get(i)
+        if data is None:
+            # The worker died, so check that slice here.
+            found = check(start, end)
+        else:
+            found = cPickle.loads(data)
+        problems.extend(found)
+        if found and not report:
+            break
+    return problems
+
+def _work(check, i, start, end, fd):
+    # Only the parent may talk to the real interface.
+    iface.object = Interface(None)
+    data = cPickle.dumps(check(start, end), 2)
+    file = os.fdopen(fd, "wb")
+    file.write(struct.pack(RECORD, i, len(data)))
+    file.write(data)
+    file.close()
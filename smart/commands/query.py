@@ -19,13 +19,15 @@
 # along with Smart Package Manager; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
-from smart.util.strtools import isGlob
+from smart.util.strtools import isGlob, dumpJSON
+from smart.searchindex import getPathPackages, getTextCandidates
 from smart.option import OptionParser
 from smart.cache import Provides, PreRequires, Package
 from smart import *
 import tempfile
 import fnmatch
 import string
+import csv
 import sys
 import os
 import re
@@ -46,6 +48,8 @@ smart query --requires libpkg.so --show-providedby
 smart query --installed
 smart query --summary ldap
 smart query --show-format='Name: $name\tVersion: $version\n'
+smart query --show-all --format=json --output=packages.json
+smart query --installed --format=csv --fields=name,version,summary
 """)
 
 def option_parser(**kwargs):
@@ -132,6 +136,10 @@ def option_parser(**kwargs):
                       metavar="TMPL", help=_("show using string template"))
     parser.add_option("--format", action="store", default="text",
                       metavar="FMT", help=_("change output format"))
+    parser.add_option("--fields", action="store", default=None,
+                      metavar="LIST", help=_("comma separated fields to "
+                                             "show with the json and csv "
+                                             "formats"))
     parser.add_option("--output", action="store", metavar="FILE",
                       help=_("redirect output to given filename"))
     return parser
@@ -161,7 +169,7 @@ def main(ctrl, opts, reloadchannels=True):
 
     cache = ctrl.getCache()
     if not opts.args:
-        packages = cache.getPackages()[:]
+        packages = dict.fromkeys(cache.getPackages(), True)
     else:
         packages = {}
         for arg in opts.args:
@@ -185,44 +193,54 @@ def main(ctrl, opts, reloadchannels=True):
                         packages[obj] = True
                     else:
                         packages.update(dict.fromkeys(obj.packages, True))
-        packages = packages.keys()
+
+    # From here on packages is a dictionary used as a set, and each
+    # filter keeps part of it. Filters computing their matches from
+    # the cache indexes run first, and those needing package info last.
 
     if opts.installed or opts.dupes or opts.leaves or opts.orphans:
-        packages = [pkg for pkg in packages if pkg.installed]
+        packages = dict([(pkg, True) for pkg in packages if pkg.installed])
     if opts.dupes:
-        dupes = []
+        installedby = {}
+        dupes = {}
         for pkg in packages:
-            dupe = False
-            for prv in cache.getProvides(pkg.name):
-                for prvpkg in prv.packages:
-                    if prvpkg == pkg:
-                        continue
-                    if prvpkg.installed:
-                        dupe = True
-            if dupe:
-                dupes.append(pkg)
+            installed = installedby.get(pkg.name)
+            if installed is None:
+                installed = installedby[pkg.name] = {}
+                for prv in cache.getProvides(pkg.name):
+                    for prvpkg in prv.packages:
+                        if prvpkg.installed:
+                            installed[prvpkg] = True
+            for prvpkg in installed:
+                if prvpkg is not pkg:
+                    dupes[pkg] = True
+                    break
         packages = dupes
     if opts.leaves:
-        leaves = []
+        # Walk the requires of installed packages once, instead of
+        # the requiredby of each candidate.
+        required = {}
+        for reqpkg in cache.getPackages():
+            if reqpkg.installed:
+                for req in reqpkg.requires:
+                    for prv in req.providedby:
+                        required[prv] = True
+        leaves = {}
         for pkg in packages:
-            leaf = True
             for prv in pkg.provides:
-                for req in prv.requiredby:
-                    for reqpkg in req.packages:
-                        if reqpkg.installed:
-                            leaf = False
-            if leaf:
-                leaves.append(pkg)
+                if prv in required:
+                    break
+            else:
+                leaves[pkg] = True
         packages = leaves
     if opts.orphans:
-        orphans = []
+        orphans = {}
         for pkg in packages:
-            orphan = True
             for loader in pkg.loaders:
                 if not loader.getInstalled():
-                    orphan = False
-            if orphan:
-                orphans.append(pkg)
+                    break
+            else:
+                orphans[pkg] = True
         packages = orphans
 
     if opts.newest:
@@ -233,60 +251,33 @@ def main(ctrl, opts, reloadchannels=True):
                     newest[pkg.name] = pkg
             else:
                 newest[pkg.name] = pkg
-        packages = [pkg for pkg in packages if pkg == newest[pkg.name]]
+        packages = dict.fromkeys(newest.values(), True)
+
+    def parseWho(args, objs):
+        who = []
+        names = None
+        for name in args:
+            if '=' in name:
+                name, version = name.split('=')
+            else:
+                version = None
+            if isGlob(name):
+                p = re.compile(fnmatch.translate(name), re.I)
+                if names is None:
+                    # Collected once, so that each glob doesn't walk
+                    # every relation again.
+                    names = dict.fromkeys([x.name for x in objs]).keys()
+                for objname in names:
+                    if p.match(objname):
+                        who.append(Provides(objname, version))
+            else:
+                who.append(Provides(name, version))
+        return who
 
-    whoprovides = []
-    for name in opts.provides:
-        if '=' in name:
-            name, version = name.split('=')
-        else:
-            version = None
-        if isGlob(name):
-            p = re.compile(fnmatch.translate(name), re.I)
-            for prv in cache.getProvides():
-                if p.match(prv.name):
-                    whoprovides.append(Provides(prv.name, version))
-        else:
-            whoprovides.append(Provides(name, version))
-    whorequires = []
-    for name in opts.requires:
-        if '=' in name:
-            name, version = name.split('=')
-        else:
-            version = None
-        if isGlob(name):
-            p = re.compile(fnmatch.translate(name), re.I)
-            for req in cache.getRequires():
-                if p.match(req.name):
-                    whorequires.append(Provides(req.name, version))
-        else:
-            whorequires.append(Provides(name, version))
-    whoupgrades = []
-    for name in opts.upgrades:
-        if '=' in name:
-            name, version = name.split('=')
-        else:
-            version = None
-        if isGlob(name):
-            p = re.compile(fnmatch.translate(name), re.I)
-            for upg in cache.getUpgrades():
-                if p.match(upg.name):
-                    whoupgrades.append(Provides(upg.name, version))
-        else:
-            whoupgrades.append(Provides(name, version))
-    whoconflicts = []
-    for name in opts.conflicts:
-        if '=' in name:
-            name, version = name.split('=')
-        else:
-            version = None
-        if isGlob(name):
-            p = re.compile(fnmatch.translate(name), re.I)
-            for cnf in cache.getConflicts():
-                if p.match(cnf.name):
-                    whoconflicts.append(Provides(cnf.name, version))
-        else:
-            whoconflicts.append(Provides(name, version))
+    whoprovides = parseWho(opts.provides, cache.getProvides())
+    whorequires = parseWho(opts.requires, cache.getRequires())
+    whoupgrades = parseWho(opts.upgrades, cache.getUpgrades())
+    whoconflicts = parseWho(opts.conflicts, cache.getConflicts())
 
     if whoprovides or whorequires or whoupgrades or whoconflicts:
         newpackages = {}
@@ -314,7 +305,7 @@ def main(ctrl, opts, reloadchannels=True):
                     for pkg in cnf.packages:
                         if pkg in packages:
                             newpackages[pkg] = True
-        packages = newpackages.keys()
+        packages = newpackages
 
     def sh2re(pattern, stripeol=True, joinspace=True):
         """ Convert the shell-style pattern to a regular expression. """
@@ -343,10 +334,11 @@ def main(ctrl, opts, reloadchannels=True):
         hasflag.append(token)
     hassummary = []
     for token in opts.summary:
-        hassummary.append(sh2re(token))
+        hassummary.append((sh2re(token), getTextCandidates(cache, token)))
     hasdescription = []
     for token in opts.description:
-        hasdescription.append(sh2re(token))
+        hasdescription.append((sh2re(token),
+                               getTextCandidates(cache, token, True)))
     haspath = []
     for token in opts.path:
         haspath.append(sh2re(token, stripeol=False, joinspace=False))
@@ -354,66 +346,75 @@ def main(ctrl, opts, reloadchannels=True):
     for token in opts.url:
         haspath.append(sh2re(token, joinspace=False))
 
-    if hasname or hasgroup or hassummary or hasdescription or haspath or hasurl:
+    matching = (hasname or hasgroup or hassummary or hasdescription or
+                haspath or hasurl)
+
+    if haschannel:
         newpackages = {}
-        needsinfo = hasgroup or hassummary or hasdescription or haspath or hasurl
-        for pkg in cache.getPackages():
-            if hasname:
-                for pattern in hasname:
-                    if pattern.search(pkg.name):
-                        newpackages[pkg] = True
-            if needsinfo:
+        for pkg in packages:
+            for loader in pkg.loaders:
+                alias = loader.getChannel().getAlias()
+                if alias in haschannel:
+                    newpackages[pkg] = True
+        packages = newpackages
+
+    if hasflag:
+        # Packages also matched by name, path or info must have all
+        # the flags, and others any of them.
+        newpackages = {}
+        for pkg in packages:
+            passed = [x for x in hasflag if pkgconf.testFlag(x, pkg)]
+            if passed and (not matching or len(passed) == len(hasflag)):
+                newpackages[pkg] = True
+        packages = newpackages
+
+    if matching:
+        newpackages = {}
+        needsinfo = hasgroup or hassummary or hasdescription or hasurl
+        # Summaries and descriptions are only checked for packages
+        # which may match, unless some pattern may match anything.
+        allinfo = bool(hasgroup or hasurl)
+        textpackages = {}
+        for pattern, candidates in hassummary+hasdescription:
+            if candidates is None:
+                allinfo = True
+            else:
+                textpackages.update(candidates)
+        if haspath:
+            pathpackages = {}
+            for pattern in haspath:
+                pathpackages.update(getPathPackages(cache, pattern.match))
+        for pkg in packages:
+            for pattern in hasname:
+                if pattern.search(pkg.name):
+                    newpackages[pkg] = True
+                    break
+            if haspath and pkg in pathpackages:
+                newpackages[pkg] = True
+            if pkg in newpackages:
+                continue
+            if needsinfo and (allinfo or pkg in textpackages):
                 info = pkg.loaders.keys()[0].getInfo(pkg)
                 if hasgroup:
                     for pattern in hasgroup:
                         if pattern.search(info.getGroup()):
                             newpackages[pkg] = True
                 if hassummary:
-                    for pattern in hassummary:
-                        if pattern.search(info.getSummary()):
+                    for pattern, candidates in hassummary:
+                        if ((candidates is None or pkg in candidates) and
+                            pattern.search(info.getSummary())):
                             newpackages[pkg] = True
                 if hasdescription:
-                    for pattern in hasdescription:
-                        if pattern.search(info.getDescription()):
+                    for pattern, candidates in hasdescription:
+                        if ((candidates is None or pkg in candidates) and
+                            pattern.search(info.getDescription())):
                             newpackages[pkg] = True
-                if haspath:
-                    for pattern in haspath:
-                        for path in info.getPathList():
-                            if pattern.match(path):
-                                newpackages[pkg] = True
                 if hasurl:
                     for pattern in hasurl:
                         for url in info.getReferenceURLs():
                             if pattern.match(url):
                                 newpackages[pkg] = True
-            if hasflag and not (hasname or needsinfo):
-                for flag in hasflag:
-                    if pkgconf.testFlag(flag, pkg):
-                        newpackages[pkg] = True
-            elif hasflag and pkg in newpackages:
-                for flag in hasflag:
-                    if not pkgconf.testFlag(flag, pkg):
-                        del newpackages[pkg]
-                        break
-        
-        packages = newpackages.keys()
-
-    if haschannel:
-        newpackages = {}
-        for pkg in packages:
-            for loader in pkg.loaders:
-                alias = loader.getChannel().getAlias()
-                if alias in haschannel:
-                    newpackages[pkg] = True
-        packages = newpackages.keys()
-
-    if hasflag:
-        newpackages = {}
-        for pkg in packages:
-            for flag in hasflag:
-                if pkgconf.testFlag(flag, pkg):
-                    newpackages[pkg] = True
-        packages = newpackages.keys()
+        packages = newpackages
 
     format = opts.format.lower()+"output"
     for attr, value in globals().items():
@@ -428,6 +429,17 @@ def main(ctrl, opts, reloadchannels=True):
 
     output.start()
 
+    if isinstance(output, _RecordOutput):
+        # Records are written while walking the cache, in its own
+        # order, so nothing but the current record is kept around.
+        for pkg in cache.getPackages():
+            if pkg in packages:
+                output.showPackage(pkg)
+        output.end()
+        output.stopGrabOutput()
+        return
+
+    packages = packages.keys()
     packages.sort()
     for pkg in packages:
         output.showPackage(pkg)
@@ -976,4 +988,115 @@ class PrologOutput(NullOutput):
         self.showProvides(prvpkg, prv)
         self.add("conflictedby('%s', '%s')." % (prv, cnf))
 
+FIELDS = ["name", "version", "summary", "group", "priority", "channels",
+          "installed", "provides", "requires", "prerequires", "recommends",
+          "upgrades", "conflicts", "providedby", "requiredby",
+          "upgradedby", "conflictedby"]
+
+class _RecordOutput(NullOutput):
+    """
+    Base for the formats writing one record per package, as soon as
+    the package is shown, with the fields given in --fields, or the
+    ones enabled by the --show-* options.
+    """
+
+    def __init__(self, opts):
+        NullOutput.__init__(self, opts)
+        if opts.fields:
+            fields = [x.strip() for x in opts.fields.split(",")]
+            for field in fields:
+                if field not in FIELDS:
+                    raise Error, _("Unknown field: %s") % field
+        else:
+            fields = ["name"]
+            if not opts.hide_version:
+                fields.append("version")
+            for field in FIELDS:
+                if getattr(opts, "show_"+field, False):
+                    fields.append(field)
+        self.fields = fields
+
+    def getName(self, pkg):
+        if self.opts.hide_version:
+            return pkg.name
+        return str(pkg)
+
+    def getRelated(self, pkg, relations, attr):
+        names = {}
+        for rel in relations:
+            for other in getattr(rel, attr):
+                for relpkg in other.packages:
+                    if relpkg is pkg and attr == "conflictedby":
+                        continue
+                    if self.opts.installed and not relpkg.installed:
+                        continue
+                    names[self.getName(relpkg)] = True
+        names = names.keys()
+        names.sort()
+        return names
+
+    def getRecord(self, pkg):
+        record = []
+        info = None
+        for field in self.fields:
+            if field == "name":
+                value = pkg.name
+            elif field == "version":
+                value = pkg.version
+            elif field == "summary" or field == "group":
+                if info is None:
+                    info = pkg.loaders.keys()[0].getInfo(pkg)
+                if field == "summary":
+                    value = info.getSummary()
+                else:
+                    value = info.getGroup()
+            elif field == "priority":
+                value = pkg.getPriority()
+            elif field == "channels":
+                value = [x.getChannel().getAlias() for x in pkg.loaders]
+                value.sort()
+            elif field == "installed":
+                value = bool(pkg.installed)
+            elif field == "prerequires":
+                value = [str(x) for x in pkg.requires
+                         if isinstance(x, PreRequires)]
+                value.sort()
+            elif field == "providedby":
+                value = self.getRelated(pkg, pkg.requires, "providedby")
+            elif field == "requiredby" or field == "upgradedby" or \
+                 field == "conflictedby":
+                value = self.getRelated(pkg, pkg.provides, field)
+            else:
+                value = [str(x) for x in getattr(pkg, field)]
+                value.sort()
+            record.append((field, value))
+        return record
+
+class JSONOutput(_RecordOutput):
+    """One JSON object per line and package."""
+
+    def showPackage(self, pkg):
+        items = ["%s: %s" % (dumpJSON(field), dumpJSON(value))
+                 for field, value in self.getRecord(pkg)]
+        sys.stdout.write("{%s}\n" % ", ".join(items))
+
+class CSVOutput(_RecordOutput):
+    """A header row with the fields, and one row per package."""
+
+    def start(self):
+        self._writer = csv.writer(sys.stdout)
+        self._writer.writerow(self.fields)
+
+    def showPackage(self, pkg):
+        row = []
+        for field, value in self.getRecord(pkg):
+            if type(value) is list:
+                value = ", ".join(value)
+            elif type(value) is bool:
+                value = value and "true" or "false"
+            elif type(value) is unicode:
+                value = value.encode("utf-8")
+            row.append(value)
+        self._writer.writerow(row)
+
 # vim:ts=4:sw=4:et
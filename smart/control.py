@@ -19,8 +19,8 @@
 # along with Smart Package Manager; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
-import cPickle
 import sys, os
+import threading
 import copy
 import time
 import tempfile
@@ -36,6 +36,7 @@ from smart.searcher import Searcher
 from smart.media import MediaSet
 from smart.progress import Progress
 from smart.fetcher import Fetcher
+from smart.diskcache import DiskCache
 from smart.report import Report
 from smart.channel import *
 from smart.cache import *
@@ -56,6 +57,7 @@ class Control(object):
         self._dynamicchannels = {} # alias -> Channel()
         self._pathlocks = PathLocks(forcelocks)
         self._cache = Cache()
+        self._diskcache = DiskCache(self.__stateversion__)
 
         self.loadSysConf(confpath)
 
@@ -157,7 +159,7 @@ class Control(object):
     def restoreMediaState(self):
         self._mediaset.restoreState()
 
-    __stateversion__ = 2
+    __stateversion__ = 3
 
     def loadSysConf(self, confpath=None):
         datadir = sysconf.get("data-dir")
@@ -200,14 +202,8 @@ class Control(object):
                 cachepath = os.path.join(sysconf.get("data-dir"), "cache")
                 if sysconf.get("disk-cache", True):
                     iface.showStatus(_("Saving cache..."))
-                    cachefile = open(cachepath+".new", "w")
-                    state = (self.__stateversion__,
-                             self._cache,
-                             self._channels,
-                             self._sysconfchannels)
-                    cPickle.dump(state, cachefile, 2)
-                    cachefile.close()
-                    os.rename(cachepath+".new", cachepath)
+                    self._diskcache.save(cachepath, self._channels,
+                                         self._sysconfchannels)
                     iface.hideStatus()
                 elif os.path.isfile(cachepath):
                     os.unlink(cachepath)
@@ -252,11 +248,8 @@ class Control(object):
             cachepath = os.path.join(sysconf.get("data-dir"), "cache")
             if os.path.isfile(cachepath) and sysconf.get("disk-cache", True):
                 iface.showStatus(_("Loading cache..."))
-                cachefile = open(cachepath)
                 try:
-                    state = cPickle.load(cachefile)
-                    if state[0] != self.__stateversion__:
-                        raise StateVersionError
+                    state = self._diskcache.load(cachepath)
                 except:
                     if sysconf.get("log-level") == DEBUG:
                         import traceback
@@ -264,15 +257,11 @@ class Control(object):
                     if os.access(os.path.dirname(cachepath), os.W_OK):
                         os.unlink(cachepath)
                 else:
-                    (__stateversion__,
-                     self._cache,
-                     self._channels,
-                     self._sysconfchannels) = state
+                    self._channels, self._sysconfchannels = state
                     for alias in self._channels.keys():
                         if (alias not in channels or
                             not isEnabled(alias, channels[alias])):
                             self.removeChannel(alias)
-                cachefile.close()
                 iface.hideStatus()
 
         for alias in channels:
@@ -313,6 +302,67 @@ class Control(object):
         self._channels.update(newchannels)
         self._dynamicchannels.update(newchannels)
 
+    def _fetchChannel(self, channel, fetcher, progress, caching, manual,
+                      showtopic=True):
+        if not manual and channel.hasManualUpdate():
+            fetcher.setCaching(ALWAYS)
+        else:
+            fetcher.setCaching(caching)
+            if showtopic and channel.getFetchSteps() > 0:
+                progress.setTopic(_("Fetching information for '%s'...") %
+                              (channel.getName() or channel.getAlias()))
+                progress.show()
+        fetcher.setForceCopy(channel.isRemovable())
+        fetcher.setLocalPathPrefix(channel.getAlias()+"%%")
+        try:
+            if not channel.fetch(fetcher, progress):
+                iface.debug(_("Failed fetching channel '%s'") % channel)
+                return False
+        except Error, e:
+            iface.error(unicode(e))
+            iface.debug(_("Failed fetching channel '%s'") % channel)
+            return False
+        return True
+
+    def _fetchChannelsInParallel(self, channels, progress, caching, manual):
+        # Every channel is fetched in its own thread, with its own
+        # fetcher. All of them share the limit of active downloads
+        # of the main fetcher.
+        progress.setTopic(_("Fetching channel information..."))
+        progress.show()
+        self._fetcher.resetActiveDownloads()
+        results = {}
+        errors = []
+        def fetch(channel, fetcher):
+            try:
+                results[channel] = self._fetchChannel(channel, fetcher,
+                                                      progress, caching,
+                                                      manual, False)
+            except:
+                results[channel] = False
+                errors.append(sys.exc_info())
+        threads = []
+        for channel in channels:
+            fetcher = self._fetcher.clone()
+            thread = threading.Thread(target=fetch, args=(channel, fetcher))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append((thread, fetcher))
+        try:
+            for thread, fetcher in threads:
+                # Joining with a timeout lets KeyboardInterrupt through.
+                while thread.isAlive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            for thread, fetcher in threads:
+                fetcher.cancel()
+            for thread, fetcher in threads:
+                thread.join()
+            raise
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return False not in results.values()
+
     def reloadChannels(self, channels=None, caching=ALWAYS):
 
         if channels is None:
@@ -354,6 +404,7 @@ class Control(object):
             progress = Progress()
         else:
             progress = iface.getProgress(self._fetcher, True)
+            self._diskcache.materialize(self._cache, self._channels.values())
             oldpkgs = {}
             for pkg in self._cache.getPackages():
                 oldpkgs[(pkg.name, pkg.version)] = True
@@ -368,31 +419,32 @@ class Control(object):
 
         self._fetcher.setForceMountedCopy(True)
 
-        self._cache.reset()
+        # Loaders of channels which change while fetching are replaced
+        # in the cache, and only their packages are relinked on load.
+        if not sysconf.get("incremental-reload", True):
+            self._cache.reset()
 
         # Do the real work.
-        result = True
+        digests = {}
         for channel in channels:
-            digest = channel.getDigest()
-            if not manual and channel.hasManualUpdate():
-                self._fetcher.setCaching(ALWAYS)
-            else:
-                self._fetcher.setCaching(caching)
-                if channel.getFetchSteps() > 0:
-                    progress.setTopic(_("Fetching information for '%s'...") %
-                                  (channel.getName() or channel.getAlias()))
-                    progress.show()
-            self._fetcher.setForceCopy(channel.isRemovable())
-            self._fetcher.setLocalPathPrefix(channel.getAlias()+"%%")
-            try:
-                if not channel.fetch(self._fetcher, progress):
-                    iface.debug(_("Failed fetching channel '%s'") % channel)
-                    result = False
-            except Error, e:
-                iface.error(unicode(e))
-                iface.debug(_("Failed fetching channel '%s'") % channel)
+            digests[channel] = channel.getDigest()
+        parallel = []
+        if sysconf.get("parallel-channel-fetch", False):
+            # Removable channels may need user interaction.
+            parallel = [x for x in channels if not x.isRemovable()]
+        if len(parallel) > 1:
+            result = self._fetchChannelsInParallel(parallel, progress,
+                                                   caching, manual)
+        else:
+            result = True
+            parallel = []
+        for channel in channels:
+            if (channel not in parallel and
+                not self._fetchChannel(channel, self._fetcher, progress,
+                                       caching, manual)):
                 result = False
-            if (channel.getDigest() != digest and
+        for channel in channels:
+            if (channel.getDigest() != digests[channel] and
                 isinstance(channel, PackageChannel)):
                 channel.addLoaders(self._cache)
                 if channel.getAlias() in self._sysconfchannels:
@@ -407,7 +459,11 @@ class Control(object):
         progress.setStopped()
         progress.show()
         progress.stop()
- 
+
+        # Bring back loaders restored from the disk cache which weren't
+        # replaced while fetching. The cache relinks everything then.
+        self._diskcache.materialize(self._cache, self._channels.values())
+
         # Build cache with the new information.
         self._cache.load()
 
@@ -0,0 +1,606 @@
+#
+# Copyright (c) 2009 Smart Package Manager Team.
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart.cache import Loader, Package, Provides, Depends, StateVersionError
+from smart.channel import PackageChannel
+from smart.searchindex import getSearchIndex
+from smart.util.objdigest import getObjectHexDigest
+from smart import *
+from cStringIO import StringIO
+from array import array
+import cPickle
+import struct
+import gc
+import mmap
+import os
+
+#
+# On-disk layout of the cache file:
+#
+#   header   magic, format version, control state version, and the
+#            offset/length of the index, of the channel table and of
+#            the links.
+#   sections one per loader, see below.
+#   index    pickled list with one (classpath, stateversion, alias,
+#            digest, offset, length) tuple per section.
+#   channels pickled (channels, sysconfchannels) tuple, with loaders
+#            replaced by persistent references to their sections.
+#   links    int array with the links between relations of the cache
+#            holding the loaders, if it held exactly these loaders and
+#            was linked when saved, or nothing. Relations are numbered
+#            as buildPackage() lists them when the sections are loaded
+#            in order in an empty cache. The array has the number of
+#            relations, and then, for each non-empty providedby,
+#            requiredby, recommendedby, upgradedby or conflictedby list,
+#            the relation number, the position of the attribute in
+#            LINKATTRS, the list length, and the numbers of the
+#            relations in it.
+#
+# Each section holds everything needed to rebuild a single loader:
+#
+#   head     number of values, size of the values blob, number of
+#            packages, number of relation references, size of the state.
+#   kinds    one byte per value: "s" str, "u" unicode, "n" None,
+#            "c" class, "t" tuple of values, "p" anything else, pickled.
+#   offsets  int array with the start of each value in the blob.
+#   blob     the values themselves. Tuples are int arrays of indexes
+#            of previously defined values.
+#   packages PKGROWSIZE ints per package: initargs value, number of
+#            provides, requires, recommends, upgrades and conflicts,
+#            essential flag, and priority.
+#   refs     int array with initargs values of the package relations,
+#            in the order given above.
+#   state    pickled (loaderstate, pkginfos) tuple, with packages and
+#            relations replaced by persistent references. The loader
+#            state includes its search index, and the indexes of the
+#            paths and texts of its packages once they were queried.
+#
+
+MAGIC = "SMARTDC\0"
+FORMATVERSION = 5
+
+HEADER = "<8sIIQQQQQQ"
+HEADERSIZE = struct.calcsize(HEADER)
+SECTIONHEAD = "<IIIII"
+SECTIONHEADSIZE = struct.calcsize(SECTIONHEAD)
+PKGROWSIZE = 8
+INTSIZE = array("i").itemsize
+LINKATTRS = ("providedby", "requiredby", "recommendedby",
+             "upgradedby", "conflictedby")
+
+class DiskCache(object):
+
+    def __init__(self, stateversion):
+        self._stateversion = stateversion
+        self._file = None
+        self._map = None
+        self._index = []
+        self._classes = {}
+        self._pending = {}  # loader -> section index
+        self._sections = {} # loader -> section index
+        self._indexes = {}  # loader -> (paths, texts) when materialized
+        self._links = None
+
+    def load(self, path):
+        """
+        Open the cache file at the given path and return the saved
+        (channels, sysconfchannels) tuple. Loaders in these channels
+        are empty shells until materialize() is called on them, so
+        that sections of channels which are updated or disabled are
+        never decoded.
+        """
+        self.close()
+        try:
+            return self._load(path)
+        except:
+            self.close()
+            raise
+
+    def _load(self, path):
+        self._file = open(path, "rb")
+        try:
+            self._map = map = mmap.mmap(self._file.fileno(), 0,
+                                        access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError):
+            raise StateVersionError
+        if len(map) < HEADERSIZE:
+            raise StateVersionError
+        (magic, formatversion, stateversion,
+         indexoffset, indexlength,
+         channelsoffset, channelslength,
+         linksoffset, linkslength) = \
+            struct.unpack(HEADER, map[:HEADERSIZE])
+        if (magic != MAGIC or formatversion != FORMATVERSION or
+            stateversion != self._stateversion):
+            raise StateVersionError
+
+        index = cPickle.loads(map[indexoffset:indexoffset+indexlength])
+        shells = []
+        for classpath, loaderversion, alias, digest, offset, length in index:
+            cls = self._getClass(classpath)
+            if cls.__stateversion__ != loaderversion:
+                raise StateVersionError
+            loader = cls.__new__(cls)
+            Loader.__init__(loader)
+            shells.append(loader)
+        self._index = index
+
+        def persistent_load(pid):
+            return shells[int(pid)]
+        unpickler = cPickle.Unpickler(StringIO(
+                        map[channelsoffset:channelsoffset+channelslength]))
+        unpickler.persistent_load = persistent_load
+        channels, sysconfchannels = unpickler.load()
+
+        for i, loader in enumerate(shells):
+            alias = index[i][2]
+            if alias is not None:
+                channel = channels.get(alias)
+                if (channel is None or
+                    getObjectHexDigest(channel.getDigest()) != index[i][3]):
+                    raise StateVersionError
+                loader.setChannel(channel)
+            self._pending[loader] = i
+            self._sections[loader] = i
+        if linkslength:
+            self._links = (linksoffset, linkslength)
+
+        return channels, sysconfchannels
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._map = None
+        self._index = []
+        self._pending.clear()
+        self._sections.clear()
+        self._indexes.clear()
+        self._links = None
+
+    def materialize(self, cache, channels):
+        """
+        Rebuild the packages and state of loaders restored by load()
+        which are still part of the given channels, and add them to
+        the cache. Returns True if any loader was materialized.
+
+        If every section is materialized at once in an empty cache,
+        the links saved with them are restored as well, so the cache
+        is left linked and doesn't have to match relations again.
+        """
+        loaded = []
+        for channel in channels:
+            if not isinstance(channel, PackageChannel):
+                continue
+            for loader in channel.getLoaders():
+                i = self._pending.pop(loader, None)
+                if i is not None:
+                    loaded.append((i, loader))
+        # Links number relations as they're built, so sections are
+        # loaded in the order they were saved.
+        loaded.sort()
+        empty = not cache._packages
+        # Nothing built here is garbage, so don't have the collector
+        # walk the objects over and over while they're created.
+        gcenabled = gc.isenabled()
+        gc.disable()
+        try:
+            for i, loader in loaded:
+                cache.addLoader(loader)
+                entry = self._index[i]
+                self.loadSection(loader,
+                                 self._map[entry[4]:entry[4]+entry[5]])
+                self._indexes[loader] = self._getIndexes(loader)
+            if loaded:
+                # Packages built here aren't linked yet, so unless the
+                # saved links are restored the cache relinks on load.
+                if not (empty and self._links and
+                        len(loaded) == len(self._index) and
+                        self.loadLinks(cache, self._getLinksData())):
+                    cache._linked = False
+        finally:
+            if gcenabled:
+                gc.enable()
+        return bool(loaded)
+
+    def save(self, path, channels, sysconfchannels):
+        """
+        Write the given channels and their loaders to the cache file
+        at path. Sections of loaders which were restored from the
+        currently open file and didn't change are copied verbatim,
+        so only new loaders, and loaders which built their path or
+        text indexes meanwhile, have to be encoded.
+        """
+        file = open(path+".new", "wb")
+        file.write("\0"*HEADERSIZE)
+        offset = HEADERSIZE
+        index = []
+        loaders = []
+        copied = []
+        loaderpids = {}
+        for channel in channels.values():
+            if not isinstance(channel, PackageChannel):
+                continue
+            for loader in channel.getLoaders():
+                loaderchannel = loader.getChannel()
+                if loaderchannel is None:
+                    alias = digest = None
+                else:
+                    alias = loaderchannel.getAlias()
+                    digest = getObjectHexDigest(loaderchannel.getDigest())
+                i = self._sections.get(loader)
+                data = None
+                if (i is not None and self._index[i][3] == digest and
+                    self._indexes.get(loader, (None, None)) ==
+                    self._getIndexes(loader)):
+                    entry = self._index[i]
+                    data = self._map[entry[4]:entry[4]+entry[5]]
+                    # File provides may have changed packages since
+                    # the section was loaded.
+                    if (loader in self._indexes and
+                        self._getCounts(loader) != self._getCounts(data)):
+                        data = None
+                if data is None:
+                    data = self.dumpSection(loader)
+                else:
+                    copied.append(i)
+                cls = loader.__class__
+                loaders.append(loader)
+                loaderpids[loader] = str(len(index))
+                index.append(("%s:%s" % (cls.__module__, cls.__name__),
+                              cls.__stateversion__, alias, digest,
+                              offset, len(data)))
+                file.write(data)
+                offset += len(data)
+
+        def persistent_id(obj):
+            if isinstance(obj, Loader):
+                return loaderpids[obj]
+            return None
+        channelsfile = StringIO()
+        pickler = cPickle.Pickler(channelsfile, 2)
+        pickler.persistent_id = persistent_id
+        pickler.dump((channels, sysconfchannels))
+        channelsdata = channelsfile.getvalue()
+        indexdata = cPickle.dumps(index, 2)
+        # Links of the open file still hold if its sections are all
+        # copied in the same order.
+        if copied == range(len(self._index)) and len(copied) == len(index):
+            linksdata = self._getLinksData()
+        else:
+            linksdata = ""
+            cache = loaders and loaders[0].getCache()
+            if (cache and cache._linked and not cache._removed and
+                dict.fromkeys(cache._loaders) == dict.fromkeys(loaders)):
+                linksdata = self.dumpLinks(loaders)
+
+        file.write(indexdata)
+        file.write(channelsdata)
+        file.write(linksdata)
+        file.seek(0)
+        file.write(struct.pack(HEADER, MAGIC, FORMATVERSION,
+                               self._stateversion,
+                               offset, len(indexdata),
+                               offset+len(indexdata), len(channelsdata),
+                               offset+len(indexdata)+len(channelsdata),
+                               len(linksdata)))
+        file.close()
+        os.rename(path+".new", path)
+
+    def _getCounts(self, source):
+        # Number of relations of each kind in each package of a loader
+        # or of a section, which tells if the section still matches it.
+        counts = array("i")
+        if isinstance(source, str):
+            nvalues, blobsize, npkgs = \
+                struct.unpack(SECTIONHEAD, source[:SECTIONHEADSIZE])[:3]
+            pos = SECTIONHEADSIZE+nvalues+(nvalues+1)*INTSIZE+blobsize
+            rows = array("i")
+            rows.fromstring(source[pos:pos+npkgs*PKGROWSIZE*INTSIZE])
+            for row in xrange(0, npkgs*PKGROWSIZE, PKGROWSIZE):
+                counts.extend(rows[row+1:row+6])
+        else:
+            for pkg in source._packages:
+                counts.extend((len(pkg.provides), len(pkg.requires),
+                               len(pkg.recommends), len(pkg.upgrades),
+                               len(pkg.conflicts)))
+        return counts
+
+    def _getRelations(self, loaders):
+        # Number relations as buildPackage() lists them in an empty
+        # cache, where each one is added to the list of the first kind
+        # it's used for, in the order it's first found.
+        seen = {}
+        kinds = ([], [], [], [], [])
+        for loader in loaders:
+            for pkg in loader._packages:
+                for kind, lst in ((0, pkg.provides), (1, pkg.requires),
+                                  (2, pkg.recommends), (3, pkg.upgrades),
+                                  (4, pkg.conflicts)):
+                    for rel in lst:
+                        if id(rel) not in seen:
+                            seen[id(rel)] = True
+                            kinds[kind].append(rel)
+        relations = []
+        for lst in kinds:
+            relations.extend(lst)
+        return relations
+
+    def dumpLinks(self, loaders):
+        """
+        Return a string with the links between relations of the given
+        loaders, in the format described above, or an empty string if
+        they're linked to relations of other loaders.
+        """
+        relations = self._getRelations(loaders)
+        ids = {}
+        for i, rel in enumerate(relations):
+            ids[id(rel)] = i
+        links = array("i", [len(relations)])
+        for i, rel in enumerate(relations):
+            for code, attr in enumerate(LINKATTRS):
+                lst = getattr(rel, attr, None)
+                if lst:
+                    links.extend((i, code, len(lst)))
+                    for other in lst:
+                        j = ids.get(id(other))
+                        if j is None:
+                            return ""
+                        links.append(j)
+        return links.tostring()
+
+    def loadLinks(self, cache, data):
+        """
+        Restore the links between relations in the cache from a string
+        returned by dumpLinks(), and leave the cache linked. The cache
+        must only hold the packages of the loaders given to dumpLinks(),
+        materialized in the same order. Returns False, leaving the cache
+        unlinked, if the links don't match them.
+        """
+        links = array("i")
+        links.fromstring(data)
+        relations = (cache._provides + cache._requires + cache._recommends +
+                     cache._upgrades + cache._conflicts)
+        if links[0] != len(relations):
+            return False
+        getrel = relations.__getitem__
+        pos = 1
+        end = len(links)
+        while pos < end:
+            i, code, n = links[pos:pos+3]
+            pos += 3
+            setattr(relations[i], LINKATTRS[code],
+                    map(getrel, links[pos:pos+n]))
+            pos += n
+        cache.indexDeps()
+        cache._linked = True
+        return True
+
+    def _getLinksData(self):
+        if self._links is None:
+            return ""
+        offset, length = self._links
+        return self._map[offset:offset+length]
+
+    def _getIndexes(self, loader):
+        index = loader._searchindex
+        if index is None:
+            return None, None
+        return index._paths, index._texts
+
+    def _getClass(self, classpath):
+        cls = self._classes.get(classpath)
+        if cls is None:
+            modname, clsname = classpath.split(":")
+            module = __import__(modname, {}, {}, [clsname])
+            try:
+                cls = getattr(module, clsname)
+            except AttributeError:
+                raise StateVersionError
+            self._classes[classpath] = cls
+        return cls
+
+    def dumpSection(self, loader):
+        """
+        Return a string with the packages and state of the given
+        loader, in the section format described above.
+        """
+        values = ValueTable()
+        rows = array("i")
+        refs = array("i")
+        pkgindex = {}
+        for i, pkg in enumerate(loader._packages):
+            pkgindex[id(pkg)] = i
+            rows.append(values.add(pkg.getInitArgs()))
+            for lst in (pkg.provides, pkg.requires, pkg.recommends,
+                        pkg.upgrades, pkg.conflicts):
+                rows.append(len(lst))
+                for rel in lst:
+                    refs.append(values.add(rel.getInitArgs()))
+            rows.append(bool(pkg.essential))
+            rows.append(pkg.priority)
+
+        def persistent_id(obj):
+            if isinstance(obj, Package):
+                i = pkgindex.get(id(obj))
+                if i is None:
+                    raise Error, _("Loader %s references foreign package %s") \
+                                 % (loader, obj)
+                return "p%d" % i
+            if isinstance(obj, (Provides, Depends)):
+                return "r%d" % values.add(obj.getInitArgs())
+            return None
+        # Path and text indexes read the info of every package, so
+        # they're left for the first query instead.
+        getSearchIndex(loader)
+        state = loader.__getstate__()
+        for key in ("_packages", "_cache", "_channel"):
+            if key in state:
+                del state[key]
+        infos = [pkg.loaders.get(loader) for pkg in loader._packages]
+        statefile = StringIO()
+        pickler = cPickle.Pickler(statefile, 2)
+        pickler.persistent_id = persistent_id
+        pickler.dump((state, infos))
+        statedata = statefile.getvalue()
+
+        kinds, offsets, blob = values.dump()
+        return "".join([struct.pack(SECTIONHEAD, len(kinds), len(blob),
+                                    len(loader._packages), len(refs),
+                                    len(statedata)),
+                        kinds, offsets.tostring(), blob,
+                        rows.tostring(), refs.tostring(), statedata])
+
+    def loadSection(self, loader, data):
+        """
+        Rebuild the packages and state of the given loader from a
+        string returned by dumpSection(). The loader must already be
+        added to the cache which will hold its packages.
+        """
+        nvalues, blobsize, npkgs, nrefs, statesize = \
+            struct.unpack(SECTIONHEAD, data[:SECTIONHEADSIZE])
+        pos = SECTIONHEADSIZE
+        kinds = data[pos:pos+nvalues]
+        pos += nvalues
+        offsets = array("i")
+        offsets.fromstring(data[pos:pos+(nvalues+1)*INTSIZE])
+        pos += (nvalues+1)*INTSIZE
+        values = self._loadValues(kinds, offsets, data[pos:pos+blobsize])
+        pos += blobsize
+        rows = array("i")
+        rows.fromstring(data[pos:pos+npkgs*PKGROWSIZE*INTSIZE])
+        pos += npkgs*PKGROWSIZE*INTSIZE
+        refs = array("i")
+        refs.fromstring(data[pos:pos+nrefs*INTSIZE])
+        pos += nrefs*INTSIZE
+
+        # Subclasses may hook side effects into buildPackage(), which
+        # must not run again, so use the base implementation.
+        buildPackage = Loader.buildPackage
+        packages = []
+        r = 0
+        for row in xrange(0, npkgs*PKGROWSIZE, PKGROWSIZE):
+            relargs = []
+            for n in rows[row+1:row+6]:
+                if n:
+                    relargs.append([values[x] for x in refs[r:r+n]])
+                    r += n
+                else:
+                    relargs.append(None)
+            prvargs, reqargs, recargs, upgargs, cnfargs = relargs
+            pkg = buildPackage(loader, values[rows[row]], prvargs, reqargs,
+                               upgargs, cnfargs, recargs)
+            if rows[row+6]:
+                pkg.essential = True
+            if rows[row+7]:
+                pkg.priority = rows[row+7]
+            packages.append(pkg)
+
+        objmap = loader.getCache()._objmap
+        def persistent_load(pid):
+            if pid[0] == "p":
+                return packages[int(pid[1:])]
+            args = values[int(pid[1:])]
+            obj = objmap.get(args)
+            if obj is None:
+                obj = args[0](*args[1:])
+            return obj
+        unpickler = cPickle.Unpickler(StringIO(data[pos:pos+statesize]))
+        unpickler.persistent_load = persistent_load
+        state, infos = unpickler.load()
+        state["_packages"] = loader._packages
+        loader.__setstate__(state)
+        for pkg, info in zip(packages, infos):
+            pkg.loaders[loader] = info
+
+    def _loadValues(self, kinds, offsets, blob):
+        values = []
+        append = values.append
+        getClass = self._getClass
+        for i in xrange(len(kinds)):
+            kind = kinds[i]
+            chunk = blob[offsets[i]:offsets[i+1]]
+            if kind == "s":
+                append(intern(chunk))
+            elif kind == "t":
+                idx = array("i")
+                idx.fromstring(chunk)
+                append(tuple([values[x] for x in idx]))
+            elif kind == "n":
+                append(None)
+            elif kind == "u":
+                append(chunk.decode("utf-8"))
+            elif kind == "c":
+                append(getClass(chunk))
+            elif kind == "p":
+                append(cPickle.loads(chunk))
+            else:
+                raise StateVersionError
+        return values
+
+class ValueTable(object):
+
+    def __init__(self):
+        self._kinds = []
+        self._chunks = []
+        self._map = {}
+
+    def add(self, value):
+        vtype = type(value)
+        if vtype is str:
+            key = ("s", value)
+        elif vtype is tuple:
+            key = ("t", tuple([self.add(x) for x in value]))
+        elif value is None:
+            key = ("n", None)
+        elif vtype is unicode:
+            key = ("u", value)
+        elif isinstance(value, type):
+            key = ("c", value)
+        else:
+            key = ("p", cPickle.dumps(value, 2))
+        i = self._map.get(key)
+        if i is None:
+            kind, value = key
+            if kind == "t":
+                chunk = array("i", value).tostring()
+            elif kind == "u":
+                chunk = value.encode("utf-8")
+            elif kind == "c":
+                chunk = "%s:%s" % (value.__module__, value.__name__)
+            elif kind == "n":
+                chunk = ""
+            else:
+                chunk = value
+            i = self._map[key] = len(self._kinds)
+            self._kinds.append(kind)
+            self._chunks.append(chunk)
+        return i
+
+    def dump(self):
+        offsets = array("i", [0])
+        pos = 0
+        for chunk in self._chunks:
+            pos += len(chunk)
+            offsets.append(pos)
+        return "".join(self._kinds), offsets, "".join(self._chunks)
+
+# vim:ts=4:sw=4:et
@@ -22,7 +22,9 @@
 #
 from smart.util.strtools import sizeToStr, speedToStr, secondsToStr
 from smart.media import MediaSet, DeviceMedia
-from smart.uncompress import Uncompressor
+from smart.uncompress import Uncompressor, StreamUncompressor
+from smart.util.filedigest import getFileDigests, forgetFileDigests
+from smart.util.filedigest import StreamDigests
 from smart.mirror import MirrorSystem
 from smart.const import *
 from smart import *
@@ -68,15 +70,80 @@ class Fetcher(object):
         self._activedownloads = 0
         self._activedownloadslock = thread.allocate_lock()
         self._maxactivedownloads = 0
+        self._parent = None
+        self._events = threading.Condition()
+        self._changed = []
+        self._woken = False
+        self._running = []
         self.time = 0
         self._eta = 0
 
     def reset(self):
         self._items.clear()
         self._uncompressing = 0
+        del self._changed[:]
+
+    def clone(self):
+        # The new fetcher shares the mirror system and the limit of
+        # active downloads with this one, so that several fetchers
+        # may run at the same time in different threads. The limit
+        # is reset by calling resetActiveDownloads() on this fetcher.
+        fetcher = Fetcher()
+        fetcher._parent = self
+        fetcher._events = self._events
+        fetcher._mediaset = self._mediaset
+        fetcher._mirrorsystem = self._mirrorsystem
+        fetcher._localdir = self._localdir
+        fetcher._mangle = self._mangle
+        fetcher._caching = self._caching
+        fetcher._forcecopy = self._forcecopy
+        fetcher._forcemountedcopy = self._forcemountedcopy
+        fetcher._localpathprefix = self._localpathprefix
+        return fetcher
+
+    def resetActiveDownloads(self):
+        self._activedownloads = 0
+        self._maxactivedownloads = sysconf.get("max-active-downloads",
+                                               MAXACTIVEDOWNLOADS)
 
     def cancel(self):
         self._cancel = True
+        self.wakeUp()
+
+    def wakeUp(self, item=None):
+        # Handlers and their threads call this when something changed
+        # which run() must look at, optionally the state of an item.
+        events = self._events
+        events.acquire()
+        if item is None:
+            self._woken = True
+        else:
+            self._changed.append(item)
+        events.notifyAll()
+        events.release()
+
+    def _wakeUpRunning(self):
+        # Wake up all fetchers sharing the active downloads limit,
+        # so that they may start new downloads.
+        if self._parent:
+            return self._parent._wakeUpRunning()
+        events = self._events
+        events.acquire()
+        for fetcher in self._running:
+            fetcher._woken = True
+        events.notifyAll()
+        events.release()
+
+    def _setRunning(self, flag):
+        root = self
+        while root._parent:
+            root = root._parent
+        self._events.acquire()
+        if flag:
+            root._running.append(self)
+        else:
+            root._running.remove(self)
+        self._events.release()
 
     def getItem(self, url):
         return self._items.get(url)
@@ -162,15 +229,21 @@ class Fetcher(object):
         return self._forcemountedcopy
 
     def changeActiveDownloads(self, value):
+        if self._parent:
+            return self._parent.changeActiveDownloads(value)
         result = False
         self._activedownloadslock.acquire()
         if self._activedownloads+value <= self._maxactivedownloads:
             self._activedownloads += value
             result = True
         self._activedownloadslock.release()
+        if value < 0:
+            self._wakeUpRunning()
         return result
 
     def getActiveDownloads(self):
+        if self._parent:
+            return self._parent.getActiveDownloads()
         return self._activedownloads
 
     def enqueue(self, url, **info):
@@ -199,9 +272,8 @@ class Fetcher(object):
                 sys.exit(0)
             old_quit_handler = signal.signal(signal.SIGQUIT, quitIntHandler)
             old_int_handler  = signal.signal(signal.SIGINT, quitIntHandler)
-        self._activedownloads = 0
-        self._maxactivedownloads = sysconf.get("max-active-downloads",
-                                               MAXACTIVEDOWNLOADS)
+        if not self._parent:
+            self.resetActiveDownloads()
         self._maxdownloadrate = sysconf.get("max-download-rate", 0)
         self.time = time.time()
         handlers = self._handlers.values()
@@ -236,69 +308,89 @@ class Fetcher(object):
         uncompchecked = {}
         self._speedupdated = self.time
         cancelledtime = None
-        while active or self._uncompressing:
-            self.time = time.time()
-            if self._cancel:
-                if not cancelledtime:
-                    cancelledtime = self.time
+        # Instead of looking at every item all the time, only items
+        # reported through wakeUp() are checked, and the loop blocks
+        # until something is reported. The first pass checks them all.
+        events = self._events
+        events.acquire()
+        del self._changed[:]
+        self._woken = False
+        events.release()
+        self._setRunning(True)
+        changed = self._items.values()
+        running = {}
+        try:
+            while active or self._uncompressing:
+                self.time = time.time()
+                if self._cancel:
+                    if not cancelledtime:
+                        cancelledtime = self.time
+                    for handler in active[:]:
+                        if not handler.wasCancelled():
+                            handler.cancel()
+                        if not handler.tick():
+                            active.remove(handler)
+                    # We won't wait for handlers which are not being nice.
+                    if time.time() > cancelledtime+CANCELDELAY:
+                        for item in self._items.values():
+                            if item.getStatus() != SUCCEEDED:
+                                item.setCancelled()
+                        # Remove handlers, since we don't know their state.
+                        self._handlers.clear()
+                        prog.show()
+                        break
+                    prog.show()
+                    self._waitEvents(min(SPEEDDELAY, cancelledtime +
+                                         CANCELDELAY - self.time))
+                    continue
                 for handler in active[:]:
-                    if not handler.wasCancelled():
-                        handler.cancel()
                     if not handler.tick():
                         active.remove(handler)
-                # We won't wait for handlers which are not being nice.
-                if time.time() > cancelledtime+CANCELDELAY:
-                    for item in self._items.values():
-                        if item.getStatus() != SUCCEEDED:
-                            item.setCancelled()
-                    # Remove handlers, since we don't know their state.
-                    self._handlers.clear()
-                    prog.show()
-                    break
-                prog.show()
-                continue
-            for handler in active[:]:
-                if not handler.tick():
-                    active.remove(handler)
-            if self._speedupdated+SPEEDDELAY < self.time:
-                self._speedupdated = self.time
-                updatespeed = True
-            else:
-                updatespeed = False
-            for url in self._items:
-                item = self._items[url]
-                if item.getStatus() == FAILED:
-                    if (item.getRetries() < MAXRETRIES and
-                        item.setNextURL()):
-                        item.reset()
-                        handler = self.getHandlerInstance(item)
-                        handler.enqueue(item)
-                        if handler not in active:
-                            active.append(handler)
-                    continue
-                elif (item.getStatus() != SUCCEEDED or
-                      not item.getInfo("uncomp")):
-                    if updatespeed:
+                for item in changed:
+                    status = item.getStatus()
+                    if status == RUNNING:
+                        running[item] = True
+                        continue
+                    elif item in running:
+                        del running[item]
+                    if status == FAILED:
+                        if (item.getRetries() < MAXRETRIES and
+                            item.setNextURL()):
+                            item.reset()
+                            handler = self.getHandlerInstance(item)
+                            handler.enqueue(item)
+                            if handler not in active:
+                                active.append(handler)
+                            # Tick it again before blocking.
+                            self._woken = True
+                        continue
+                    elif status != SUCCEEDED or not item.getInfo("uncomp"):
+                        continue
+                    localpath = item.getTargetPath()
+                    if localpath in uncompchecked:
+                        continue
+                    uncompchecked[localpath] = True
+                    uncomphandler = uncomp.getHandler(localpath)
+                    if not uncomphandler:
+                        continue
+                    uncomppath = uncomphandler.getTargetPath(localpath)
+                    if (not self.hasStrongValidate(item, uncomp=True) or
+                        not self.validate(item, uncomppath, uncomp=True)):
+                        self._uncompressing += 1
+                        thread.start_new_thread(self._uncompress,
+                                            (item, localpath, uncomphandler))
+                    else:
+                        item.setSucceeded(uncomppath)
+                if self._speedupdated+SPEEDDELAY < self.time:
+                    self._speedupdated = self.time
+                    for item in running:
                         item.updateSpeed()
                         item.updateETA()
-                    continue
-                localpath = item.getTargetPath()
-                if localpath in uncompchecked:
-                    continue
-                uncompchecked[localpath] = True
-                uncomphandler = uncomp.getHandler(localpath)
-                if not uncomphandler:
-                    continue
-                uncomppath = uncomphandler.getTargetPath(localpath)
-                if (not self.hasStrongValidate(item, uncomp=True) or
-                    not self.validate(item, uncomppath, uncomp=True)):
-                    self._uncompressing += 1
-                    thread.start_new_thread(self._uncompress,
-                                            (item, localpath, uncomphandler))
-                else:
-                    item.setSucceeded(uncomppath)
-            prog.show()
-            time.sleep(0.1)
+                prog.show()
+                if active or self._uncompressing:
+                    changed = self._waitEvents(SPEEDDELAY)
+        finally:
+            self._setRunning(False)
         for handler in handlers:
             handler.stop()
         if not progress:
@@ -316,13 +408,30 @@ class Fetcher(object):
             item.setFailed(unicode(e))
         else:
             uncomppath = uncomphandler.getTargetPath(localpath)
+            forgetFileDigests(uncomppath)
             valid, reason = self.validate(item, uncomppath,
                                           withreason=True, uncomp=True)
             if not valid:
                 item.setFailed(reason)
             else:
                 item.setSucceeded(uncomppath)
+        self._events.acquire()
         self._uncompressing -= 1
+        self._events.release()
+        self.wakeUp()
+
+    def _waitEvents(self, timeout):
+        events = self._events
+        events.acquire()
+        try:
+            if not self._changed and not self._woken and timeout > 0:
+                events.wait(timeout)
+            changed = self._changed
+            self._changed = []
+            self._woken = False
+        finally:
+            events.release()
+        return changed
 
     def getLocalSchemes(self):
         return self._localschemes
@@ -355,6 +464,46 @@ class Fetcher(object):
             self._handlers[scheme] = handler
         return handler
 
+    def getStreamUncompressor(self, item, localpath):
+        # Handlers may feed downloaded data into the returned object,
+        # so that the file is uncompressed while being downloaded.
+        if not item.getInfo("uncomp") or not sysconf.get("stream-uncompress",
+                                                         False):
+            return None
+        # Without strong digests the uncompressed file couldn't be
+        # trusted, and would be uncompressed again anyway.
+        if not self.hasStrongValidate(item, uncomp=True):
+            return None
+        handler = self._uncompressor.getHandler(localpath)
+        if not handler or not handler.getDecompressor():
+            return None
+        digests = self.getDigestNames(item, uncomp=True)
+        try:
+            return StreamUncompressor(handler, localpath, digests)
+        except Error:
+            return None
+
+    def getStreamDigests(self, item):
+        # Handlers may feed downloaded data into the returned object,
+        # and give its digests to validate(), so that the file isn't
+        # read again.
+        return StreamDigests(self.getDigestNames(item))
+
+    def getDigestNames(self, item, uncomp=False):
+        # Names of the digests validate() checks for item.
+        if uncomp:
+            prefix = "uncomp_"
+        else:
+            prefix = ""
+        names = []
+        if item.getInfo(prefix+"md5"):
+            names.append("md5")
+        if item.getInfo(prefix+"sha256"):
+            names.append("sha256")
+        elif item.getInfo(prefix+"sha"):
+            names.append("sha")
+        return names
+
     def hasStrongValidate(self, item, uncomp=False):
         if uncomp:
             prefix = "uncomp_"
@@ -364,7 +513,12 @@ class Fetcher(object):
                     item.getInfo(prefix+"sha") or
                     item.getInfo(prefix+"sha256"))
 
-    def validate(self, item, localpath, withreason=False, uncomp=False):
+    def validate(self, item, localpath, withreason=False, uncomp=False,
+                 digests=None):
+        # If given, digests maps "size", "md5", "sha" and "sha256" to
+        # values already computed for localpath, which isn't read again.
+        if digests is None:
+            digests = {}
         try:
             if not os.path.isfile(localpath):
                 raise Error, _("File not found for validation")
@@ -386,61 +540,35 @@ class Fetcher(object):
 
             size = item.getInfo(uncompprefix+"size")
             if size:
-                lsize = os.path.getsize(localpath)
+                lsize = digests.get("size")
+                if lsize is None:
+                    lsize = os.path.getsize(localpath)
                 if lsize != size:
                     raise Error, _("Unexpected size (expected %d, got %d)") % \
                                  (size, lsize)
 
             filemd5 = item.getInfo(uncompprefix+"md5")
-            if filemd5:
-                try:
-                    from hashlib import md5
-                except ImportError:
-                    from md5 import md5
-                digest = md5()
-                file = open(localpath)
-                data = file.read(BLOCKSIZE)
-                while data:
-                    digest.update(data)
-                    data = file.read(BLOCKSIZE)
-                lfilemd5 = digest.hexdigest()
-                if lfilemd5 != filemd5:
-                    raise Error, _("Invalid MD5 (expected %s, got %s)") % \
-                                 (filemd5, lfilemd5)
-
             filesha256 = item.getInfo(uncompprefix+"sha256")
-            if filesha256:
-                try:
-                    from hashlib import sha256
-                except ImportError:
-                    from smart.util.sha256 import sha256
-                digest = sha256()
-                file = open(localpath)
-                data = file.read(BLOCKSIZE)
-                while data:
-                    digest.update(data)
-                    data = file.read(BLOCKSIZE)
-                lfilesha256 = digest.hexdigest()
-                if lfilesha256 != filesha256:
-                   raise Error, _("Invalid SHA256 (expected %s, got %s)") % \
-                                 (filesha256, lfilesha256)
-            else:
-                filesha = item.getInfo(uncompprefix+"sha")
-                if filesha:
-                    try:
-                        from hashlib import sha1 as sha
-                    except ImportError:
-                        from sha import sha
-                    digest = sha()
-                    file = open(localpath)
-                    data = file.read(BLOCKSIZE)
-                    while data:
-                        digest.update(data)
-                        data = file.read(BLOCKSIZE)
-                    lfilesha = digest.hexdigest()
-                    if lfilesha != filesha:
-                        raise Error, _("Invalid SHA (expected %s, got %s)") % \
-                                     (filesha, lfilesha)
+            filesha = not filesha256 and item.getInfo(uncompprefix+"sha")
+            names = [name for name, value in (("md5", filemd5),
+                                              ("sha256", filesha256),
+                                              ("sha", filesha))
+                     if value and name not in digests]
+            if names:
+                digests = digests.copy()
+                digests.update(getFileDigests(localpath, names))
+
+            if filemd5 and digests["md5"] != filemd5:
+                raise Error, _("Invalid MD5 (expected %s, got %s)") % \
+                             (filemd5, digests["md5"])
+
+            if filesha256 and digests["sha256"] != filesha256:
+               raise Error, _("Invalid SHA256 (expected %s, got %s)") % \
+                             (filesha256, digests["sha256"])
+
+            if filesha and digests["sha"] != filesha:
+                raise Error, _("Invalid SHA (expected %s, got %s)") % \
+                             (filesha, digests["sha"])
         except Error, reason:
             if withreason:
                 return False, reason
@@ -555,6 +683,7 @@ class FetchItem(object):
                                          r"\1*\2", url))
             prog.setSub(url, 0, self._info.get("size") or 1, 1)
             prog.show()
+            self._fetcher.wakeUp(self)
 
     def progress(self, current, total):
         if self._status is RUNNING:
@@ -607,6 +736,7 @@ class FetchItem(object):
                     self._speed = fetchedsize/timedelta
                 self._progress.setSubDone(self._urlobj.original)
                 self._progress.show()
+            self._fetcher.wakeUp(self)
 
     def setFailed(self, reason):
         self._status = FAILED
@@ -615,6 +745,7 @@ class FetchItem(object):
             self._mirror.addInfo(failed=1)
             self._progress.setSubStopped(self._urlobj.original)
             self._progress.show()
+        self._fetcher.wakeUp(self)
 
     def setCancelled(self):
         self.setFailed(_("Cancelled"))
@@ -739,6 +870,81 @@ class FetcherHandler(object):
     def getLocalPath(self, item):
         return self._fetcher.getLocalPath(item)
 
+    def finishStream(self, item, stream, localpath):
+        # Return the path the item succeeded with, after localpath was
+        # downloaded and validated while also being fed into stream.
+        # Unless the uncompressed file can be trusted, it's left to
+        # the fetcher to uncompress localpath as usual.
+        fetcher = self._fetcher
+        try:
+            stream.close()
+            if fetcher.validate(item, stream.getPartPath(), uncomp=True,
+                                digests=stream.getDigests()):
+                stream.commit()
+                forgetFileDigests(stream.getTargetPath())
+                return stream.getTargetPath()
+        except (Error, IOError, OSError):
+            pass
+        stream.abort()
+        return localpath
+
+    def getConditionalHeaders(self, localpath):
+        # Headers asking the server not to send localpath again if it
+        # didn't change. localpath must exist and be valid.
+        import rfc822
+        validators = self.loadValidators(localpath)
+        headers = {}
+        if "etag" in validators:
+            headers["If-None-Match"] = validators["etag"]
+        if "last-modified" in validators:
+            headers["If-Modified-Since"] = validators["last-modified"]
+        else:
+            mtime = os.path.getmtime(localpath)
+            headers["If-Modified-Since"] = rfc822.formatdate(mtime)
+        return headers
+
+    def loadValidators(self, localpath):
+        # Validators are only good for the very file they were sent
+        # with, so they're dropped if localpath changed afterwards.
+        validators = {}
+        try:
+            file = open(localpath+".validators")
+            try:
+                for line in file:
+                    name, value = line.rstrip("\n").split(": ", 1)
+                    validators[name] = value
+            finally:
+                file.close()
+            st = os.stat(localpath)
+        except (IOError, OSError, ValueError):
+            return {}
+        if (validators.get("size") != str(st.st_size) or
+            validators.get("mtime") != str(int(st.st_mtime))):
+            return {}
+        return validators
+
+    def saveValidators(self, localpath, etag=None, lastmodified=None):
+        # Must be called once localpath has its final modification time.
+        validatorspath = localpath+".validators"
+        try:
+            if not etag and not lastmodified:
+                if os.path.isfile(validatorspath):
+                    os.unlink(validatorspath)
+                return
+            st = os.stat(localpath)
+            file = open(validatorspath, "w")
+            try:
+                file.write("size: %d\n" % st.st_size)
+                file.write("mtime: %d\n" % int(st.st_mtime))
+                if etag:
+                    file.write("etag: %s\n" % etag)
+                if lastmodified:
+                    file.write("last-modified: %s\n" % lastmodified)
+            finally:
+                file.close()
+        except (IOError, OSError):
+            pass
+
     def runLocal(self, caching=None):
         # That's part of the caching magic.
         fetcher = self._fetcher
@@ -757,6 +963,7 @@ class FetcherHandler(object):
                                                      uncomp=True)
                     if not valid and fetcher.validate(item, localpath):
                         uncomphandler.uncompress(localpath)
+                        forgetFileDigests(uncomppath)
                         valid, reason = fetcher.validate(item, uncomppath,
                                                          withreason=True,
                                                          uncomp=True)
@@ -841,6 +1048,7 @@ class FileHandler(FetcherHandler):
                             os.symlink(localpath, linkpath)
                             uncomppath = uncomphandler.getTargetPath(linkpath)
                             uncomphandler.uncompress(linkpath)
+                            forgetFileDigests(uncomppath)
                             valid, reason = fetcher.validate(item, uncomppath,
                                                              withreason=True,
                                                              uncomp=True)
@@ -884,11 +1092,13 @@ class FileHandler(FetcherHandler):
                     error = unicode(e)
                     retries += 1
                 else:
+                    forgetFileDigests(localpath)
                     item.setSucceeded(localpath)
                     break
             else:
                 item.setFailed(error)
         self._active = False
+        self._fetcher.wakeUp()
 
 Fetcher.setHandler("file", FileHandler, local=True)
 
@@ -1092,6 +1302,7 @@ class FTPHandler(FetcherHandler):
                     os.utime(localpathpart, (mtime, mtime))
 
                 os.rename(localpathpart, localpath)
+                forgetFileDigests(localpath)
 
                 valid, reason = fetcher.validate(item, localpath,
                                                  withreason=True)
@@ -1203,6 +1414,8 @@ class URLLIBHandler(FetcherHandler):
 
             item.start()
 
+            stream = None
+
             try:
 
                 localpath = self.getLocalPath(item)
@@ -1217,9 +1430,9 @@ class URLLIBHandler(FetcherHandler):
 
                 if (os.path.isfile(localpath) and
                     fetcher.validate(item, localpath)):
-                    mtime = os.path.getmtime(localpath)
-                    opener.addheader("if-modified-since",
-                                     rfc822.formatdate(mtime))
+                    headers = self.getConditionalHeaders(localpath)
+                    for name, value in headers.items():
+                        opener.addheader(name, value)
 
                 localpathpart = localpath+".part"
                 if os.path.isfile(localpathpart):
@@ -1265,6 +1478,12 @@ class URLLIBHandler(FetcherHandler):
                 except (IOError, OSError), e:
                     raise IOError, "%s: %s" % (localpathpart, e)
 
+                if openmode == "w":
+                    stream = fetcher.getStreamUncompressor(item, localpath)
+                    digests = fetcher.getStreamDigests(item)
+                else:
+                    digests = None
+
                 rate_limit = self._fetcher._maxdownloadrate
                 if rate_limit:
                     rate_limit /= self._active
@@ -1276,6 +1495,10 @@ class URLLIBHandler(FetcherHandler):
                         if self._cancel:
                             raise FetcherCancelled
                         local.write(data)
+                        if digests:
+                            digests.update(data)
+                        if stream:
+                            stream.write(data)
                         current += len(data)
                         item.progress(current, total)
                         if rate_limit:
@@ -1292,9 +1515,13 @@ class URLLIBHandler(FetcherHandler):
                     remote.close()
 
                 os.rename(localpathpart, localpath)
+                forgetFileDigests(localpath)
 
+                if digests:
+                    digests = digests.getDigests()
                 valid, reason = fetcher.validate(item, localpath,
-                                                 withreason=True)
+                                                 withreason=True,
+                                                 digests=digests)
                 if not valid:
                     if openmode == "a":
                         # Try again, from the very start.
@@ -1311,7 +1538,10 @@ class URLLIBHandler(FetcherHandler):
                         fetchedsize = os.path.getsize(localpath)
                     else:
                         fetchedsize = None
-                    item.setSucceeded(localpath, fetchedsize)
+                    targetpath = localpath
+                    if stream:
+                        targetpath = self.finishStream(item, stream, localpath)
+                    item.setSucceeded(targetpath, fetchedsize)
 
                     if "last-modified" in info:
                         mtimes = info["last-modified"]
@@ -1320,6 +1550,9 @@ class URLLIBHandler(FetcherHandler):
                             mtime = calendar.timegm(mtimet)
                             os.utime(localpath, (mtime, mtime))
 
+                    self.saveValidators(localpath, info.get("etag"),
+                                        info.get("last-modified"))
+
             except urllib.addinfourl, remote:
                 if remote.errcode == 304: # Not modified
                     item.setSucceeded(localpath)
@@ -1339,6 +1572,9 @@ class URLLIBHandler(FetcherHandler):
             except FetcherCancelled:
                 item.setCancelled()
 
+            if stream:
+                stream.abort()
+
         self._lock.acquire()
         self._active -= 1
         self._lock.release()
@@ -1470,6 +1706,7 @@ class URLLIB2Handler(FetcherHandler):
                     remote.close()
 
                 os.rename(localpathpart, localpath)
+                forgetFileDigests(localpath)
 
                 valid, reason = fetcher.validate(url, localpath,
                                                  withreason=True)
@@ -1519,6 +1756,349 @@ Fetcher.setHandler("https", URLLIB2Handler)
 Fetcher.setHandler("gopher", URLLIB2Handler)
 """#"""
 
+class HTTPKeepAliveHandler(FetcherHandler):
+
+    # Each thread fetches items for a single host, reusing the same
+    # HTTP/1.1 connection, and leaves the connection in a shared pool
+    # of idle connections when it's done.
+
+    MAXACTIVE = 10
+    MAXPERHOST = 2
+    MAXIDLE = 2
+    MAXREDIRECTS = 5
+
+    _idle = {} # key -> [connection]
+    _idlelock = thread.allocate_lock()
+
+    def __init__(self, *args):
+        FetcherHandler.__init__(self, *args)
+        self._active = {} # key -> threads
+        self._lock = thread.allocate_lock()
+
+    def getKey(self, url):
+        proxy = urllib.getproxies().get(url.scheme)
+        if proxy and urllib.proxy_bypass(url.host):
+            proxy = None
+        return (url.scheme, url.host, url.port, proxy)
+
+    def tick(self):
+        self._lock.acquire()
+        if self._queue:
+            maxperhost = sysconf.get("http-connections-per-host",
+                                     self.MAXPERHOST)
+            queued = {}
+            for item in self._queue:
+                key = self.getKey(item.getURL())
+                queued[key] = queued.get(key, 0)+1
+            active = sum(self._active.values())
+            for key in queued:
+                wanted = min(queued[key], maxperhost)
+                while (self._active.get(key, 0) < wanted and
+                       active < self.MAXACTIVE and
+                       self.changeActiveDownloads(+1)):
+                    self._active[key] = self._active.get(key, 0)+1
+                    active += 1
+                    thread.start_new_thread(self.work, (key,))
+        self._lock.release()
+        return bool(self._queue or self._active)
+
+    def work(self, key):
+        connections = {}
+        while not self._cancel:
+            self._lock.acquire()
+            for i in range(len(self._queue)-1,-1,-1):
+                if self.getKey(self._queue[i].getURL()) == key:
+                    item = self._queue.pop(i)
+                    break
+            else:
+                item = None
+            self._lock.release()
+            if not item:
+                break
+            self.fetch(item, connections)
+
+        self._idlelock.acquire()
+        for connkey, conn in connections.items():
+            idle = self._idle.setdefault(connkey, [])
+            if conn.sock and len(idle) < self.MAXIDLE:
+                idle.append(conn)
+            else:
+                conn.close()
+        self._idlelock.release()
+
+        self._lock.acquire()
+        self._active[key] -= 1
+        if not self._active[key]:
+            del self._active[key]
+        self._lock.release()
+
+        self.changeActiveDownloads(-1)
+
+    def getConnection(self, connections, key):
+        import httplib
+        conn = connections.get(key)
+        if conn:
+            return conn
+        self._idlelock.acquire()
+        idle = self._idle.get(key)
+        if idle:
+            conn = idle.pop()
+        self._idlelock.release()
+        if not conn:
+            scheme, host, port, proxy = key
+            if port:
+                port = int(port)
+            if scheme == "https":
+                cls = httplib.HTTPSConnection
+            else:
+                cls = httplib.HTTPConnection
+            if proxy:
+                proxyhost, proxyport, proxyauth = self.splitProxy(proxy)
+                conn = cls(proxyhost, proxyport)
+                if scheme == "https":
+                    headers = {}
+                    if proxyauth:
+                        headers["Proxy-Authorization"] = proxyauth
+                    conn.set_tunnel(host, port, headers)
+            else:
+                conn = cls(host, port)
+            conn.requests = 0
+        connections[key] = conn
+        return conn
+
+    def splitProxy(self, proxy):
+        import base64
+        scheme, rest = urllib.splittype(proxy)
+        host, rest = urllib.splithost(rest)
+        user, host = urllib.splituser(host)
+        host, port = urllib.splitport(host)
+        if port:
+            port = int(port)
+        auth = None
+        if user:
+            auth = "Basic "+base64.b64encode(urllib.unquote(user))
+        return host, port, auth
+
+    def request(self, connections, target, headers):
+        import httplib, urlparse, base64
+        for i in range(self.MAXREDIRECTS+1):
+            url = URL(target)
+            key = self.getKey(url)
+            conn = self.getConnection(connections, key)
+            requestheaders = headers.copy()
+            if url.user:
+                auth = "%s:%s" % (url.user, url.passwd)
+                requestheaders["Authorization"] = \
+                    "Basic "+base64.b64encode(auth)
+            scheme, rest = urllib.splittype(target)
+            host, selector = urllib.splithost(rest)
+            proxy = key[3]
+            if proxy and url.scheme != "https":
+                # Plain proxies want the whole URL, without user info.
+                selector = "%s://%s%s" % (scheme,
+                                          urllib.splituser(host)[1],
+                                          selector)
+                proxyauth = self.splitProxy(proxy)[2]
+                if proxyauth:
+                    requestheaders["Proxy-Authorization"] = proxyauth
+            try:
+                conn.request("GET", selector or "/", headers=requestheaders)
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                # The server may have closed an idle connection.
+                conn.close()
+                if not conn.requests:
+                    raise
+                conn.request("GET", selector or "/", headers=requestheaders)
+                response = conn.getresponse()
+            conn.requests += 1
+            location = response.getheader("location")
+            if response.status in (301, 302, 303, 307) and location:
+                response.read()
+                target = urlparse.urljoin(target, location)
+                continue
+            return response
+        raise Error, _("Too many redirections")
+
+    def fetch(self, item, connections):
+        import httplib, rfc822, calendar
+        from time import time, sleep
+
+        fetcher = self._fetcher
+        url = item.getURL()
+
+        item.start()
+
+        stream = None
+
+        try:
+
+            localpath = self.getLocalPath(item)
+            current = 0
+            total = None
+
+            size = item.getInfo("size")
+
+            headers = {"User-Agent": "smart/" + VERSION}
+
+            if (os.path.isfile(localpath) and
+                fetcher.validate(item, localpath)):
+                headers.update(self.getConditionalHeaders(localpath))
+
+            localpathpart = localpath+".part"
+            if os.path.isfile(localpathpart):
+                partsize = os.path.getsize(localpathpart)
+                if not size or partsize < size:
+                    headers["Range"] = "bytes=%d-" % partsize
+            else:
+                partsize = 0
+
+            remote = self.request(connections, url.original, headers)
+
+            if remote.status == 416 and "Range" in headers:
+                # Range not satisfiable, try again without it.
+                remote.read()
+                del headers["Range"]
+                remote = self.request(connections, url.original, headers)
+
+            if remote.status == 304: # Not modified
+                remote.read()
+                item.setSucceeded(localpath)
+                return
+            elif remote.status == 404:
+                remote.read()
+                # Use a standard translatable error message.
+                item.setFailed(_("File not found"))
+                return
+            elif remote.status not in (200, 206):
+                remote.read()
+                item.setFailed(remote.reason)
+                return
+
+            contentlength = remote.getheader("content-length")
+            if contentlength:
+                total = int(contentlength)
+            elif size:
+                total = size
+
+            if remote.status == 206:
+                openmode = "a"
+                current = partsize
+                if contentlength:
+                    total += partsize
+            else:
+                partsize = 0
+                openmode = "w"
+
+            if size and total and size != total:
+                raise Error, _("Server reports unexpected size")
+
+            try:
+                local = open(localpathpart, openmode)
+            except (IOError, OSError), e:
+                raise IOError, "%s: %s" % (localpathpart, e)
+
+            if openmode == "w":
+                stream = fetcher.getStreamUncompressor(item, localpath)
+                digests = fetcher.getStreamDigests(item)
+            else:
+                digests = None
+
+            rate_limit = self._fetcher._maxdownloadrate
+            if rate_limit:
+                rate_limit /= sum(self._active.values())
+                start = time()
+
+            try:
+                data = remote.read(BLOCKSIZE)
+                while data:
+                    if self._cancel:
+                        raise FetcherCancelled
+                    local.write(data)
+                    if digests:
+                        digests.update(data)
+                    if stream:
+                        stream.write(data)
+                    current += len(data)
+                    item.progress(current, total)
+                    if rate_limit:
+                        elapsed_time = time() - start
+                        if elapsed_time != 0:
+                            expected_time = current / rate_limit
+                            sleep_time = expected_time - elapsed_time
+                            if sleep_time > 0:
+                                sleep(sleep_time)
+                    data = remote.read(BLOCKSIZE)
+            finally:
+                local.close()
+
+            os.rename(localpathpart, localpath)
+            forgetFileDigests(localpath)
+
+            if digests:
+                digests = digests.getDigests()
+            valid, reason = fetcher.validate(item, localpath,
+                                             withreason=True,
+                                             digests=digests)
+            if not valid:
+                if openmode == "a":
+                    # Try again, from the very start.
+                    item.reset()
+                    self._lock.acquire()
+                    self._queue.append(item)
+                    self._lock.release()
+                else:
+                    raise Error, reason
+            else:
+                if total:
+                    fetchedsize = total-partsize
+                elif not partsize:
+                    fetchedsize = os.path.getsize(localpath)
+                else:
+                    fetchedsize = None
+                targetpath = localpath
+                if stream:
+                    targetpath = self.finishStream(item, stream, localpath)
+                item.setSucceeded(targetpath, fetchedsize)
+
+                lastmodified = remote.getheader("last-modified")
+                if lastmodified:
+                    mtimet = rfc822.parsedate(lastmodified)
+                    if mtimet:
+                        mtime = calendar.timegm(mtimet)
+                        os.utime(localpath, (mtime, mtime))
+
+                self.saveValidators(localpath, remote.getheader("etag"),
+                                    lastmodified)
+
+        except (IOError, OSError, Error, socket.error,
+                httplib.HTTPException, ValueError), e:
+            self.closeConnections(connections)
+            try:
+                errmsg = unicode(e[1])
+            except IndexError:
+                errmsg = unicode(e)
+            item.setFailed(errmsg)
+
+        except FetcherCancelled:
+            self.closeConnections(connections)
+            item.setCancelled()
+
+        if stream:
+            stream.abort()
+
+    def closeConnections(self, connections):
+        # Responses may have been left half read.
+        for conn in connections.values():
+            conn.close()
+        connections.clear()
+
+def enableHTTPKeepAlive():
+    Fetcher.setHandler("http", HTTPKeepAliveHandler)
+    Fetcher.setHandler("https", HTTPKeepAliveHandler)
+
+hooks.register("enable-http-keep-alive", enableHTTPKeepAlive)
+
 class PyCurlHandler(FetcherHandler):
 
     MAXACTIVE = 5
@@ -1589,9 +2169,14 @@ class PyCurlHandler(FetcherHandler):
                     if os.path.isfile(localpath):
                         os.unlink(localpath)
                     os.rename(localpath+".part", localpath)
+                    forgetFileDigests(localpath)
                     mtime = handle.getinfo(pycurl.INFO_FILETIME)
                     if mtime != -1:
                         os.utime(localpath, (mtime, mtime))
+                    if url.scheme in ("http", "https"):
+                        self.saveValidators(localpath,
+                                            handle.headers.get("etag"),
+                                            handle.headers.get("last-modified"))
 
                 del self._active[handle]
                 userhost = (url.user, url.host, url.port)
@@ -1716,6 +2301,16 @@ class PyCurlHandler(FetcherHandler):
                                 item.progress(partsize+downcurrent,
                                               partsize+downtotal)
 
+                        handle.headers = {}
+
+                        def header(line, headers=handle.headers):
+                            if line.startswith("HTTP/"):
+                                # Only the last response matters.
+                                headers.clear()
+                            elif ":" in line:
+                                name, value = line.split(":", 1)
+                                headers[name.strip().lower()] = value.strip()
+
                         handle.setopt(pycurl.URL, str(url))
                         handle.setopt(pycurl.OPT_FILETIME, 1)
                         handle.setopt(pycurl.LOW_SPEED_LIMIT, 1)
@@ -1725,10 +2320,12 @@ class PyCurlHandler(FetcherHandler):
                         handle.setopt(pycurl.WRITEDATA, local)
                         handle.setopt(pycurl.FOLLOWLOCATION, 1)
                         handle.setopt(pycurl.MAXREDIRS, 5)
-                        handle.setopt(pycurl.HTTPHEADER, ["Pragma:"])
+                        handle.setopt(pycurl.HEADERFUNCTION, header)
                         handle.setopt(pycurl.USERAGENT, "smart/" + VERSION)
                         handle.setopt(pycurl.FAILONERROR, 1)
 
+                        httpheader = ["Pragma:"]
+
                         # check if we have a valid local file and use I-M-S
                         if fetcher.validate(item, localpath):
                             handle.setopt(pycurl.TIMECONDITION,
@@ -1736,11 +2333,18 @@ class PyCurlHandler(FetcherHandler):
                             mtime = os.path.getmtime(localpath)
                             if url.scheme == "ftp":
                                 mtime += 1 # libcurl handles ftp mtime wrongly
+                            else:
+                                validators = self.loadValidators(localpath)
+                                if "etag" in validators:
+                                    httpheader.append("If-None-Match: " +
+                                                      validators["etag"])
                             handle.setopt(pycurl.TIMEVALUE, int(mtime))
                         else:
                             # reset the I-M-S option 
                             handle.setopt(pycurl.TIMECONDITION,
                                           pycurl.TIMECONDITION_NONE)
+
+                        handle.setopt(pycurl.HTTPHEADER, httpheader)
                                           
                         rate_limit = self._fetcher._maxdownloadrate
                         if rate_limit:
@@ -1764,6 +2368,10 @@ class PyCurlHandler(FetcherHandler):
             while res == mp:
                 res, num = multi.perform()
             self._lock.release()
+            if num < len(self._active):
+                # Some transfer is done, so info_read() in tick()
+                # has something to report.
+                self._fetcher.wakeUp()
             multi.select(1.0)
         # Keep in mind that even though the while above has exited due to
         # self._active being False, it may actually be true *here* due to
@@ -1889,6 +2497,7 @@ class SCPHandler(FetcherHandler):
                     raise Error, output
 
                 os.rename(item.localpath, localpath)
+                forgetFileDigests(localpath)
 
                 fetchedsize = os.path.getsize(localpath)
 
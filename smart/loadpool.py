@@ -0,0 +1,203 @@
+#
+# Copyright (c) 2009 Smart Package Manager Team.
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart.cache import Loader, Cache
+from smart.diskcache import DiskCache
+from smart.interface import Interface
+from smart import *
+import signal
+import select
+import struct
+import errno
+import os
+
+#
+# Loaders are parsed by forked workers, each one writing records to
+# its own pipe as loaders are done. A record is the loader position
+# and the length of the data, followed by the loader section as
+# dumped by DiskCache. A negative length means the worker couldn't
+# load that loader, and the parent should load it by itself.
+#
+
+RECORD = "<ii"
+RECORDSIZE = struct.calcsize(RECORD)
+
+def isForkable(loader):
+    # Loaders which hook side effects into buildPackage() must
+    # run them in the parent process.
+    for cls in type(loader).__mro__:
+        if cls is Loader:
+            return True
+        if "buildPackage" in cls.__dict__:
+            return False
+    return True
+
+def loadInParallel(cache, loaders, jobs):
+    """
+    Load the given loaders, which must already be added to the cache,
+    using up to jobs worker processes. Packages are built in the
+    parent in the order of the loaders list, so the resulting cache
+    is the same as if the loaders were loaded one after the other.
+    """
+    steps = {}
+    forkable = []
+    for i, loader in enumerate(loaders):
+        if isForkable(loader):
+            steps[i] = loader.getLoadSteps()
+            forkable.append(i)
+    jobs = min(jobs, len(forkable))
+    if jobs < 2 or not hasattr(os, "fork"):
+        for loader in loaders:
+            loader.load()
+        return
+
+    # Give bigger loaders out first, each to the least busy worker.
+    forkable.sort(lambda x, y: cmp(steps[y], steps[x]))
+    queues = [[] for i in range(jobs)]
+    load = [0]*jobs
+    for i in forkable:
+        j = load.index(min(load))
+        queues[j].append(i)
+        load[j] += steps[i]
+
+    diskcache = DiskCache(None)
+    workers = {}
+    try:
+        for queue in queues:
+            r, w = os.pipe()
+            pid = os.fork()
+            if not pid:
+                status = 1
+                try:
+                    try:
+                        os.close(r)
+                        for fd in workers:
+                            os.close(fd)
+                        _work(diskcache, loaders, queue, w)
+                        status = 0
+                    except:
+                        pass
+                finally:
+                    os._exit(status)
+            os.close(w)
+            workers[r] = Worker(pid)
+
+        prog = iface.getProgress(cache)
+        results = {}
+        for i, loader in enumerate(loaders):
+            if i not in steps:
+                loader.load()
+                continue
+            while i not in results and workers:
+                readResults(workers, results)
+            data = results.pop(i, None)
+            if data is None:
+                loader.load()
+            else:
+                diskcache.loadSection(loader, data)
+                prog.add(steps[i])
+                prog.show()
+        while workers:
+            readResults(workers, results)
+    finally:
+        for fd, worker in workers.items():
+            os.close(fd)
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except OSError:
+                pass
+            worker.wait()
+
+class Worker(object):
+
+    def __init__(self, pid):
+        self.pid = pid
+        self._chunks = []
+        self._size = 0
+        self._record = None
+
+    def feed(self, data, results):
+        self._chunks.append(data)
+        self._size += len(data)
+        while True:
+            if self._record is None:
+                if self._size < RECORDSIZE:
+                    break
+                self._record = struct.unpack(RECORD,
+                                             self._take(RECORDSIZE))
+            i, length = self._record
+            if length < 0:
+                results[i] = None
+            elif self._size < length:
+                break
+            else:
+                results[i] = self._take(length)
+            self._record = None
+
+    def _take(self, length):
+        data = "".join(self._chunks)
+        self._chunks = [data[length:]]
+        self._size -= length
+        return data[:length]
+
+    def wait(self):
+        while True:
+            try:
+                os.waitpid(self.pid, 0)
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    break
+            else:
+                break
+
+def readResults(workers, results):
+    try:
+        readable = select.select(workers.keys(), [], [])[0]
+    except select.error, e:
+        if e[0] != errno.EINTR:
+            raise
+        return
+    for fd in readable:
+        worker = workers[fd]
+        data = os.read(fd, 65536)
+        if data:
+            worker.feed(data, results)
+        else:
+            del workers[fd]
+            os.close(fd)
+            worker.wait()
+
+def _work(diskcache, loaders, queue, fd):
+    # Only the parent may drive the progress of the real interface.
+    iface.object = Interface(None)
+    file = os.fdopen(fd, "wb")
+    for i in queue:
+        loader = loaders[i]
+        try:
+            loader.setCache(Cache())
+            loader.load()
+            data = diskcache.dumpSection(loader)
+        except Error:
+            # The parent will load it again and report the problem.
+            file.write(struct.pack(RECORD, i, -1))
+        else:
+            file.write(struct.pack(RECORD, i, len(data)))
+            file.write(data)
+        file.flush()
+    file.close()
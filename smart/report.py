@@ -25,6 +25,36 @@ from smart.const import INSTALL, REMOVE
 from smart.fetcher import Fetcher, FetchItem
 from smart import *
 
+# Installed packages of the last cache asked for, along with packages
+# which would upgrade them, as found by a scan over the whole cache.
+_upgradable = {}
+
+def getUpgradable(cache):
+    """
+    Return a list of (pkg, upgpkgs) tuples, with every installed package
+    which may be upgraded and the packages upgrading it. The result is
+    kept until the cache is loaded again.
+    """
+    upgradable = _upgradable.get(cache)
+    if upgradable is None:
+        _upgradable.clear()
+        upgradable = _upgradable[cache] = []
+        for pkg in cache.getPackages():
+            if pkg.installed:
+                upgpkgs = {}
+                for prv in pkg.provides:
+                    for upg in prv.upgradedby:
+                        for upgpkg in upg.packages:
+                            upgpkgs[upgpkg] = True
+                if upgpkgs:
+                    upgradable.append((pkg, upgpkgs.keys()))
+    return upgradable
+
+def resetUpgradable(cache):
+    _upgradable.pop(cache, None)
+
+hooks.register("cache-loaded", resetUpgradable)
+
 class Report(object):
 
     def __init__(self, changeset):
@@ -64,9 +94,14 @@ class Report(object):
         self.requires.clear()
         self.requiredby.clear()
 
-    def compute(self):
+    def compute(self, notupgraded=False):
+        """
+        Classify the packages in the changeset. Installed packages which
+        could be upgraded but won't be are only looked for, through the
+        whole cache, when notupgraded is true.
+        """
         changeset = self._changeset
-        for pkg in changeset.getCache().getPackages():
+        for pkg in changeset:
             if pkg in self.exclude:
                 continue
             if changeset.get(pkg) is REMOVE:
@@ -119,21 +154,6 @@ class Report(object):
                 if (pkg not in self.upgrading and
                     pkg not in self.downgrading):
                     self.installing[pkg] = True
-            elif pkg.installed:
-                notupgraded = {}
-                try:
-                    for prv in pkg.provides:
-                        for upg in prv.upgradedby:
-                            for upgpkg in upg.packages:
-                                if changeset.get(upgpkg) is INSTALL:
-                                    raise StopIteration
-                                else:
-                                    notupgraded[upgpkg] = True
-                except StopIteration:
-                    pass
-                else:
-                    if notupgraded:
-                        self.notupgraded[pkg] = notupgraded.keys()
 
             pkgop = changeset.get(pkg)
             if pkgop:
@@ -171,6 +191,20 @@ class Report(object):
                 if map:
                     self.requiredby[pkg] = map.keys()
 
+        if notupgraded:
+            self.computeNotUpgraded()
+
+    def computeNotUpgraded(self):
+        changeset = self._changeset
+        for pkg, upgpkgs in getUpgradable(changeset.getCache()):
+            if pkg in self.exclude or changeset.get(pkg):
+                continue
+            for upgpkg in upgpkgs:
+                if changeset.get(upgpkg) is INSTALL:
+                    break
+            else:
+                self.notupgraded[pkg] = upgpkgs[:]
+
     def getDownloadSize(self):
         total = 0
         for pkg in self.install:
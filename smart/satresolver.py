@@ -0,0 +1,483 @@
+#
+# Copyright (c) 2009 Smart Package Manager Team.
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart.transaction import Failed, lock_reason, sortUpgrades
+from smart.const import INSTALL, REMOVE, UPGRADE, FIX, REINSTALL, KEEP
+from smart.const import LOCKED_INSTALL, LOCKED_REMOVE
+from smart.util.sat import Solver
+from smart import *
+
+# How many times the solutions found are looked over for changes
+# which could lower the weight.
+IMPROVEPASSES = 3
+
+
+class SATResolver(object):
+    """
+    Resolve the queue of a transaction by encoding the relations of
+    the packages involved as clauses. Each package has a variable
+    telling if it's in the system after the transaction, and
+
+    - packages requiring something need one of its providers,
+    - conflicting packages, and packages with the same name which
+      can't coexist, exclude each other,
+    - locked and queued packages are kept as requested.
+
+    Only packages which may change get a variable, and the ones
+    installed are only looked further when they get removed. Upgrades
+    are preferred when deciding, and the solutions found are then
+    improved while that lowers the weight given by the policy.
+
+    Recommends of the packages being installed are soft preferences.
+    They aren't clauses, but solutions leaving fewer of them out are
+    preferred over lighter ones while improving, as the heuristic
+    solver installs them whenever it can.
+    """
+
+    def __init__(self, trans):
+        self._trans = trans
+        self._cache = trans.getCache()
+        self._policy = trans.getPolicy()
+        self._solver = Solver()
+        self._vars = {}
+        self._pkgs = [None]
+        self._pending = []
+        self._pairs = {}
+        self._fix = {}
+        self._targets = {}
+        self._expanded = {}
+        self._relaxed = {}
+        self._required = {}
+        self._clauses = 0
+
+    def run(self):
+        """
+        Return the changeset resolving the queue of the transaction.
+        """
+        self._queue = queue = self._trans.getQueue()
+        self._locked = locked = self._policy.getLockedSet()
+        self._changeset = changeset = self._trans.getChangeSet().copy()
+        isinst = changeset.installed
+
+        self._assumptions = assumptions = []
+        self._reasons = reasons = {}
+        upgpkgs = []
+        for pkg in queue:
+            op = queue[pkg]
+            if op is KEEP:
+                if pkg in changeset:
+                    del changeset[pkg]
+                installed = pkg.installed
+            elif op is INSTALL:
+                if not isinst(pkg) and pkg in locked:
+                    raise Failed, _("Can't install %s: it's locked") % pkg
+                installed = True
+            elif op is REMOVE:
+                if isinst(pkg) and pkg in locked:
+                    raise Failed, _("Can't remove %s: it's locked") % pkg
+                installed = False
+            elif op is REINSTALL:
+                if pkg in locked:
+                    raise Failed, _("Can't reinstall %s: it's locked") % pkg
+                installed = True
+            else:
+                if op is UPGRADE:
+                    upgpkgs.append(pkg)
+                else:
+                    if op is FIX:
+                        self._fix[pkg] = True
+                    self._getVar(pkg)
+                continue
+            lit = self._getLiteral(pkg, installed)
+            assumptions.append(lit)
+            if installed:
+                reasons[lit] = (LOCKED_INSTALL, None)
+            else:
+                reasons[lit] = (LOCKED_REMOVE, None)
+        # Upgrades are decided on first, in the order they'd be tried.
+        sortUpgrades(upgpkgs, self._policy)
+        for i in range(len(upgpkgs)):
+            self._targets[upgpkgs[i]] = 2.-float(i)/len(upgpkgs)
+            self._getVar(upgpkgs[i])
+        for pkg in changeset:
+            self._getVar(pkg)
+        self._encode()
+
+        solver = self._solver
+        while not self._solve([]):
+            core = solver.getCore()
+            dropped = [x for x in core if x > 0 and
+                       queue.get(self._pkgs[x]) is INSTALL]
+            if dropped and sysconf.has("attempt-install", soft=True):
+                # Give up on one of the packages instead.
+                assumptions.remove(dropped[0])
+                continue
+            lines = [lock_reason(self._pkgs[abs(x)], reasons[x])
+                     for x in core]
+            lines.sort()
+            raise Failed, _("Can't satisfy all requested changes:\n    %s") \
+                          % "\n    ".join(lines)
+
+        solution = self._getSolution()
+        weight = self._getWeight(solution)
+        for i in range(IMPROVEPASSES):
+            improved = False
+            for lits in self._getCandidates(solution):
+                result = self._improve(lits, solution, weight)
+                if result:
+                    solution, weight = result
+                    improved = True
+            if not improved:
+                break
+
+        self._apply(solution)
+        for pkg in queue:
+            op = queue[pkg]
+            if op is REINSTALL:
+                changeset.set(pkg, INSTALL, force=True)
+            if (op is INSTALL or op is REINSTALL) and pkg in changeset:
+                changeset.setRequested(pkg, True)
+
+        stats = self.getStats()
+        iface.debug(_("SAT resolver: %d packages, %d clauses, "
+                      "%d decisions, %d conflicts")
+                    % (stats["packages"], stats["clauses"],
+                       stats["decisions"], stats["conflicts"]))
+        return changeset
+
+    def getStats(self):
+        stats = self._solver.getStats()
+        stats["packages"] = len(self._vars)
+        stats["clauses"] = self._clauses
+        return stats
+
+    def _getVar(self, pkg):
+        var = self._vars.get(pkg)
+        if var is None:
+            # Everything stays as it is unless needed, and installed
+            # packages are decided on first, so that they're kept.
+            installed = self._changeset.installed(pkg)
+            var = self._solver.newVar(installed, float(installed))
+            self._vars[pkg] = var
+            self._pkgs.append(pkg)
+            self._pending.append(pkg)
+            if pkg in self._locked:
+                lit = installed and var or -var
+                if lit not in self._reasons:
+                    self._assumptions.append(lit)
+                    self._reasons[lit] = self._locked[pkg]
+        return var
+
+    def _getLiteral(self, pkg, installed):
+        var = self._getVar(pkg)
+        if installed:
+            return var
+        return -var
+
+    def _addClause(self, lits):
+        self._solver.addClause(lits)
+        self._clauses += 1
+
+    def _addExclusion(self, pkg1, pkg2):
+        isinst = self._changeset.installed
+        if (isinst(pkg1) and isinst(pkg2) and
+            pkg1 not in self._fix and pkg2 not in self._fix):
+            # They're already together, and not asked to be fixed.
+            return
+        var1 = self._vars[pkg1]
+        var2 = self._vars[pkg2]
+        pair = (min(var1, var2), max(var1, var2))
+        if pair not in self._pairs:
+            self._pairs[pair] = True
+            self._addClause([-var1, -var2])
+
+    def _encode(self):
+        # Packages not installed only get a variable if something may
+        # require them to be installed. Otherwise they're left out,
+        # since they'll stay out of the system.
+        vars = self._vars
+        isinst = self._changeset.installed
+        getVar = self._getVar
+        while self._pending:
+            pkg = self._pending.pop()
+
+            for req in pkg.requires:
+                self._encodeRequires(pkg, req)
+
+            for cnf in pkg.conflicts:
+                for prv in cnf.providedby:
+                    for prvpkg in prv.packages:
+                        if prvpkg is not pkg:
+                            if isinst(prvpkg):
+                                getVar(prvpkg)
+                            if prvpkg in vars:
+                                self._addExclusion(pkg, prvpkg)
+
+            for prv in pkg.provides:
+                for cnf in prv.conflictedby:
+                    for cnfpkg in cnf.packages:
+                        if cnfpkg is not pkg:
+                            if isinst(cnfpkg):
+                                getVar(cnfpkg)
+                            if cnfpkg in vars:
+                                self._addExclusion(pkg, cnfpkg)
+
+            for namepkg in self._cache.getPackages(pkg.name):
+                if namepkg is not pkg and not pkg.coexists(namepkg):
+                    if isinst(namepkg):
+                        getVar(namepkg)
+                    if namepkg in vars:
+                        self._addExclusion(pkg, namepkg)
+
+    def _encodeRequires(self, pkg, req):
+        if (pkg, req) in self._required:
+            return
+        isinst = self._changeset.installed
+        vars = self._vars
+        prvpkgs = {}
+        instpkgs = []
+        for prv in req.providedby:
+            for prvpkg in prv.packages:
+                if prvpkg is pkg:
+                    self._required[(pkg, req)] = True
+                    return
+                prvpkgs[prvpkg] = True
+                if isinst(prvpkg):
+                    if prvpkg not in vars:
+                        # It stays installed, as far as we know now.
+                        return
+                    instpkgs.append(prvpkg)
+        self._required[(pkg, req)] = True
+        if not instpkgs:
+            if isinst(pkg) and pkg not in self._fix:
+                # It's already broken, and not asked to be fixed.
+                return
+            instpkgs = prvpkgs.keys()
+        lits = [-vars[pkg]]
+        for prvpkg in instpkgs:
+            lits.append(self._getVar(prvpkg))
+        if len(instpkgs) < len(prvpkgs):
+            # Providers not installed are only looked at if the
+            # installed ones go away. Until then the requirement
+            # is relaxed with a variable which is assumed false.
+            relaxvar = self._solver.newVar()
+            self._pkgs.append(None)
+            self._relaxed[relaxvar] = (lits[1:], [x for x in prvpkgs
+                                                  if x not in instpkgs])
+            lits.append(relaxvar)
+        self._addClause(lits)
+
+    def _expand(self, pkg):
+        # Packages requiring an installed package may break once it's
+        # removed, and other versions may replace it, so these are
+        # only looked at then.
+        isinst = self._changeset.installed
+        getVar = self._getVar
+        self._expanded[pkg] = updown = []
+        for prv in pkg.provides:
+            for req in prv.requiredby:
+                for reqpkg in req.packages:
+                    if reqpkg in self._vars:
+                        self._encodeRequires(reqpkg, req)
+                    elif isinst(reqpkg):
+                        getVar(reqpkg)
+            for upg in prv.upgradedby:
+                for upgpkg in upg.packages:
+                    if not isinst(upgpkg):
+                        updown.append(getVar(upgpkg))
+        for upg in pkg.upgrades:
+            for prv in upg.providedby:
+                for prvpkg in prv.packages:
+                    if not isinst(prvpkg):
+                        updown.append(getVar(prvpkg))
+
+    def _relax(self, relaxvar):
+        lits = [-relaxvar]
+        for prvpkg in self._relaxed.pop(relaxvar)[1]:
+            lits.append(self._getVar(prvpkg))
+        self._addClause(lits)
+
+    def _solve(self, lits, solution=None):
+        # Solve the problem as encoded so far, and then look at what
+        # was left out and may matter for the solution found.
+        isinst = self._changeset.installed
+        pkgs = self._pkgs
+        solver = self._solver
+        while True:
+            # Start over close to the original state, except for the
+            # upgrades, which are all tried at first, and then kept as
+            # in the given solution.
+            for var in range(1, len(pkgs)):
+                pkg = pkgs[var]
+                if pkg is None:
+                    continue
+                activity = self._targets.get(pkg)
+                if activity is None:
+                    installed = isinst(pkg)
+                    solver.setPhase(var, installed)
+                    solver.setActivity(var, float(installed))
+                else:
+                    solver.setPhase(var, solution is None or solution[var])
+                    solver.setActivity(var, activity)
+            relaxed = [-x for x in self._relaxed]
+            if solver.solve(self._assumptions+lits+relaxed):
+                found = self._getSolution()
+                expand = []
+                relax = []
+                for relaxvar in self._relaxed:
+                    for var in self._relaxed[relaxvar][0]:
+                        if found[var]:
+                            break
+                    else:
+                        relax.append(relaxvar)
+                if not relax:
+                    # Removals may be due to relaxed requirements, so
+                    # these are only looked at when nothing else is.
+                    expand = [x for x in range(1, len(found))
+                              if not found[x] and pkgs[x] is not None and
+                                 isinst(pkgs[x]) and
+                                 pkgs[x] not in self._expanded]
+                    if not expand:
+                        return True
+            else:
+                expand = []
+                relax = [-x for x in solver.getCore() if -x in self._relaxed]
+                if not relax:
+                    return False
+            for var in expand:
+                self._expand(pkgs[var])
+            for var in relax:
+                self._relax(var)
+            self._encode()
+
+    def _improve(self, lits, solution, weight):
+        # Look for a solution where the given literals hold, keeping
+        # the upgrades of the given one, and return it with its weight
+        # if it's better. Among solutions weighting the same, the one
+        # with fewer changes is better.
+        if self._solve(lits, solution):
+            candidate = self._getSolution()
+            candidateweight = self._getWeight(candidate)
+            if candidateweight < weight:
+                return candidate, candidateweight
+        return None
+
+    def _getSolution(self):
+        getValue = self._solver.getValue
+        return [None]+[getValue(var) for var in range(1, len(self._pkgs))]
+
+    def _apply(self, solution, changeset=None):
+        if changeset is None:
+            changeset = self._changeset
+        isinst = changeset.installed
+        pkgs = self._pkgs
+        for var in range(1, len(solution)):
+            pkg = pkgs[var]
+            if pkg is not None and solution[var] != isinst(pkg):
+                changeset.set(pkg, solution[var] and INSTALL or REMOVE)
+        return changeset
+
+    def _getWeight(self, solution):
+        changeset = self._apply(solution, self._changeset.copy())
+        return (len(self._getMissingRecommends(solution)),
+                self._policy.getWeight(changeset), len(changeset))
+
+    def _getMissingRecommends(self, solution):
+        # Return the providers which could be installed for each of
+        # the recommends left out by packages the solution installs.
+        if sysconf.get("ignore-all-recommends", 0) == 1:
+            return []
+        isinst = self._changeset.installed
+        vars = self._vars
+        locked = self._locked
+        def installed(pkg):
+            var = vars.get(pkg)
+            if var is None or var >= len(solution):
+                return isinst(pkg)
+            return solution[var]
+        missing = []
+        for var in range(1, len(solution)):
+            pkg = self._pkgs[var]
+            if pkg is None or not solution[var] or isinst(pkg):
+                continue
+            for req in pkg.recommends:
+                prvpkgs = []
+                for prv in req.providedby:
+                    for prvpkg in prv.packages:
+                        if pkgconf.testFlag("ignore-recommends", prvpkg):
+                            continue
+                        if installed(prvpkg):
+                            break
+                        if prvpkg not in locked:
+                            prvpkgs.append(prvpkg)
+                    else:
+                        continue
+                    break
+                else:
+                    if prvpkgs:
+                        missing.append(prvpkgs)
+        return missing
+
+    def _getCandidates(self, solution):
+        # Try getting the upgrades left out, keeping a single one of
+        # the upgrades replacing a package, undoing other changes,
+        # replacing removed packages by other versions, and removing
+        # packages instead of installing anything else.
+        isinst = self._changeset.installed
+        vars = self._vars
+        candidates = []
+        installs = []
+        replaced = {}
+        for var in range(1, len(solution)):
+            pkg = self._pkgs[var]
+            if pkg in self._targets and solution[var]:
+                for upg in pkg.upgrades:
+                    for prv in upg.providedby:
+                        for prvpkg in prv.packages:
+                            if isinst(prvpkg):
+                                replaced.setdefault(prvpkg, []).append(var)
+        for lst in replaced.values():
+            if len(lst) > 1:
+                for var in lst:
+                    candidates.append([var]+[-x for x in lst if x != var])
+        for var in range(1, len(solution)):
+            pkg = self._pkgs[var]
+            if pkg is None:
+                continue
+            if pkg in self._targets:
+                if not solution[var]:
+                    candidates.append([var])
+                continue
+            if not isinst(pkg) and pkg not in self._queue:
+                installs.append(-var)
+            if solution[var] != isinst(pkg):
+                if solution[var]:
+                    candidates.append([-var])
+                elif pkg not in replaced:
+                    candidates.append([var])
+                    for altvar in self._expanded.get(pkg, ()):
+                        if not solution[altvar]:
+                            candidates.append([altvar])
+        candidates.append(installs)
+        # Try installing what's recommended, one provider at a time.
+        for prvpkgs in self._getMissingRecommends(solution):
+            for prvpkg in prvpkgs:
+                candidates.append([self._getVar(prvpkg)])
+        self._encode()
+        return candidates
@@ -44,6 +44,10 @@ class Searcher(object):
       may implement their own details in the searching mechanism.
 
     - provides is matched in Provides.search(), for the same reason.
+      Only names which may be close enough to the pattern are tried,
+      as told by the search index of each loader, so these methods
+      must compare the pattern with the name, or with strings which
+      start with it.
 
     - requires, recommends, upgrades, and conflicts don't have special
       searching methods. Instead, their usual match() method is given
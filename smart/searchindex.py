@@ -0,0 +1,465 @@
+#
+# Copyright (c) 2009 Smart Package Manager Team.
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart.util.strtools import filterprefixes, globdistance
+from bisect import bisect_left, bisect_right
+from array import array
+import re
+
+# Longer patterns are cut short by the C distance functions.
+MAXPATTERN = 1024
+
+class SearchIndex(object):
+    """
+    Sorted names of the packages in a loader and of what they provide.
+
+    Package.search() and Provides.search() only give a ratio to names
+    which, or which followed by something else, are close enough to
+    the pattern. Since that something else may be anything, a name can
+    only match if it's close enough to some prefix of the pattern, and
+    walking the sorted names tells which are, without computing the
+    distance for each of them.
+
+    The index is built on first use, or when the loader is saved in the
+    disk cache, and it's kept there, so it's only built again when the
+    loader is reset. The path and text indexes are kept with it too, but
+    since they read the info of every package, they're only built on
+    first use, and the loader is saved again once they are.
+    """
+
+    def __init__(self, packages=()):
+        pkgnames = {}
+        prvnames = {}
+        for pkg in packages:
+            pkgnames[pkg.name] = True
+            for prv in pkg.provides:
+                prvnames[prv.name] = True
+        self._pkgnames = pkgnames.keys()
+        self._pkgnames.sort()
+        self._prvnames = prvnames.keys()
+        self._prvnames.sort()
+        self._paths = None
+        self._texts = None
+
+    def addProvides(self, name):
+        # File provides are added after loading. There are few of them,
+        # so keeping the list sorted isn't worth it.
+        self._prvnames.append(name)
+
+    def getPackageNames(self, pattern, maxdistance):
+        return filterprefixes(pattern, self._pkgnames, maxdistance)
+
+    def getProvidesNames(self, pattern, maxdistance):
+        return filterprefixes(pattern, self._prvnames, maxdistance)
+
+    def __getstate__(self):
+        return ("\0".join(self._pkgnames), "\0".join(self._prvnames),
+                self._paths, self._texts)
+
+    def __setstate__(self, state):
+        pkgnames, prvnames, self._paths, self._texts = state
+        self._pkgnames = pkgnames and pkgnames.split("\0") or []
+        self._prvnames = prvnames and prvnames.split("\0") or []
+
+class PathIndex(object):
+    """
+    Paths of the packages in a loader.
+
+    Each path is split after its last slash, and both parts are kept
+    only once, in sorted tables of directories and base names. Entries
+    are sorted by directory, base name and package, so the entries of
+    a directory are contiguous, and _dirpos tells where they start.
+    Packages are given by their position in the loader.
+    """
+
+    def __init__(self, loader=None):
+        dirs = {}
+        bases = {}
+        if loader is not None:
+            for i, pkg in enumerate(loader._packages):
+                for path in loader.getInfo(pkg).getPathList():
+                    j = path.rfind("/")+1
+                    basename = path[j:]
+                    bases[basename] = True
+                    entries = dirs.get(path[:j])
+                    if entries is None:
+                        dirs[path[:j]] = [(basename, i)]
+                    else:
+                        entries.append((basename, i))
+        self._bases = bases.keys()
+        self._bases.sort()
+        for i, basename in enumerate(self._bases):
+            bases[basename] = i
+        self._dirs = dirs.keys()
+        self._dirs.sort()
+        self._dirpos = array("i", [0])
+        self._entbases = array("i")
+        self._entpkgs = array("i")
+        for dirname in self._dirs:
+            entries = dirs[dirname]
+            entries.sort()
+            lastentry = None
+            for entry in entries:
+                if entry != lastentry:
+                    lastentry = entry
+                    self._entbases.append(bases[entry[0]])
+                    self._entpkgs.append(entry[1])
+            self._dirpos.append(len(self._entpkgs))
+
+    def getPackages(self, path):
+        """
+        Return the positions of the packages with the given path.
+        """
+        j = path.rfind("/")+1
+        dirname = path[:j]
+        basename = path[j:]
+        d = bisect_left(self._dirs, dirname)
+        if d == len(self._dirs) or self._dirs[d] != dirname:
+            return []
+        b = bisect_left(self._bases, basename)
+        if b == len(self._bases) or self._bases[b] != basename:
+            return []
+        lo = bisect_left(self._entbases, b, self._dirpos[d], self._dirpos[d+1])
+        hi = bisect_right(self._entbases, b, lo, self._dirpos[d+1])
+        return self._entpkgs[lo:hi].tolist()
+
+    def getDirs(self, pattern, maxdistance):
+        """
+        Return the positions of the directories which may start a path
+        with at most maxdistance edits from the pattern.
+        """
+        dirs = self._dirs
+        return [bisect_left(dirs, x)
+                for x in filterprefixes(pattern, dirs, maxdistance)]
+
+    def matchPaths(self, match, dirs=None):
+        """
+        Call match() once for each path in the given directories, or in
+        all of them, and return a dictionary mapping the position of the
+        packages with a path for which it returned something true to the
+        greatest value returned for their paths.
+        """
+        result = {}
+        bases = self._bases
+        dirpos = self._dirpos
+        entbases = self._entbases
+        entpkgs = self._entpkgs
+        if dirs is None:
+            dirs = range(len(self._dirs))
+        for d in dirs:
+            dirname = self._dirs[d]
+            lastbase = None
+            for e in xrange(dirpos[d], dirpos[d+1]):
+                b = entbases[e]
+                if b != lastbase:
+                    lastbase = b
+                    value = match(dirname+bases[b])
+                if value:
+                    i = entpkgs[e]
+                    if value > result.get(i, 0):
+                        result[i] = value
+        return result
+
+    def __getstate__(self):
+        return ("\0".join(self._dirs), len(self._dirs),
+                "\0".join(self._bases), len(self._bases),
+                self._dirpos.tostring(), self._entbases.tostring(),
+                self._entpkgs.tostring())
+
+    def __setstate__(self, state):
+        dirs, ndirs, bases, nbases, dirpos, entbases, entpkgs = state
+        # A single empty name is joined into nothing, so the length
+        # is needed to tell it from no names at all.
+        self._dirs = ndirs and dirs.split("\0") or []
+        self._bases = nbases and bases.split("\0") or []
+        self._dirpos = array("i", dirpos)
+        self._entbases = array("i", entbases)
+        self._entpkgs = array("i", entpkgs)
+
+class TextIndex(object):
+    """
+    Words found in a text of the packages in a loader.
+
+    Words are runs of ASCII letters and digits, lowercased. A regular
+    expression may only match a text if every run of letters and digits
+    it takes literally is part of some word of the text, so the packages
+    having such words are the only ones worth matching against it.
+    Words are kept sorted and joined in a single string, so the ones
+    containing a run may be found without looking at each of them, and
+    each word has a contiguous list of package positions in _wordpkgs.
+    """
+
+    _wordre = re.compile("[a-z0-9]+")
+
+    def __init__(self, texts=()):
+        findall = self._wordre.findall
+        words = {}
+        for i, text in texts:
+            if not text:
+                continue
+            text = text.lower()
+            if type(text) is unicode:
+                text = text.encode("ascii", "replace")
+            for word in dict.fromkeys(findall(text)):
+                pkgs = words.get(word)
+                if pkgs is None:
+                    words[word] = array("i", [i])
+                else:
+                    pkgs.append(i)
+        self._words = words.keys()
+        self._words.sort()
+        self._wordpos = array("i", [0])
+        self._wordpkgs = array("i")
+        for word in self._words:
+            self._wordpkgs.extend(words[word])
+            self._wordpos.append(len(self._wordpkgs))
+        self._setWords()
+
+    def _setWords(self):
+        # Each word is preceded by a separator, so that _wordstart
+        # gives the word containing any offset of the joined string.
+        self._joined = "".join(["\0"+x for x in self._words])
+        self._wordstart = array("i")
+        start = 0
+        for word in self._words:
+            self._wordstart.append(start)
+            start += len(word)+1
+
+    def getPackages(self, run):
+        """
+        Return a dictionary with the positions of the packages having
+        a word containing the given lowercase run.
+        """
+        result = {}
+        joined = self._joined
+        wordstart = self._wordstart
+        wordpos = self._wordpos
+        wordpkgs = self._wordpkgs
+        nwords = len(self._words)
+        offset = joined.find(run)
+        while offset != -1:
+            w = bisect_right(wordstart, offset)-1
+            for i in wordpkgs[wordpos[w]:wordpos[w+1]]:
+                result[i] = True
+            if w+1 == nwords:
+                break
+            offset = joined.find(run, wordstart[w+1])
+        return result
+
+    def __getstate__(self):
+        return ("\0".join(self._words), len(self._words),
+                self._wordpos.tostring(), self._wordpkgs.tostring())
+
+    def __setstate__(self, state):
+        words, nwords, wordpos, wordpkgs = state
+        self._words = nwords and words.split("\0") or []
+        self._wordpos = array("i", wordpos)
+        self._wordpkgs = array("i", wordpkgs)
+        self._setWords()
+
+def getSearchIndex(loader):
+    index = loader._searchindex
+    if index is None:
+        index = loader._searchindex = SearchIndex(loader._packages)
+    return index
+
+def getPathIndex(loader):
+    index = getSearchIndex(loader)
+    if index._paths is None:
+        index._paths = PathIndex(loader)
+    return index._paths
+
+def getMaxDistance(pattern, cutoff):
+    """
+    Return how many edits globdistance() may find between the pattern
+    and a string for the ratio to be above zero with the given cutoff,
+    or None if that's not bounded.
+    """
+    if "*" in pattern or "?" in pattern or len(pattern) >= MAXPATTERN:
+        return None
+    if type(cutoff) is int:
+        return max(cutoff, 0)
+    if type(cutoff) is not float or cutoff <= 0:
+        return None
+    # The allowed distance grows with the longest string, but strings
+    # longer than the pattern are at least as far as the difference
+    # in length, which grows faster, so past top nothing may match.
+    patternl = len(pattern)
+    top = int((patternl+1)/cutoff)+1
+    if top > MAXPATTERN:
+        return None
+    maxdistance = 0
+    for maxl in range(patternl, top+1):
+        # The C module rounds to single precision first.
+        distance = int(maxl-cutoff*maxl+0.0001)
+        if maxl-patternl <= distance and distance > maxdistance:
+            maxdistance = distance
+    return maxdistance
+
+def getTextIndexes(loader):
+    """
+    Return the text indexes of the summaries and of the descriptions
+    of the packages in the loader.
+    """
+    index = getSearchIndex(loader)
+    if index._texts is None:
+        summaries = []
+        descriptions = []
+        for i, pkg in enumerate(loader._packages):
+            info = loader.getInfo(pkg)
+            summaries.append((i, info.getSummary()))
+            descriptions.append((i, info.getDescription()))
+        index._texts = (TextIndex(summaries), TextIndex(descriptions))
+    return index._texts
+
+def _getLiteralRuns(pattern):
+    # Wildcards and sets are parsed as fnmatch.translate() does.
+    literal = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*" or c == "?":
+            c = " "
+        elif c == "[":
+            j = i
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j < n:
+                c = " "
+                i = j+1
+        literal.append(c)
+    return [str(x) for x in
+            TextIndex._wordre.findall("".join(literal).lower())]
+
+def getTextCandidates(cache, pattern, description=False):
+    """
+    Return a dictionary with the packages in the cache whose summary,
+    or description, may match the given shell-style pattern, or None
+    if any of them may. Text indexes of the loaders are built when
+    missing.
+    """
+    runs = _getLiteralRuns(pattern)
+    if not runs:
+        return None
+    packages = {}
+    for loader in cache._loaders:
+        lpackages = loader._packages
+        textindex = getTextIndexes(loader)[bool(description)]
+        found = None
+        for run in runs:
+            pkgs = textindex.getPackages(run)
+            if found is None:
+                found = pkgs
+            else:
+                for i in found.keys():
+                    if i not in pkgs:
+                        del found[i]
+            if not found:
+                break
+        for i in found:
+            packages[lpackages[i]] = True
+    return packages
+
+def getPathRatios(loader, searcher):
+    """
+    Return a dictionary mapping the packages of the loader with paths
+    matching the path patterns of the searcher to the best ratio
+    found for them, as Loader.search() would compute it.
+    """
+    index = getPathIndex(loader)
+    ic = searcher.ignorecase
+    ratios = {}
+    for spath, cutoff in searcher.path:
+        maxdistance = getMaxDistance(spath, cutoff)
+        if maxdistance is None:
+            dirs = None
+        else:
+            dirs = index.getDirs(spath, maxdistance)
+        def match(path):
+            return globdistance(spath, path, cutoff, ic)[1]
+        for i, ratio in index.matchPaths(match, dirs).iteritems():
+            if ratio > ratios.get(i, 0):
+                ratios[i] = ratio
+    packages = loader._packages
+    return dict([(packages[i], ratio) for i, ratio in ratios.iteritems()])
+
+def getPathPackages(cache, match):
+    """
+    Return a dictionary with the packages in the cache having some
+    path for which match(path) returns something true.
+    """
+    def test(path):
+        return bool(match(path))
+    packages = {}
+    for loader in cache._loaders:
+        lpackages = loader._packages
+        for i in getPathIndex(loader).matchPaths(test):
+            packages[lpackages[i]] = True
+    return packages
+
+def _getNames(cache, patterns, provides):
+    if not cache._linked:
+        return None
+    names = {}
+    for pattern, cutoff in patterns:
+        maxdistance = getMaxDistance(pattern, cutoff)
+        if maxdistance is None:
+            return None
+        for loader in cache._loaders:
+            index = getSearchIndex(loader)
+            if provides:
+                found = index.getProvidesNames(pattern, maxdistance)
+            else:
+                found = index.getPackageNames(pattern, maxdistance)
+            for name in found:
+                names[name] = True
+    return names.keys()
+
+def getSearchPackages(cache, searcher):
+    """
+    Return the packages in the cache which may match the name and
+    version patterns of the searcher.
+    """
+    names = _getNames(cache, searcher.nameversion, False)
+    if names is None:
+        return cache.getPackages()
+    packages = []
+    for lst in cache.getPackagesByNames(names).values():
+        packages.extend(lst)
+    return packages
+
+def getSearchProvides(cache, searcher):
+    """
+    Return the provides in the cache which may match the provides
+    patterns of the searcher.
+    """
+    names = _getNames(cache, searcher.provides, True)
+    if names is None:
+        return cache.getProvides()
+    provides = []
+    for lst in cache.getProvidesByNames(names).values():
+        provides.extend(lst)
+    return provides
+
+# vim:ts=4:sw=4:et
@@ -70,6 +70,7 @@ class ElementSorter(object):
         self._priorities = {}  # {(pred, succ): priority}
         self._predcount = {}   # succ -> n
         self._disabled = set() # set([(pred, succ)])
+        self._components = None # elem -> [elem, ...] with enabled relations
         self._maximum_priority = 0
 
     def reset(self):
@@ -77,6 +78,7 @@ class ElementSorter(object):
         self._priorities.clear()
         self._predcount.clear()
         self._disabled.clear()
+        self._components = None
         self._maximum_priority = 0
 
     def disableRelation(self, relation):
@@ -89,12 +91,28 @@ class ElementSorter(object):
             raise DisableError("Ordering between %r and %r is already disabled."
                                % relation)
         self._disabled.add(relation)
+        components = self._components
+        if components is not None:
+            # Only the component holding the relation may split apart,
+            # so that's the only one which must be computed again.
+            pred, succ = relation
+            component = components[pred]
+            if component is components[succ] and len(component) > 1:
+                follows = self._getFollows()
+                for component in self._getComponents(component, follows,
+                                                     component):
+                    for elem in component:
+                        components[elem] = component
 
     def enableRelation(self, relation):
         if relation not in self._disabled: # XXX UNTESTED
             raise EnableError("Ordering between %r and %r is not disabled."
                               % relation)
         self._disabled.remove(relation)
+        components = self._components
+        if (components is not None and
+            components[relation[0]] is not components[relation[1]]):
+            self._components = None
 
     def getPathData(self, start, end,
                     follow_relations=None, maximum_priority=None):
@@ -134,53 +152,165 @@ class ElementSorter(object):
                 path.pop()
         return (elements, relations)
 
+    def _getFollows(self, follow_relations=None, maximum_priority=None):
+        disabled = self._disabled
+        priorities = self._priorities
+        def follows(relation):
+            return ((relation not in disabled) and
+                    (follow_relations is None or
+                     relation in follow_relations) and
+                    (maximum_priority is None or
+                     priorities[relation] <= maximum_priority))
+        return follows
+
+    def _getComponents(self, roots, follows, within=None):
+        """Return the strongly connected components reachable from C{roots}.
+
+        This is Tarjan's algorithm, walking the graph only once, and
+        without recursion so that long chains of relations don't hit
+        the interpreter limits.  When C{within} is given, elements
+        outside of it are ignored.
+        """
+        successors = self._successors
+        index = {}
+        lowlink = {}
+        stack = []
+        onstack = set()
+        components = []
+        if within is not None:
+            within = set(within)
+        for root in roots:
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            onstack.add(root)
+            work = [(root, iter(successors.get(root, ())))]
+            while work:
+                elem, succs = work[-1]
+                for succ in succs:
+                    if ((within is not None and succ not in within) or
+                        not follows((elem, succ))):
+                        continue
+                    if succ not in index:
+                        index[succ] = lowlink[succ] = len(index)
+                        stack.append(succ)
+                        onstack.add(succ)
+                        work.append((succ, iter(successors.get(succ, ()))))
+                        break
+                    if succ in onstack and index[succ] < lowlink[elem]:
+                        lowlink[elem] = index[succ]
+                else:
+                    work.pop()
+                    if work:
+                        pred = work[-1][0]
+                        if lowlink[elem] < lowlink[pred]:
+                            lowlink[pred] = lowlink[elem]
+                    if lowlink[elem] == index[elem]:
+                        i = len(stack)-1
+                        while stack[i] != elem:
+                            i -= 1
+                        component = stack[i:]
+                        del stack[i:]
+                        onstack.difference_update(component)
+                        components.append(component)
+        return components
+
+    def _getLoopData(self, component, follows):
+        """Return the elements and relations of C{component} in loops."""
+        members = set(component)
+        successors = self._successors
+        relations = set()
+        for elem in component:
+            for succ in successors.get(elem, ()):
+                relation = (elem, succ)
+                if succ in members and follows(relation):
+                    relations.add(relation)
+        if not relations:
+            return None
+        return (members, relations)
+
+    def _findLoops(self, roots, follow_relations=None,
+                      maximum_priority=None):
+        follows = self._getFollows(follow_relations, maximum_priority)
+        loops = []
+        roots = list(roots)
+        checkroots = set(roots)
+        for component in self._getComponents(roots, follows):
+            for elem in component:
+                if elem in checkroots:
+                    data = self._getLoopData(component, follows)
+                    if data:
+                        loops.append(data)
+                    break
+        return loops
+
+    def getComponentOf(self, elem):
+        """Return the elements in the same loop as C{elem}, including itself.
+
+        Components are computed once for all elements, and then kept
+        up to date as relations are disabled.
+        """
+        if self._components is None:
+            components = {}
+            follows = self._getFollows()
+            for component in self._getComponents(self._successors, follows):
+                for member in component:
+                    components[member] = component
+            self._components = components
+        return self._components[elem]
+
     def getLoops(self):
         """Return all elements and relations participating in loops.
 
         The result is the same as for L{getPathData()}, except that only
         elements and relations involved in loops will be returned.
         """
-        all_loop_elements = set()
+        follows = self._getFollows()
         loops = []
+        done = set()
         for elem in self._successors:
-            if elem not in all_loop_elements:
-                loop_elements, loop_relations = self.getPathData(elem, elem)
-                if loop_elements:
-                    done = set([elem])
-                    todo = loop_elements - done
-                    while todo:
-                        loop_elem = todo.pop()
-                        more_elements, more_relations = \
-                            self.getPathData(loop_elem, loop_elem)
-                        loop_elements.update(more_elements)
-                        loop_relations.update(more_relations)
-                        done.add(loop_elem)
-                        more_elements.difference_update(done)
-                        todo.update(more_elements)
-                    loops.append((loop_elements, loop_relations))
-                    all_loop_elements.update(loop_elements)
+            component = self.getComponentOf(elem)
+            if component[0] not in done:
+                done.add(component[0])
+                data = self._getLoopData(component, follows)
+                if data:
+                    loops.append(data)
         return loops
 
     def hasLoop(self, elements, relations):
-        for elem in elements:
-            data = self.getPathData(elem, elem, follow_relations=relations)
-            if data[0]:
-                return True
-        return False
+        return bool(self._findLoops(elements, relations))
 
     def countRelationsInLoop(self, elements, relations, maximum_priority=None):
+        """Return how many of C{relations} are in loops through C{elements}.
+
+        Every followed relation inside the strongly connected components
+        holding C{elements} is counted, since each of them is part of
+        some loop.  This is an upper bound of what L{getPathData()} walks
+        from those elements would find, as these skip relations leading
+        to elements they've already been through.
+        """
         loop_relations = 0
-        loop_elements = set()
-        for elem in elements:
-            if elem not in loop_elements:
-                data = self.getPathData(elem, elem,
-                                        follow_relations=relations,
-                                        maximum_priority=maximum_priority)
-                if data[0]:
-                    loop_elements.update(data[0])
-                    loop_relations += len(data[1])
+        for loop_elements, relations in self._findLoops(elements, relations,
+                                                        maximum_priority):
+            loop_relations += len(relations)
         return loop_relations
 
+    def _hasPath(self, start, end, follow_relations):
+        follows = self._getFollows(follow_relations)
+        successors = self._successors
+        seen = set([start])
+        todo = [start]
+        while todo:
+            elem = todo.pop()
+            for succ in successors.get(elem, ()):
+                if succ not in seen and follows((elem, succ)):
+                    if succ == end:
+                        return True
+                    seen.add(succ)
+                    todo.append(succ)
+        return False
+
     def _getReenableOrder(self, elements, relations):
         follow_relations = set(relations)
         sort_key = {}
@@ -205,11 +335,11 @@ class ElementSorter(object):
 
     def breakLoops(self):
         # Reenable all relations so that we identify all potential
-        # loops correctly, and retrieve data for all loops.  Note that
-        # with all relations enabled, any given element can only possibly
-        # be part of one loop.  If that assumption is broken before loops
-        # are computed, the logic below may not work in weird cases.
+        # loops correctly, and retrieve data for all loops.  Loops are
+        # the strongly connected components of the graph, so any given
+        # element can only possibly be part of one loop.
         self._disabled.clear()
+        self._components = None
         loops = self.getLoops()
 
         for loop_elements, loop_relations in loops:
@@ -230,16 +360,14 @@ class ElementSorter(object):
             for relation in reenable_order:
                 if relation in self._disabled:
                     pred, succ = relation
-                    elements, relations = \
-                        self.getPathData(succ, pred,
-                                         follow_relations=loop_relations)
-                    if not elements:
+                    if not self._hasPath(succ, pred, loop_relations):
                         self.enableRelation(relation)
 
     def addElement(self, elem):
         if elem not in self._successors:
             self._successors[elem] = set()
             self._predcount[elem] = 0
+            self._components = None
 
     def addPredecessor(self, succ, pred, priority=0):
         self.addSuccessor(pred, succ, priority)
@@ -248,6 +376,7 @@ class ElementSorter(object):
         pair = pred, succ
         successors = self._successors
         predcount = self._predcount
+        self._components = None
         if succ not in successors:
             successors[succ] = set()
             predcount[succ] = 0
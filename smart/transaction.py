@@ -21,7 +21,9 @@
 #
 from smart.const import INSTALL, REMOVE, UPGRADE, FIX, REINSTALL, KEEP, LOCKED_EXCLUDE, LOCKED_INSTALL, LOCKED_CONFLICT, LOCKED_CONFLICT_BY, LOCKED_NO_COEXIST, LOCKED_SYSCONF, LOCKED_REMOVE
 from smart.cache import PreRequires, Package
+from smart.util.strtools import dumpJSON
 from smart import *
+import time
 
 def lock_reason(pkg, lockvalue):
     try:
@@ -46,9 +48,105 @@ def lock_reason(pkg, lockvalue):
     else:
         return _("%s is locked (unknown reason)") % pkg
 
-class ChangeSet(dict):
+class CheckpointDict(dict):
+    """
+    Dictionary which can go back to a previous state. After checkpoint(),
+    the original value of every changed key is recorded, so that rollback()
+    undoes the changes, and commit() accepts them, at a cost proportional
+    to the number of changes rather than to the dictionary size.
+    Checkpoints may be nested.
+    """
+
+    def __init__(self, state=None):
+        self._checkpoints = []
+        if state:
+            dict.update(self, state)
+
+    def __setitem__(self, key, value):
+        if self._checkpoints:
+            self._record(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if self._checkpoints:
+            self._record(key)
+        dict.__delitem__(self, key)
+
+    def clear(self):
+        if self._checkpoints:
+            for key in self.keys():
+                del self[key]
+        else:
+            dict.clear(self)
+
+    def update(self, other):
+        if self._checkpoints:
+            for key in other.keys():
+                self[key] = other[key]
+        else:
+            dict.update(self, other)
+
+    def copy(self):
+        return CheckpointDict(self)
+
+    def _record(self, key):
+        checkpoint = self._checkpoints[-1]
+        if key not in checkpoint:
+            checkpoint[key] = dict.get(self, key)
+
+    def _restore(self, key, value):
+        if value is None:
+            if dict.__contains__(self, key):
+                dict.__delitem__(self, key)
+        else:
+            dict.__setitem__(self, key, value)
+
+    def _current(self, key):
+        return dict.get(self, key)
+
+    def checkpoint(self):
+        self._checkpoints.append({})
+
+    def rollback(self):
+        checkpoint = self._checkpoints.pop()
+        for key, value in checkpoint.iteritems():
+            self._restore(key, value)
+
+    def commit(self):
+        checkpoint = self._checkpoints.pop()
+        if self._checkpoints:
+            parent = self._checkpoints[-1]
+            for key in checkpoint:
+                if key not in parent:
+                    parent[key] = checkpoint[key]
+
+    def getChanges(self):
+        """
+        Return the changes made since the last checkpoint, to be given
+        to applyChanges() later.
+        """
+        changes = {}
+        for key in self._checkpoints[-1]:
+            changes[key] = self._current(key)
+        return changes
+
+    def applyChanges(self, changes):
+        for key, value in changes.iteritems():
+            if self._checkpoints:
+                self._record(key)
+            self._restore(key, value)
+
+    def getPrevious(self):
+        """
+        Return the values keys changed since the last checkpoint had
+        before, with None for keys which weren't there.
+        """
+        return self._checkpoints[-1].copy()
+
+class ChangeSet(CheckpointDict):
 
     def __init__(self, cache, state=None, requested=None):
+        CheckpointDict.__init__(self)
         self._cache = cache
         self._requested = {}
         if state:
@@ -57,17 +155,94 @@ class ChangeSet(dict):
             self._requested.update(requested)
 
     def clear(self):
-        dict.clear(self)
+        CheckpointDict.clear(self)
         self._requested.clear()
 
     def update(self, other):
-        dict.update(self, other)
+        CheckpointDict.update(self, other)
         if type(other) is ChangeSet:
+            if self._checkpoints:
+                for pkg in other._requested:
+                    self._record(pkg)
             self._requested.update(other._requested)
 
     def copy(self):
         return ChangeSet(self._cache, self, self._requested)
 
+    # Values recorded in checkpoints are (op, requested) pairs, with
+    # None standing for packages not in the changeset.
+
+    def _record(self, pkg):
+        checkpoint = self._checkpoints[-1]
+        if pkg not in checkpoint:
+            checkpoint[pkg] = self._current(pkg)
+
+    def _current(self, pkg):
+        op = dict.get(self, pkg)
+        if op is None:
+            return None
+        return op, pkg in self._requested
+
+    def getPrevious(self):
+        previous = {}
+        for pkg, value in self._checkpoints[-1].iteritems():
+            previous[pkg] = value and value[0]
+        return previous
+
+    def _restore(self, pkg, value):
+        if value is None:
+            if dict.__contains__(self, pkg):
+                dict.__delitem__(self, pkg)
+            if pkg in self._requested:
+                del self._requested[pkg]
+        else:
+            op, requested = value
+            dict.__setitem__(self, pkg, op)
+            if requested:
+                self._requested[pkg] = True
+            elif pkg in self._requested:
+                del self._requested[pkg]
+
+    def compareChanges(self, changes1, changes2):
+        """
+        Compare the changesets which would result from applying each
+        of the given changes, in the same way dictionaries compare, but
+        only looking at the packages changed.
+        """
+        len1 = len2 = len(self)
+        for pkg, value in changes1.iteritems():
+            len1 += (value is not None) - dict.__contains__(self, pkg)
+        for pkg, value in changes2.iteritems():
+            len2 += (value is not None) - dict.__contains__(self, pkg)
+        if len1 != len2:
+            return cmp(len1, len2)
+        pkgs = dict.fromkeys(changes1)
+        pkgs.update(dict.fromkeys(changes2))
+        pkg1, op1 = self._characterize(pkgs, changes1, changes2)
+        if pkg1 is None:
+            return 0
+        pkg2, op2 = self._characterize(pkgs, changes2, changes1)
+        return cmp(pkg1, pkg2) or cmp(op1, op2)
+
+    def _characterize(self, pkgs, changes1, changes2):
+        # Find the smallest package which is in the changeset after
+        # changes1 but with a different operation after changes2.
+        minpkg = minop = None
+        for pkg in pkgs:
+            op1 = self._changedOp(pkg, changes1)
+            if op1 is None or op1 is self._changedOp(pkg, changes2):
+                continue
+            if minpkg is None or pkg < minpkg:
+                minpkg = pkg
+                minop = op1
+        return minpkg, minop
+
+    def _changedOp(self, pkg, changes):
+        if pkg in changes:
+            value = changes[pkg]
+            return value and value[0]
+        return dict.get(self, pkg)
+
     def getCache(self):
         return self._cache
 
@@ -141,6 +316,8 @@ class ChangeSet(dict):
 
     def setRequested(self, pkg, flag):
         assert pkg in self
+        if self._checkpoints:
+            self._record(pkg)
         if flag:
             self._requested[pkg] = True
         elif pkg in self._requested:
@@ -238,6 +415,16 @@ class Policy(object):
     def getWeight(self, changeset):
         return 0
 
+    def getWeightChange(self, changeset, previous):
+        """
+        Return how much the weight of changeset changed since the
+        packages in previous had the operations given there, None
+        standing for packages which weren't in the changeset.
+        Policies overloading getWeight() should overload this too,
+        or the whole changeset is weighted every time.
+        """
+        return 0
+
     def getPriority(self, pkg):
         priority = self._priorities.get(pkg)
         if priority is None:
@@ -256,6 +443,20 @@ class Policy(object):
             set[pkg] = -(set[pkg] - lower)*10
         return set
 
+def getPreviousOp(changeset, previous):
+    def getop(pkg):
+        if pkg in previous:
+            return previous[pkg]
+        return changeset.get(pkg)
+    return getop
+
+def hasWeightChange(policy):
+    # Weighting changes must be implemented where getWeight() is.
+    for cls in type(policy).__mro__:
+        if "getWeight" in cls.__dict__:
+            return "getWeightChange" in cls.__dict__
+    return False
+
 class PolicyInstall(Policy):
     """Give precedence for keeping functionality in the system."""
 
@@ -299,12 +500,22 @@ class PolicyInstall(Policy):
                                     downgraded[upgpkg].append(pkg)
                                 else:
                                     downgraded[upgpkg] = [pkg]
+        # Packages whose weight depends on the operation of each package.
+        self._affected = affected = {}
+        for relations in upgraded, downgraded:
+            for pkg in relations:
+                for otherpkg in relations[pkg]:
+                    if otherpkg in affected:
+                        affected[otherpkg].append(pkg)
+                    else:
+                        affected[otherpkg] = [pkg]
 
     def runFinished(self):
         Policy.runFinished(self)
         del self._upgrading
         del self._upgraded
         del self._downgraded
+        del self._affected
 
     def getWeight(self, changeset):
         weight = 0
@@ -334,6 +545,37 @@ class PolicyInstall(Policy):
                     weight += 3
         return weight
 
+    def getWeightChange(self, changeset, previous):
+        pkgs = {}
+        affected = self._affected
+        for pkg in previous:
+            pkgs[pkg] = True
+            for affpkg in affected.get(pkg, ()):
+                pkgs[affpkg] = True
+        getprevious = getPreviousOp(changeset, previous)
+        change = 0
+        for pkg in pkgs:
+            change += (self._getPackageWeight(pkg, changeset.get) -
+                       self._getPackageWeight(pkg, getprevious))
+        return change
+
+    def _getPackageWeight(self, pkg, getop):
+        # What pkg adds to getWeight(), given the operations from getop.
+        op = getop(pkg)
+        if op is REMOVE:
+            for upgpkg in self._upgraded.get(pkg, ()):
+                if getop(upgpkg) is INSTALL:
+                    return -1
+            for dwnpkg in self._downgraded.get(pkg, ()):
+                if getop(dwnpkg) is INSTALL:
+                    return 15
+            return 20
+        elif op is INSTALL:
+            if pkg in self._upgrading:
+                return 2
+            return 3
+        return 0
+
 class PolicyRemove(Policy):
     """Give precedence to the choice with less changes."""
 
@@ -346,6 +588,16 @@ class PolicyRemove(Policy):
                 weight += 5
         return weight
 
+    def getWeightChange(self, changeset, previous):
+        change = 0
+        for pkg in previous:
+            for op, sign in ((changeset.get(pkg), 1), (previous[pkg], -1)):
+                if op is REMOVE:
+                    change += sign
+                elif op is INSTALL:
+                    change += 5*sign
+        return change
+
 class PolicyUpgrade(Policy):
     """Give precedence to the choice with more upgrades and smaller impact."""
 
@@ -493,18 +745,187 @@ class PolicyUpgrade(Policy):
         weight += -30*upgradedcount+(installedcount-upgradedcount)
         return weight
 
+    def getWeightChange(self, changeset, previous):
+        # Stable bonuses only depend on packages upgrading the bonus
+        # package, so the upgraded packages are all that's affected.
+        pkgs = {}
+        upgrading = self._upgrading
+        for pkg in previous:
+            pkgs[pkg] = True
+            if pkg in upgrading:
+                pkgs.update(upgrading[pkg])
+        getprevious = getPreviousOp(changeset, previous)
+        change = 0
+        for pkg in pkgs:
+            change += (self._getPackageWeight(pkg, changeset.get) -
+                       self._getPackageWeight(pkg, getprevious))
+        return change
+
+    def _getPackageWeight(self, pkg, getop):
+        # What pkg adds to getWeight(), given the operations from getop,
+        # including its share as an upgraded package.
+        weight = 0
+        upgraded = False
+        for upgpkg in self._upgraded.get(pkg, ()):
+            if getop(upgpkg) is INSTALL:
+                upgraded = True
+                break
+        op = getop(pkg)
+        if op is REMOVE:
+            if upgraded:
+                weight -= 1
+            else:
+                weight += 3
+        elif op is INSTALL:
+            weight += 1
+            if pkg in self._upgrading:
+                weight += self._sortbonus.get(pkg, 0)
+        if upgraded:
+            weight -= 31
+            for bonusvalue, bonusdeps in self._stablebonus.get(pkg, ()):
+                for deppkg in bonusdeps:
+                    if getop(deppkg) is not None:
+                        break
+                else:
+                    weight += bonusvalue
+                    break
+        return weight
+
 class Failed(Error): pass
 
 PENDING_REMOVE   = 1
 PENDING_INSTALL  = 2
 PENDING_UPDOWN   = 3
 
+# Methods instrumented while profiling.
+PROFILEDMETHODS = ["_install", "_remove", "_updown", "_pending", "_upgrade",
+                   "_fix", "_try"]
+PROFILEDPOLICY = ["getWeight", "getWeightChange"]
+
+class SolverProfile(object):
+    """
+    Counters and timings of what a transaction did while running.
+
+    Methods of the transaction and its policy, and the copy method of
+    changesets, are wrapped only while profiling, so that nothing is
+    paid for it otherwise. Each call is
+    counted per depth, which is how many wrapped calls it's nested in,
+    and its time is only accounted at the outermost call of the same
+    method, so that recursion isn't timed twice.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._timers = {}
+        self._depths = {}
+        self._active = {}
+        self._nesting = [0]
+        self._wrapped = []
+
+    def count(self, name, n=1):
+        self._counters[name] = self._counters.get(name, 0)+n
+
+    def addTime(self, name, seconds):
+        self._timers[name] = self._timers.get(name, 0.)+seconds
+
+    def getCounter(self, name):
+        return self._counters.get(name, 0)
+
+    def getTime(self, name):
+        return self._timers.get(name, 0.)
+
+    def getDepths(self, name):
+        return self._depths.get(name, {})
+
+    def wrap(self, obj, name, key=None):
+        method = getattr(obj, name)
+        original = obj.__dict__.get(name)
+        key = key or name
+        counters = self._counters
+        active = self._active
+        nesting = self._nesting
+        depths = self._depths.setdefault(key, {})
+        def wrapper(*args, **kwargs):
+            depth = nesting[0]
+            depths[depth] = depths.get(depth, 0)+1
+            counters[key] = counters.get(key, 0)+1
+            nesting[0] += 1
+            if active.get(key):
+                active[key] += 1
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    active[key] -= 1
+                    nesting[0] -= 1
+            active[key] = 1
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                active[key] = 0
+                nesting[0] -= 1
+                self.addTime(key, time.time()-start)
+        setattr(obj, name, wrapper)
+        self._wrapped.append((obj, name, original))
+
+    def instrument(self, trans):
+        for name in PROFILEDMETHODS:
+            self.wrap(trans, name)
+        policy = trans.getPolicy()
+        for name in PROFILEDPOLICY:
+            self.wrap(policy, name)
+        self.wrap(ChangeSet, "copy", "changeset-copy")
+
+    def uninstrument(self):
+        # Wrapped instances get their class methods back, and wrapped
+        # classes their original functions.
+        for obj, name, original in self._wrapped:
+            if original is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, original)
+        del self._wrapped[:]
+
+    def getData(self):
+        depths = {}
+        for name in self._depths:
+            if self._depths[name]:
+                depths[name] = dict([(str(depth), n) for depth, n in
+                                     self._depths[name].items()])
+        return {"counters": self._counters.copy(),
+                "timers": self._timers.copy(),
+                "depths": depths}
+
+    def dump(self, file):
+        """Write the profile as a single line of JSON."""
+        file.write(dumpJSON(self.getData()))
+        file.write("\n")
+
+    def __str__(self):
+        lines = []
+        names = self._timers.keys()
+        names.sort()
+        for name in names:
+            lines.append("%s: %.3fs" % (name, self._timers[name]))
+        names = self._counters.keys()
+        names.sort()
+        for name in names:
+            line = "%s: %d" % (name, self._counters[name])
+            depths = self._depths.get(name)
+            if depths:
+                line += " (max depth %d)" % max(depths.keys())
+            lines.append(line)
+        return "\n".join(lines)
+
 class Transaction(object):
     def __init__(self, cache, policy=None, changeset=None, queue=None):
         self._cache = cache
         self._policy = policy and policy(self) or Policy(self)
         self._changeset = changeset or ChangeSet(cache)
         self._queue = queue or {}
+        self._weights = []
+        self._weightchange = False
+        self._profile = None
 
     def clear(self):
         self._changeset.clear()
@@ -543,6 +964,59 @@ class Transaction(object):
     def __str__(self):
         return str(self._changeset)
 
+    def _getWeight(self, changeset):
+        # The weight at each checkpoint is kept, so that policies which
+        # support it only have to weight what changed since then.
+        if self._weights:
+            return self._weights[-1] + self._policy.getWeightChange(
+                                          changeset, changeset.getPrevious())
+        return self._policy.getWeight(changeset)
+
+    def _try(self, changeset, locked, attempt):
+        # Run attempt(), which works on changeset and locked, and return
+        # the resulting weight and changes, leaving both as they were.
+        weightchange = self._weightchange
+        if weightchange:
+            self._weights.append(self._getWeight(changeset))
+        changeset.checkpoint()
+        locked.checkpoint()
+        try:
+            attempt()
+            return (self._getWeight(changeset),
+                    changeset.getChanges(), locked.getChanges())
+        finally:
+            changeset.rollback()
+            locked.rollback()
+            if weightchange:
+                self._weights.pop()
+
+    def _dumpProfile(self, profile):
+        iface.debug(_("Solver profile:\n%s") % profile)
+        path = sysconf.get("profile-solver")
+        if isinstance(path, basestring):
+            try:
+                file = open(path, "a")
+                try:
+                    profile.dump(file)
+                finally:
+                    file.close()
+            except IOError, e:
+                iface.warning(_("Couldn't write solver profile to %s: %s")
+                              % (path, e))
+
+    def getProfile(self):
+        """
+        Return the SolverProfile of the last run, or None if the
+        profile-solver option wasn't set for it.
+        """
+        return self._profile
+
+    def _sortAlternatives(self, changeset, alternatives):
+        # Alternatives are (weight, changes, ...) tuples, with changes
+        # on top of changeset. They're sorted as if changes were applied.
+        alternatives.sort(lambda x, y: cmp(x[0], y[0]) or
+                                     changeset.compareChanges(x[1], y[1]))
+
     def _install(self, pkg, changeset, locked, pending, depth=0):
         #print "[%03d] _install(%s)" % (depth, pkg)
         #depth += 1
@@ -765,19 +1239,18 @@ class Transaction(object):
                         upgpkgs[prvpkg] = True
 
         # No, let's try to upgrade it.
-        getweight = self._policy.getWeight
-        alternatives = [(getweight(changeset), changeset)]
+        alternatives = [(self._getWeight(changeset), {})]
 
         # Check if upgrading is possible.
         for upgpkg in upgpkgs:
             try:
-                cs = changeset.copy()
-                lk = locked.copy()
-                self._install(upgpkg, cs, lk, None, depth)
+                weight, cs, lk = self._try(changeset, locked,
+                    lambda: self._install(upgpkg, changeset, locked,
+                                          None, depth))
             except Failed:
                 pass
             else:
-                alternatives.append((getweight(cs), cs))
+                alternatives.append((weight, cs))
 
         # Is any downgrading version of this package installed?
         try:
@@ -808,30 +1281,32 @@ class Transaction(object):
             # Check if downgrading is possible.
             for dwnpkg in dwnpkgs:
                 try:
-                    cs = changeset.copy()
-                    lk = locked.copy()
-                    self._install(dwnpkg, cs, lk, None, depth)
+                    weight, cs, lk = self._try(changeset, locked,
+                        lambda: self._install(dwnpkg, changeset, locked,
+                                              None, depth))
                 except Failed:
                     pass
                 else:
-                    alternatives.append((getweight(cs), cs))
+                    alternatives.append((weight, cs))
 
         # If there's only one alternative, it's the one currenlty in use.
         if len(alternatives) > 1:
-            alternatives.sort()
-            changeset.setState(alternatives[0][1])
+            self._sortAlternatives(changeset, alternatives)
+            changeset.applyChanges(alternatives[0][1])
 
     def _pending(self, changeset, locked, pending, depth=0):
         #print "[%03d] _pending()" % depth
         #depth += 1
 
         isinst = changeset.installed
-        getweight = self._policy.getWeight
 
+        profile = self._profile
         updown = []
         while pending:
             item = pending.pop(0)
             kind = item[0]
+            if profile:
+                profile.count("pending-items")
             if kind == PENDING_UPDOWN:
                 updown.append(item[1])
             elif kind == PENDING_INSTALL:
@@ -866,23 +1341,23 @@ class Transaction(object):
                     pw = self._policy.getPriorityWeights(prvpkgs)
                     for prvpkg in prvpkgs:
                         try:
-                            cs = changeset.copy()
-                            lk = locked.copy()
-                            self._install(prvpkg, cs, lk, None, depth)
+                            weight, cs, lk = self._try(changeset, locked,
+                                lambda: self._install(prvpkg, changeset,
+                                                      locked, None, depth))
                         except Failed, e:
                             failures.append(unicode(e))
                         else:
-                            alternatives.append((getweight(cs)+pw[prvpkg]+
+                            alternatives.append((weight+pw[prvpkg]+
                                                  keeporder, cs, lk))
                             keeporder += 0.000001
                     if not alternatives:
                         raise Failed, _("Can't install %s: all packages "
                                         "providing %s failed to install:\n%s")\
                                       % (pkg, req,  "\n".join(failures))
-                    alternatives.sort()
-                    changeset.setState(alternatives[0][1])
+                    self._sortAlternatives(changeset, alternatives)
+                    changeset.applyChanges(alternatives[0][1])
                     if len(alternatives) == 1:
-                        locked.update(alternatives[0][2])
+                        locked.applyChanges(alternatives[0][2])
                 else:
                     # This turned out to be the only way.
                     self._install(prvpkgs[0], changeset, locked,
@@ -920,14 +1395,13 @@ class Transaction(object):
                     pw = self._policy.getPriorityWeights(prvpkgs)
                     for prvpkg in prvpkgs:
                         try:
-                            cs = changeset.copy()
-                            lk = locked.copy()
-                            self._install(prvpkg, cs, lk, None, depth)
+                            weight, cs, lk = self._try(changeset, locked,
+                                lambda: self._install(prvpkg, changeset,
+                                                      locked, None, depth))
                         except Failed, e:
                             failures.append(unicode(e))
                         else:
-                            alternatives.append((getweight(cs)+pw[prvpkg],
-                                                cs, lk))
+                            alternatives.append((weight+pw[prvpkg], cs, lk))
 
                 if not prvpkgs or not alternatives:
 
@@ -955,32 +1429,31 @@ class Transaction(object):
                 # Then, remove every requiring package, or
                 # upgrade/downgrade them to something which
                 # does not require this dependency.
-                cs = changeset.copy()
-                lk = locked.copy()
-                try:
+                def removeRequiring():
                     for reqpkg in reqpkgs:
                         if reqpkg in locked and isinst(reqpkg):
                             raise Failed, _("%s is locked") % reqpkg
                     for reqpkg in reqpkgs:
-                        if not cs.installed(reqpkg):
+                        if not isinst(reqpkg):
                             continue
-                        if reqpkg in lk:
+                        if reqpkg in locked:
                             raise Failed, _("%s is locked") % reqpkg
-                        self._remove(reqpkg, cs, lk, None, depth)
+                        self._remove(reqpkg, changeset, locked, None, depth)
+                try:
+                    alternatives.append(self._try(changeset, locked,
+                                                  removeRequiring))
                 except Failed, e:
                     failures.append(unicode(e))
-                else:
-                    alternatives.append((getweight(cs), cs, lk))
 
                 if not alternatives:
                     raise Failed, _("Can't install %s: all packages providing "
                                     "%s failed to install:\n%s") \
                                   % (pkg, prv,  "\n".join(failures))
 
-                alternatives.sort()
-                changeset.setState(alternatives[0][1])
+                self._sortAlternatives(changeset, alternatives)
+                changeset.applyChanges(alternatives[0][1])
                 if len(alternatives) == 1:
-                    locked.update(alternatives[0][2])
+                    locked.applyChanges(alternatives[0][2])
 
         for pkg in updown:
             self._updown(pkg, changeset, locked, depth)
@@ -992,7 +1465,6 @@ class Transaction(object):
         #depth += 1
 
         isinst = changeset.installed
-        getweight = self._policy.getWeight
 
         sortUpgrades(pkgs, self._policy)
 
@@ -1000,23 +1472,24 @@ class Transaction(object):
 
         origchangeset = changeset.copy()
 
-        weight = getweight(changeset)
+        weight = self._getWeight(changeset)
         for pkg in pkgs:
             if pkg in locked and not isinst(pkg):
                 continue
 
             try:
-                cs = changeset.copy()
-                lk = locked.copy()
-                self._install(pkg, cs, lk, None, depth)
+                csweight, cs, lk = self._try(changeset, locked,
+                    lambda: self._install(pkg, changeset, locked,
+                                          None, depth))
             except Failed, e:
                 pass
             else:
+                # Only the packages locked on top of the current
+                # locked set are kept, since it doesn't change here.
                 lockedstate[pkg] = lk
-                csweight = getweight(cs)
                 if csweight < weight:
                     weight = csweight
-                    changeset.setState(cs)
+                    changeset.applyChanges(cs)
 
         lockedstates = {}
         for pkg in pkgs:
@@ -1031,26 +1504,24 @@ class Transaction(object):
             if (op and op != origchangeset.get(pkg) and
                 pkg not in locked and pkg not in lockedstates):
 
-                try:
-                    cs = changeset.copy()
-                    lk = locked.copy()
+                def revert():
                     if op is REMOVE:
-                        self._install(pkg, cs, lk, None, depth)
+                        self._install(pkg, changeset, locked, None, depth)
                     elif op is INSTALL:
-                        self._remove(pkg, cs, lk, None, depth)
+                        self._remove(pkg, changeset, locked, None, depth)
+                try:
+                    csweight, cs, lk = self._try(changeset, locked, revert)
                 except Failed, e:
                     pass
                 else:
-                    csweight = getweight(cs)
                     if csweight < weight:
                         weight = csweight
-                        changeset.setState(cs)
+                        changeset.applyChanges(cs)
                 
     def _fix(self, pkgs, changeset, locked, pending, depth=0):
         #print "[%03d] _fix()" % depth
         #depth += 1
 
-        getweight = self._policy.getWeight
         isinst = changeset.installed
 
         sortUpgrades(pkgs)
@@ -1115,32 +1586,32 @@ class Transaction(object):
 
             # Try to fix by installing it.
             try:
-                cs = changeset.copy()
-                lk = locked.copy()
-                self._install(pkg, cs, lk, None, depth)
+                weight, cs, lk = self._try(changeset, locked,
+                    lambda: self._install(pkg, changeset, locked,
+                                          None, depth))
             except Failed, e:
                 failures.append(unicode(e))
             else:
                 # If they weight the same, it's better to keep the package.
-                alternatives.append((getweight(cs)-0.000001, cs))
+                alternatives.append((weight-0.000001, cs))
 
             # Try to fix by removing it.
+            def remove():
+                self._remove(pkg, changeset, locked, None, depth)
+                self._updown(pkg, changeset, locked, depth)
             try:
-                cs = changeset.copy()
-                lk = locked.copy()
-                self._remove(pkg, cs, lk, None, depth)
-                self._updown(pkg, cs, lk, depth)
+                weight, cs, lk = self._try(changeset, locked, remove)
             except Failed, e:
                 failures.append(unicode(e))
             else:
-                alternatives.append((getweight(cs), cs))
+                alternatives.append((weight, cs))
 
             if not alternatives:
                 raise Failed, _("Can't fix %s:\n%s") % \
                               (pkg, "\n".join(failures))
 
-            alternatives.sort()
-            changeset.setState(alternatives[0][1])
+            self._sortAlternatives(changeset, alternatives)
+            changeset.applyChanges(alternatives[0][1])
 
     def enqueue(self, pkg, op):
         if op is UPGRADE:
@@ -1174,13 +1645,40 @@ class Transaction(object):
 
     def run(self):
 
-        self._policy.runStarting()
+        profile = self._profile = None
+        if sysconf.get("profile-solver"):
+            profile = self._profile = SolverProfile()
+        started = False
 
         try:
+            if profile:
+                profile.instrument(self)
+                runstart = start = time.time()
+
+            self._policy.runStarting()
+            started = True
+            if profile:
+                profile.addTime("run-starting", time.time()-start)
+            self._weightchange = hasWeightChange(self._policy)
+
+            if sysconf.get("transaction-solver", "heuristic") == "sat":
+                from smart.satresolver import SATResolver
+                resolver = SATResolver(self)
+                if profile:
+                    start = time.time()
+                self._changeset.setState(resolver.run())
+                if profile:
+                    profile.addTime("sat", time.time()-start)
+                    for name, n in resolver.getStats().items():
+                        profile.count("sat-"+name, n)
+                return
+
             changeset = self._changeset.copy()
             isinst = changeset.installed
-            locked = self._policy.getLockedSet().copy()
+            locked = CheckpointDict(self._policy.getLockedSet())
             pending = []
+            if profile:
+                start = time.time()
 
             for pkg in self._queue:
                 op = self._queue[pkg]
@@ -1237,21 +1735,38 @@ class Transaction(object):
             if pending:
                 self._pending(changeset, locked, pending)
 
+            if profile:
+                now = time.time()
+                profile.addTime("queue", now-start)
+                start = now
+
             if upgpkgs:
                 self._upgrade(upgpkgs, changeset, locked, pending)
+                if profile:
+                    now = time.time()
+                    profile.addTime("upgrade", now-start)
+                    start = now
 
             if fixpkgs:
                 self._fix(fixpkgs, changeset, locked, pending)
+                if profile:
+                    profile.addTime("fix", time.time()-start)
 
             self._changeset.setState(changeset)
 
         finally:
-            self._queue.clear()
-            self._policy.runFinished()
+            if started:
+                self._queue.clear()
+                self._policy.runFinished()
+            if profile:
+                profile.uninstrument()
+                profile.addTime("run", time.time()-runstart)
+                self._dumpProfile(profile)
 
 
 class ChangeSetSplitter(object):
-    # This class operates on *sane* changesets.
+    # This class operates on *sane* changesets, which must not
+    # change while the splitter is used.
 
     DEBUG = 0
 
@@ -1259,6 +1774,9 @@ class ChangeSetSplitter(object):
         self._changeset = changeset
         self._forcerequires = forcerequires
         self._locked = {}
+        self._providers = {}
+        self._installrelations = {}
+        self._removerelations = {}
 
     def getForceRequires(self):
         return self._userequires
@@ -1283,118 +1801,160 @@ class ChangeSetSplitter(object):
     def resetLocked(self):
         self._locked.clear()
 
+    def _getProviders(self, req):
+        prvpkgs = self._providers.get(req)
+        if prvpkgs is None:
+            set = self._changeset
+            prvpkgs = self._providers[req] = \
+                [prvpkg for prv in req.providedby
+                        for prvpkg in prv.packages
+                         if prvpkg.installed or set.get(prvpkg) is INSTALL]
+        return prvpkgs
+
+    def _getRelated(self, pkg):
+        # Packages upgrading or being upgraded by pkg.
+        relpkgs = [upgpkg for prv in pkg.provides
+                          for upg in prv.upgradedby
+                          for upgpkg in upg.packages]
+        relpkgs.extend([prvpkg for upg in pkg.upgrades
+                               for prv in upg.providedby
+                               for prvpkg in prv.packages])
+        set = self._changeset
+        return [x for x in relpkgs if x in set]
+
+    def _getRemoveRelations(self, pkg):
+        # Only requiring packages which are installed or being
+        # installed matter, so they're filtered once.
+        relations = self._removerelations.get(pkg)
+        if relations is None:
+            set = self._changeset
+            requiredby = []
+            for prv in pkg.provides:
+                for req in prv.requiredby:
+                    reqpkgs = [x for x in req.packages
+                               if x.installed or set.get(x) is INSTALL]
+                    if reqpkgs:
+                        requiredby.append((req, reqpkgs))
+            relations = self._removerelations[pkg] = \
+                (requiredby, self._getRelated(pkg))
+        return relations
+
+    def _getInstallRelations(self, pkg):
+        relations = self._installrelations.get(pkg)
+        if relations is None:
+            set = self._changeset
+            requires = [(req, req in pkg.requires)
+                        for req in pkg.requires + pkg.recommends]
+            cnfpkgs = [prvpkg for cnf in pkg.conflicts
+                              for prv in cnf.providedby
+                              for prvpkg in prv.packages
+                               if prvpkg is not pkg]
+            cnfpkgs.extend([cnfpkg for prv in pkg.provides
+                                   for cnf in prv.conflictedby
+                                   for cnfpkg in cnf.packages
+                                    if cnfpkg is not pkg])
+            cnfpkgs = [x for x in cnfpkgs
+                       if x.installed or set.get(x) is INSTALL]
+            relations = self._installrelations[pkg] = \
+                (requires, cnfpkgs, self._getRelated(pkg))
+        return relations
+
     def _remove(self, subset, pkg, locked):
         set = self._changeset
+        requiredby, relpkgs = self._getRemoveRelations(pkg)
 
         # Include requiring packages being removed, or exclude
         # requiring packages being installed.
-        for prv in pkg.provides:
-            for req in prv.requiredby:
+        for req, reqpkgs in requiredby:
 
-                reqpkgs = [reqpkg for reqpkg in req.packages if
-                           subset.get(reqpkg) is INSTALL or
-                           subset.get(reqpkg) is not REMOVE and
-                           reqpkg.installed]
+            reqpkgs = [reqpkg for reqpkg in reqpkgs if
+                       subset.get(reqpkg) is INSTALL or
+                       subset.get(reqpkg) is not REMOVE and
+                       reqpkg.installed]
 
-                if not reqpkgs:
-                    continue
+            if not reqpkgs:
+                continue
 
-                # Check if some package that will stay
-                # in the system or some package already
-                # selected for installation provide the
-                # needed dependency.
-                found = False
-                for prv in req.providedby:
-                    for prvpkg in prv.packages:
-                        if (subset.get(prvpkg) is INSTALL or
-                            (prvpkg.installed and not
-                             subset.get(prvpkg) is REMOVE)):
-                            found = True
-                            break
-                    else:
-                        continue
-                    break
-                if found:
-                    continue
+            prvpkgs = self._getProviders(req)
 
-                # Try to include some providing package
-                # that is selected for installation.
-                found = False
-                for prv in req.providedby:
-                    for prvpkg in prv.packages:
-                        if (set.get(prvpkg) is INSTALL and
-                            prvpkg not in locked):
-                            try:
-                                self.include(subset, prvpkg, locked)
-                            except Error:
-                                pass
-                            else:
-                                found = True
-                                break
-                    else:
-                        continue
+            # Check if some package that will stay
+            # in the system or some package already
+            # selected for installation provide the
+            # needed dependency.
+            found = False
+            for prvpkg in prvpkgs:
+                if (subset.get(prvpkg) is INSTALL or
+                    (prvpkg.installed and not
+                     subset.get(prvpkg) is REMOVE)):
+                    found = True
                     break
-                if found:
-                    continue
+            if found:
+                continue
 
-                # Now, try to keep in the system some
-                # providing package which is already installed.
-                found = False
-                wasbroken = True
-                for prv in req.providedby:
-                    for prvpkg in prv.packages:
-                        if set.get(prvpkg) is not REMOVE:
-                            continue
-                        wasbroken = False
-                        # Package is necessarily in subset
-                        # otherwise we wouldn't get here.
-                        if prvpkg not in locked:
-                            try:
-                                self.exclude(subset, prvpkg, locked)
-                            except Error:
-                                pass
-                            else:
-                                found = True
-                                break
+            # Try to include some providing package
+            # that is selected for installation.
+            found = False
+            for prvpkg in prvpkgs:
+                if (set.get(prvpkg) is INSTALL and
+                    prvpkg not in locked):
+                    try:
+                        self.include(subset, prvpkg, locked)
+                    except Error:
+                        pass
                     else:
-                        continue
-                    break
-                if found:
+                        found = True
+                        break
+            if found:
+                continue
+
+            # Now, try to keep in the system some
+            # providing package which is already installed.
+            found = False
+            wasbroken = True
+            for prvpkg in prvpkgs:
+                if set.get(prvpkg) is not REMOVE:
                     continue
+                wasbroken = False
+                # Package is necessarily in subset
+                # otherwise we wouldn't get here.
+                if prvpkg not in locked:
+                    try:
+                        self.exclude(subset, prvpkg, locked)
+                    except Error:
+                        pass
+                    else:
+                        found = True
+                        break
+            if found:
+                continue
 
-                needed = (not wasbroken and 
-                          (self._forcerequires or
-                           isinstance(req, PreRequires)))
+            needed = (not wasbroken and 
+                      (self._forcerequires or
+                       isinstance(req, PreRequires)))
 
-                for reqpkg in reqpkgs:
+            for reqpkg in reqpkgs:
 
-                    # Finally, try to exclude the requiring
-                    # package if it is being installed, or
-                    # include it if it's being removed.
-                    reqpkgop = set.get(reqpkg)
-                    if reqpkgop and reqpkg not in locked:
-                        try:
-                            if reqpkgop is INSTALL:
-                                self.exclude(subset, reqpkg, locked)
-                            else:
-                                self.include(subset, reqpkg, locked)
-                        except Error:
-                            if needed: raise
+                # Finally, try to exclude the requiring
+                # package if it is being installed, or
+                # include it if it's being removed.
+                reqpkgop = set.get(reqpkg)
+                if reqpkgop and reqpkg not in locked:
+                    try:
+                        if reqpkgop is INSTALL:
+                            self.exclude(subset, reqpkg, locked)
                         else:
-                            continue
+                            self.include(subset, reqpkg, locked)
+                    except Error:
+                        if needed: raise
+                    else:
+                        continue
 
-                    # Should we care about this?
-                    if needed:
-                        raise Error, _("No providers for '%s', "
-                                       "required by '%s'") % (req, reqpkg)
+                # Should we care about this?
+                if needed:
+                    raise Error, _("No providers for '%s', "
+                                   "required by '%s'") % (req, reqpkg)
 
         # Check upgrading/downgrading packages.
-        relpkgs = [upgpkg for prv in pkg.provides
-                          for upg in prv.upgradedby
-                          for upgpkg in upg.packages]
-        relpkgs.extend([prvpkg for upg in pkg.upgrades
-                               for prv in upg.providedby
-                               for prvpkg in prv.packages])
         if set[pkg] is INSTALL:
             # Package is being installed, but excluded from the
             # subset. Exclude every related package which is
@@ -1416,43 +1976,37 @@ class ChangeSetSplitter(object):
 
     def _install(self, subset, pkg, locked):
         set = self._changeset
+        requires, cnfpkgs, relpkgs = self._getInstallRelations(pkg)
 
         # Check all dependencies needed by this package.
-        for req in pkg.requires + pkg.recommends:
+        for req, required in requires:
+            prvpkgs = self._getProviders(req)
 
             # Check if any already installed or to be installed
             # package will solve the problem.
             found = False
-            for prv in req.providedby:
-                for prvpkg in prv.packages:
-                    if (subset.get(prvpkg) is INSTALL or
-                        (prvpkg.installed and
-                         subset.get(prvpkg) is not REMOVE)):
-                        found = True
-                        break
-                else:
-                    continue
-                break
+            for prvpkg in prvpkgs:
+                if (subset.get(prvpkg) is INSTALL or
+                    (prvpkg.installed and
+                     subset.get(prvpkg) is not REMOVE)):
+                    found = True
+                    break
             if found:
                 continue
 
             # Check if any package that could be installed
             # may solve the problem.
             found = False
-            for prv in req.providedby:
-                for prvpkg in prv.packages:
-                    if (set.get(prvpkg) is INSTALL
-                        and prvpkg not in locked):
-                        try:
-                            self.include(subset, prvpkg, locked)
-                        except Error:
-                            pass
-                        else:
-                            found = True
-                            break
-                else:
-                    continue
-                break
+            for prvpkg in prvpkgs:
+                if (set.get(prvpkg) is INSTALL
+                    and prvpkg not in locked):
+                    try:
+                        self.include(subset, prvpkg, locked)
+                    except Error:
+                        pass
+                    else:
+                        found = True
+                        break
             if found:
                 continue
 
@@ -1460,24 +2014,20 @@ class ChangeSetSplitter(object):
             # package providing the dependency.
             found = False
             wasbroken = True
-            for prv in req.providedby:
-                for prvpkg in prv.packages:
-                    if set.get(prvpkg) is not REMOVE:
-                        continue
-                    wasbroken = False
-                    # Package is necessarily in subset
-                    # otherwise we wouldn't get here.
-                    if prvpkg not in locked:
-                        try:
-                            self.exclude(subset, prvpkg, locked)
-                        except Error:
-                            pass
-                        else:
-                            found = True
-                            break
-                else:
+            for prvpkg in prvpkgs:
+                if set.get(prvpkg) is not REMOVE:
                     continue
-                break
+                wasbroken = False
+                # Package is necessarily in subset
+                # otherwise we wouldn't get here.
+                if prvpkg not in locked:
+                    try:
+                        self.exclude(subset, prvpkg, locked)
+                    except Error:
+                        pass
+                    else:
+                        found = True
+                        break
             if found or wasbroken:
                 continue
 
@@ -1485,19 +2035,10 @@ class ChangeSetSplitter(object):
             # Should we really care about it?
             if ((self._forcerequires or
                 isinstance(req, PreRequires))
-                and req in pkg.requires):
+                and required):
                 raise Error, _("No providers for '%s', "
                                "required by '%s'") % (req, pkg)
 
-        cnfpkgs = [prvpkg for cnf in pkg.conflicts
-                          for prv in cnf.providedby
-                          for prvpkg in prv.packages
-                           if prvpkg is not pkg]
-        cnfpkgs.extend([cnfpkg for prv in pkg.provides
-                               for cnf in prv.conflictedby
-                               for cnfpkg in cnf.packages
-                                if cnfpkg is not pkg])
-
         for cnfpkg in cnfpkgs:
             if (subset.get(cnfpkg) is INSTALL or
                 cnfpkg.installed and subset.get(cnfpkg) is not REMOVE):
@@ -1510,12 +2051,6 @@ class ChangeSetSplitter(object):
                     self.include(subset, cnfpkg, locked)
 
         # Check upgrading/downgrading packages.
-        relpkgs = [upgpkg for prv in pkg.provides
-                          for upg in prv.upgradedby
-                          for upgpkg in upg.packages]
-        relpkgs.extend([prvpkg for upg in pkg.upgrades
-                               for prv in upg.providedby
-                               for prvpkg in prv.packages])
         if set[pkg] is INSTALL:
             # Package is being installed, and included in the
             # subset. Include every related package which is
@@ -1540,9 +2075,12 @@ class ChangeSetSplitter(object):
 
         if locked is None:
             locked = self._locked
+            unlock = False
             if self.DEBUG: print "-"*79
         else:
-            locked = locked.copy()
+            # Nested calls share the locked dict, and release
+            # their package when they're done with it.
+            unlock = True
         if self.DEBUG:
             strop = set.get(pkg) is INSTALL and "INSTALL" or "REMOVE"
             print "Including %s of %s" % (strop, pkg)
@@ -1556,24 +2094,31 @@ class ChangeSetSplitter(object):
 
         op = subset[pkg] = set[pkg]
         try:
-            if op is INSTALL:
-                self._install(subset, pkg, locked)
-            else:
-                self._remove(subset, pkg, locked)
-        except Error, e:
-            if self.DEBUG:
-                print "FAILED: Including %s of %s: %s" % (strop, pkg, e)
-            del subset[pkg]
-            raise
+            try:
+                if op is INSTALL:
+                    self._install(subset, pkg, locked)
+                else:
+                    self._remove(subset, pkg, locked)
+            except Error, e:
+                if self.DEBUG:
+                    print "FAILED: Including %s of %s: %s" % (strop, pkg, e)
+                del subset[pkg]
+                raise
+        finally:
+            if unlock:
+                del locked[pkg]
 
     def exclude(self, subset, pkg, locked=None):
         set = self._changeset
 
         if locked is None:
             locked = self._locked
+            unlock = False
             if self.DEBUG: print "-"*79
         else:
-            locked = locked.copy()
+            # Nested calls share the locked dict, and release
+            # their package when they're done with it.
+            unlock = True
         if self.DEBUG:
             strop = set.get(pkg) is INSTALL and "INSTALL" or "REMOVE"
             print "Excluding %s of %s" % (strop, pkg)
@@ -1590,15 +2135,19 @@ class ChangeSetSplitter(object):
 
         op = set[pkg]
         try:
-            if op is INSTALL:
-                self._remove(subset, pkg, locked)
-            elif op is REMOVE:
-                self._install(subset, pkg, locked)
-        except Error, e:
-            if self.DEBUG:
-                print "FAILED: Excluding %s of %s: %s" % (strop, pkg, e)
-            subset[pkg] = op
-            raise
+            try:
+                if op is INSTALL:
+                    self._remove(subset, pkg, locked)
+                elif op is REMOVE:
+                    self._install(subset, pkg, locked)
+            except Error, e:
+                if self.DEBUG:
+                    print "FAILED: Excluding %s of %s: %s" % (strop, pkg, e)
+                subset[pkg] = op
+                raise
+        finally:
+            if unlock:
+                del locked[pkg]
 
     def includeAll(self, subset):
         # Include everything that doesn't change locked packages
@@ -1832,67 +2381,140 @@ def checkPackagesSimple(cache, checkset=None, report=False,
     return checkPackages(cache, checkset, relateset, report)
 
 def checkPackages(cache, checkset, relateset, report=False):
-    checkset = list(checkset)
-    checkset.sort()
-    relateset = dict.fromkeys(relateset, True)
-
-    problems = False
-    coexistchecked = {}
-    for pkg in checkset:
-        for req in pkg.requires:
-            for prv in req.providedby:
-                for prvpkg in prv.packages:
-                    if prvpkg in relateset:
-                        break
+    return getDependencyIndex(cache).check(checkset, relateset, report)
+
+# Dependency index of the last cache checked.
+_depindexes = {}
+
+def getDependencyIndex(cache):
+    """
+    Return the DependencyIndex of the cache, which is kept until the
+    cache is loaded again.
+    """
+    index = _depindexes.get(cache)
+    if index is None:
+        _depindexes.clear()
+        index = _depindexes[cache] = DependencyIndex(cache)
+    return index
+
+def resetDependencyIndex(cache):
+    _depindexes.pop(cache, None)
+
+hooks.register("cache-loaded", resetDependencyIndex)
+
+class DependencyIndex(object):
+    """
+    Index used to check that dependencies of packages hold.
+
+    Requirements are checked against the provides offered by the
+    related packages, which are collected in a single pass, and
+    packages are grouped by name for the coexistence checks. The
+    index may be reused for as long as the cache isn't reloaded, and
+    getDependencyIndex() keeps one for that.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._names = None
+
+    def getNamePackages(self, name):
+        names = self._names
+        if names is None:
+            names = self._names = {}
+            for pkg in self._cache.getPackages():
+                lst = names.get(pkg.name)
+                if lst is None:
+                    names[pkg.name] = [pkg]
                 else:
-                    continue
-                break
-            else:
-                if not report:
-                    return False
-                problems = True
-                iface.info(_("Unsatisfied dependency: %s requires %s") %
-                           (pkg, req))
+                    lst.append(pkg)
+        return names.get(name, ())
 
-        for req in pkg.recommends:
-            for prv in req.providedby:
-                for prvpkg in prv.packages:
-                    if prvpkg in relateset:
+    def check(self, checkset, relateset, report=False):
+        relateset = dict.fromkeys(relateset, True)
+        provided = {}
+        for pkg in relateset:
+            for prv in pkg.provides:
+                provided[prv] = True
+        def related(pkg):
+            return pkg in relateset
+        def installed(pkg):
+            return pkg.installed
+        checkset = list(checkset)
+        checkset.sort()
+        def check(start, end):
+            return self._check(checkset, provided, related, installed,
+                               report, start, end)
+        jobs = sysconf.get("check-jobs", 1)
+        if jobs > 1 and len(checkset) > 1:
+            from smart.checkpool import checkInParallel
+            weights = [len(pkg.requires)+len(pkg.conflicts)+1
+                       for pkg in checkset]
+            problems = checkInParallel(check, weights, jobs, report)
+        else:
+            problems = check(0, len(checkset))
+        return self._report(problems, report)
+
+    def _report(self, problems, report):
+        if report:
+            for problem in problems:
+                iface.info(problem)
+        return not problems
+
+    def _check(self, checkset, provided, related, installed, report,
+               start, end):
+        # Check packages from start to end in the sorted checkset,
+        # returning the problems found, or just the first one when
+        # they're not reported.
+        problems = []
+        coexistchecked = {}
+        for pkg in checkset[:start]:
+            # Pairs of coexisting packages are only checked once,
+            # when the first of them is seen.
+            if installed(pkg):
+                for namepkg in self.getNamePackages(pkg.name):
+                    if (namepkg is not pkg and
+                        installed(namepkg) and
+                        related(namepkg)):
+                        coexistchecked[(pkg, namepkg)] = True
+        for pkg in checkset[start:end]:
+            for req in pkg.requires:
+                for prv in req.providedby:
+                    if prv in provided:
                         break
                 else:
-                    continue
-                break
+                    problems.append(_("Unsatisfied dependency: "
+                                      "%s requires %s") % (pkg, req))
+                    if not report:
+                        return problems
 
-        if not pkg.installed:
-            continue
+            if not installed(pkg):
+                continue
 
-        for cnf in pkg.conflicts:
-            for prv in cnf.providedby:
-                for prvpkg in prv.packages:
-                    if (prvpkg is not pkg and
-                        prvpkg.installed and
-                        prvpkg in relateset):
+            for cnf in pkg.conflicts:
+                for prv in cnf.providedby:
+                    for prvpkg in prv.packages:
+                        if (prvpkg is not pkg and
+                            installed(prvpkg) and
+                            related(prvpkg)):
+                            problems.append(_("Unsatisfied dependency: "
+                                              "%s conflicts with %s") %
+                                            (pkg, prvpkg))
+                            if not report:
+                                return problems
+
+            for namepkg in self.getNamePackages(pkg.name):
+                if (namepkg is not pkg and
+                    installed(namepkg) and
+                    related(namepkg) and
+                    (namepkg, pkg) not in coexistchecked):
+                    coexistchecked[(pkg, namepkg)] = True
+                    if not pkg.coexists(namepkg):
+                        problems.append(_("Package %s can't coexist "
+                                          "with %s") % (namepkg, pkg))
                         if not report:
-                            return False
-                        problems = True
-                        iface.info(_("Unsatisfied dependency: "
-                                     "%s conflicts with %s") % (pkg, prvpkg))
-
-        namepkgs = cache.getPackages(pkg.name)
-        for namepkg in namepkgs:
-            if (namepkg is not pkg and
-                namepkg.installed and
-                namepkg in relateset and
-                (namepkg, pkg) not in coexistchecked):
-                coexistchecked[(pkg, namepkg)] = True
-                if not pkg.coexists(namepkg):
-                    if not report:
-                        return False
-                    problems = True
-                    iface.info(_("Package %s can't coexist with %s") %
-                               (namepkg, pkg))
+                            return problems
 
-    return not problems
+        return problems
 
 def enablePsyco(psyco):
     psyco.bind(PolicyInstall.getWeight)
@@ -1906,7 +2528,7 @@ def enablePsyco(psyco):
     psyco.bind(Transaction.enqueue)
     psyco.bind(sortUpgrades)
     psyco.bind(recursiveUpgrades)
-    psyco.bind(checkPackages)
+    psyco.bind(DependencyIndex._check)
 
 hooks.register("enable-psyco", enablePsyco)
 
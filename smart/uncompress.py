@@ -21,6 +21,7 @@
 #
 import os
 
+from smart.util.filedigest import StreamDigests
 from smart.const import BLOCKSIZE
 from smart import *
 
@@ -56,6 +57,86 @@ class UncompressorHandler(object):
     def uncompress(self, localpath):
         raise Error, _("Unsupported file type")
 
+    def getDecompressor(self):
+        # Return an object with decompress() and, optionally, flush()
+        # methods, to uncompress data as it arrives, or None if the
+        # format can't be uncompressed that way.
+        return None
+
+class StreamUncompressor(object):
+
+    # Uncompress data written in chunks into a .part file, computing
+    # the requested digests (md5, sha, sha256) of the uncompressed data
+    # on the fly. The target path is only written by commit(), once
+    # the data was validated.
+
+    def __init__(self, handler, localpath, digests=()):
+        self._decompressor = handler.getDecompressor()
+        self._handler = handler
+        self._targetpath = handler.getTargetPath(localpath)
+        self._partpath = self._targetpath+".part"
+        self._digests = StreamDigests(digests)
+        self._error = None
+        try:
+            self._output = open(self._partpath, "w")
+        except (IOError, OSError), e:
+            raise Error, "%s: %s" % (self._partpath, e)
+
+    def getTargetPath(self):
+        return self._targetpath
+
+    def getPartPath(self):
+        return self._partpath
+
+    def getDigests(self):
+        return self._digests.getDigests()
+
+    def write(self, data):
+        # Problems are only reported by close(), so that downloading
+        # goes on, and the file is uncompressed the usual way later.
+        if not self._output:
+            return
+        try:
+            try:
+                data = self._decompressor.decompress(data)
+            except EOFError:
+                # A new stream starts right where the last one ended.
+                self._decompressor = self._handler.getDecompressor()
+                data = self._decompressor.decompress(data)
+            # Concatenated streams, as left by parallel compressors.
+            while getattr(self._decompressor, "unused_data", None):
+                unused = self._decompressor.unused_data
+                self._decompressor = self._handler.getDecompressor()
+                data += self._decompressor.decompress(unused)
+            self._output.write(data)
+        except Exception, e:
+            # Each decompressor has its own exceptions for broken data.
+            self._error = "%s: %s" % (self._targetpath, e)
+            self.abort()
+            return
+        self._digests.update(data)
+
+    def close(self):
+        flush = getattr(self._decompressor, "flush", None)
+        if flush and self._output:
+            data = flush()
+            self._output.write(data)
+            self._digests.update(data)
+        if not self._output:
+            raise Error, self._error or _("Stream already closed")
+        self._output.close()
+        self._output = None
+
+    def commit(self):
+        os.rename(self._partpath, self._targetpath)
+
+    def abort(self):
+        if self._output:
+            self._output.close()
+            self._output = None
+        if os.path.isfile(self._partpath):
+            os.unlink(self._partpath)
+
 class BZ2Handler(UncompressorHandler):
 
     def query(self, localpath):
@@ -79,6 +160,10 @@ class BZ2Handler(UncompressorHandler):
         except EOFError, e:
             raise Error, ("%s\nPossibly corrupted channel file.") % e
 
+    def getDecompressor(self):
+        import bz2
+        return bz2.BZ2Decompressor()
+
 Uncompressor.addHandler(BZ2Handler)
 
 class LZMAHandler(UncompressorHandler):
@@ -113,6 +198,13 @@ class LZMAHandler(UncompressorHandler):
         except EOFError, e:
             raise Error, ("%s\nPossibly corrupted channel file.") % e
 
+    def getDecompressor(self):
+        try:
+            import lzma
+        except ImportError:
+            return None
+        return lzma.LZMADecompressor()
+
 Uncompressor.addHandler(LZMAHandler)
 
 
@@ -140,6 +232,13 @@ class XZHandler(UncompressorHandler):
         except EOFError, e:
             raise Error, ("%s\nPossibly corrupted channel file.") % e
 
+    def getDecompressor(self):
+        try:
+            import lzma
+        except ImportError:
+            return None
+        return lzma.LZMADecompressor()
+
 Uncompressor.addHandler(XZHandler)
 
 class GZipHandler(UncompressorHandler):
@@ -165,6 +264,11 @@ class GZipHandler(UncompressorHandler):
         except EOFError, e:
             raise Error, ("%s\nPossibly corrupted channel file.") % e
 
+    def getDecompressor(self):
+        import zlib
+        # Skip the gzip header and trailer as well.
+        return zlib.decompressobj(16+zlib.MAX_WBITS)
+
 Uncompressor.addHandler(GZipHandler)
 
 class ZipHandler(UncompressorHandler):
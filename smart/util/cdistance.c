@@ -264,9 +264,112 @@ cdistance_globdistance(PyObject *self, PyObject *args)
     return ret;
 }
 
+static PyObject *
+cdistance_filterprefixes(PyObject *self, PyObject *args)
+{
+    PyObject *names, *seq, *ret;
+    const char *a, *b, *last = NULL;
+    char la[MAXSIZE];
+    int *rows, *mins;
+    int al, bl, lastl = 0;
+    int maxdistance, maxdepth, depth;
+    int ai, i, len;
+    if (!PyArg_ParseTuple(args, "s#Oi", &a, &al, &names, &maxdistance))
+        return NULL;
+    if (al > MAXSIZE)
+        al = MAXSIZE;
+    if (maxdistance < 0)
+        maxdistance = 0;
+    for (ai = 0; ai != al; ai++)
+        la[ai] = tolower(a[ai]);
+    seq = PySequence_Fast(names, "names must be a sequence");
+    if (!seq)
+        return NULL;
+    ret = PyList_New(0);
+    if (!ret) {
+        Py_DECREF(seq);
+        return NULL;
+    }
+    /* A row deeper than this is always over maxdistance. */
+    maxdepth = al+maxdistance+1;
+    rows = (int *)malloc((maxdepth+1)*(al+1)*sizeof(int));
+    mins = (int *)malloc((maxdepth+1)*sizeof(int));
+    if (!rows || !mins) {
+        free(rows);
+        free(mins);
+        Py_DECREF(seq);
+        Py_DECREF(ret);
+        return PyErr_NoMemory();
+    }
+    for (ai = 0; ai <= al; ai++)
+        rows[ai] = ai;
+    mins[0] = 0;
+    depth = 0;
+    len = PySequence_Fast_GET_SIZE(seq);
+    for (i = 0; i != len; i++) {
+        PyObject *name = PySequence_Fast_GET_ITEM(seq, i);
+        if (!PyString_Check(name)) {
+            PyErr_SetString(PyExc_TypeError, "names must be strings");
+            free(rows);
+            free(mins);
+            Py_DECREF(seq);
+            Py_DECREF(ret);
+            return NULL;
+        }
+        b = PyString_AS_STRING(name);
+        bl = PyString_GET_SIZE(name);
+        if (bl > MAXSIZE)
+            bl = MAXSIZE;
+        if (depth > bl)
+            depth = bl;
+        if (depth > lastl)
+            depth = lastl;
+        for (ai = 0; ai != depth; ai++) {
+            if (tolower(b[ai]) != tolower(last[ai])) {
+                depth = ai;
+                break;
+            }
+        }
+        /* The smallest distance in a row never decreases in the
+           next ones, so the name is discarded as soon as it's over. */
+        while (mins[depth] <= maxdistance && depth < bl) {
+            int *lst = rows+depth*(al+1);
+            int *row = lst+al+1;
+            char c = tolower(b[depth]);
+            int minrow;
+            row[0] = minrow = depth+1;
+            for (ai = 0; ai != al; ai++) {
+                row[ai+1] = min3(lst[ai+1]+1, row[ai]+1,
+                                 lst[ai]+(la[ai] != c?1:0));
+                if (row[ai+1] < minrow)
+                    minrow = row[ai+1];
+            }
+            depth++;
+            mins[depth] = minrow;
+        }
+        if (mins[depth] <= maxdistance && depth == bl) {
+            if (PyList_Append(ret, name) == -1) {
+                free(rows);
+                free(mins);
+                Py_DECREF(seq);
+                Py_DECREF(ret);
+                return NULL;
+            }
+        }
+        last = b;
+        lastl = bl;
+    }
+    free(rows);
+    free(mins);
+    Py_DECREF(seq);
+    return ret;
+}
+
 static PyMethodDef cdistance_methods[] = {
     {"distance", (PyCFunction)cdistance_distance, METH_VARARGS, NULL},
     {"globdistance", (PyCFunction)cdistance_globdistance, METH_VARARGS, NULL},
+    {"filterprefixes", (PyCFunction)cdistance_filterprefixes,
+     METH_VARARGS, NULL},
     {NULL, NULL}
 };
 
@@ -92,4 +92,44 @@ def globdistance(a, b, cutoff=None, ignorecase=False):
         return bl, 0.0
     return res, float(maxl-res)/maxl
 
+def filterprefixes(a, names, maxdistance):
+    """
+    Return the names which are at most maxdistance edits away from
+    some prefix of a, ignoring case. Rows computed for the prefix
+    shared with the previous name are reused, so sorted names are
+    walked as if they were in a prefix tree.
+    """
+    if maxdistance < 0:
+        maxdistance = 0
+    a = a.lower()
+    al = len(a)
+    rows = [range(al+1)]
+    mins = [0]
+    result = []
+    last = ""
+    for name in names:
+        b = name.lower()
+        bl = len(b)
+        shared = 0
+        top = min(bl, len(last))
+        while shared < top and b[shared] == last[shared]:
+            shared += 1
+        del rows[shared+1:]
+        del mins[shared+1:]
+        # The smallest distance in a row never decreases in the
+        # next ones, so the name is discarded as soon as it's over.
+        while mins[-1] <= maxdistance and len(rows) <= bl:
+            bi = len(rows)-1
+            c = b[bi]
+            lst = rows[-1]
+            row = [bi+1]
+            for ai in range(al):
+                row.append(min(lst[ai+1]+1, row[ai]+1, lst[ai]+(a[ai] != c)))
+            rows.append(row)
+            mins.append(min(row))
+        if mins[-1] <= maxdistance and len(rows) > bl:
+            result.append(name)
+        last = b
+    return result
+
 from cdistance import *
@@ -0,0 +1,140 @@
+#
+# Copyright (c) 2009 Smart Package Manager Team.
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart.const import BLOCKSIZE
+import mmap
+import os
+
+# Files at least this big are mapped instead of read.
+MMAPSIZE = 1024*1024
+MMAPCHUNK = 1024*1024
+
+# Computed digests, as path => (key, {name: hexdigest}), with the key
+# made of stat fields which change when the file is written or replaced,
+# and at most MAXCACHED paths.
+_cache = {}
+MAXCACHED = 1000
+
+def newDigest(name):
+    if name == "md5":
+        try:
+            from hashlib import md5
+        except ImportError:
+            from md5 import md5
+        return md5()
+    elif name == "sha256":
+        try:
+            from hashlib import sha256
+        except ImportError:
+            from smart.util.sha256 import sha256
+        return sha256()
+    elif name == "sha":
+        try:
+            from hashlib import sha1 as sha
+        except ImportError:
+            from sha import sha
+        return sha()
+    raise ValueError, "unknown digest: %s" % name
+
+def getFileDigests(path, names):
+    """
+    Return a dictionary mapping each of the given digest names ("md5",
+    "sha" or "sha256") to the hexdigest of the file at path, and "size"
+    to its size. All missing digests are computed in a single pass over
+    the file, and results are remembered while the file isn't changed
+    or replaced. Since the modification time may be set back, the inode
+    and change time are checked too.
+    """
+    st = os.stat(path)
+    key = (st.st_size, st.st_mtime, st.st_ino, st.st_ctime)
+    cached = _cache.get(path)
+    if cached and cached[0] == key:
+        digests = cached[1]
+    else:
+        digests = {}
+    missing = [x for x in names if x not in digests]
+    if missing:
+        digests = digests.copy()
+        digests.update(_computeDigests(path, st.st_size, missing))
+        if path not in _cache and len(_cache) >= MAXCACHED:
+            _cache.clear()
+        _cache[path] = (key, digests)
+    result = dict([(x, digests[x]) for x in names])
+    result["size"] = st.st_size
+    return result
+
+class StreamDigests(object):
+    """
+    Digests of data fed in chunks through update(), with getDigests()
+    returning the same dictionary getFileDigests() would for a file
+    with that data.
+    """
+
+    def __init__(self, names):
+        self._digests = [(x, newDigest(x)) for x in names]
+        self._size = 0
+
+    def update(self, data):
+        self._size += len(data)
+        for name, digest in self._digests:
+            digest.update(data)
+
+    def getDigests(self):
+        result = dict([(name, digest.hexdigest())
+                       for name, digest in self._digests])
+        result["size"] = self._size
+        return result
+
+def forgetFileDigests(path=None):
+    """
+    Forget the digests of the file at path, or of every file, which
+    must be done when a file is written.
+    """
+    if path is None:
+        _cache.clear()
+    else:
+        _cache.pop(path, None)
+
+def _computeDigests(path, size, names):
+    digests = [(x, newDigest(x)) for x in names]
+    file = open(path, "rb")
+    try:
+        map = None
+        if size >= MMAPSIZE:
+            try:
+                map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError):
+                pass
+        if map is not None:
+            try:
+                for offset in xrange(0, len(map), MMAPCHUNK):
+                    data = map[offset:offset+MMAPCHUNK]
+                    for name, digest in digests:
+                        digest.update(data)
+            finally:
+                map.close()
+        else:
+            data = file.read(BLOCKSIZE)
+            while data:
+                for name, digest in digests:
+                    digest.update(data)
+                data = file.read(BLOCKSIZE)
+    finally:
+        file.close()
+    return dict([(name, digest.hexdigest()) for name, digest in digests])
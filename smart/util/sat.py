@@ -0,0 +1,379 @@
+#
+# Copyright (c) 2009 Smart Package Manager Team.
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+import heapq
+
+# Conflicts before the first restart, and how much that grows after
+# each one.
+RESTARTFIRST = 100
+RESTARTGROWTH = 1.5
+
+ACTIVITYDECAY = 0.95
+
+
+class Solver(object):
+    """
+    Conflict driven clause learning SAT solver.
+
+    Variables are numbered from 1, as returned by newVar(), and
+    literals are variables, or negated variables for their negation.
+    Conflicts are analyzed until the first unique implication point,
+    and the learned clauses allow jumping back over unrelated decisions.
+    """
+
+    def __init__(self):
+        self._value = [None]
+        self._level = [0]
+        self._reason = [None]
+        self._activity = [0.]
+        self._phase = [False]
+        self._watches = {}
+        self._trail = []
+        self._limits = []
+        self._qhead = 0
+        self._order = []
+        self._increment = 1.
+        self._reorder = False
+        self._ok = True
+        self._model = None
+        self._core = []
+        self._conflicts = 0
+        self._decisions = 0
+
+    def newVar(self, phase=False, activity=0.):
+        """
+        Create a new variable and return it. The phase is the value
+        tried first when deciding on it, and variables with higher
+        activity are decided on first.
+        """
+        self._value.append(None)
+        self._level.append(0)
+        self._reason.append(None)
+        self._activity.append(activity)
+        self._phase.append(phase)
+        var = len(self._value)-1
+        heapq.heappush(self._order, (-activity, var))
+        return var
+
+    def getVarCount(self):
+        return len(self._value)-1
+
+    def setPhase(self, var, phase):
+        self._phase[var] = phase
+
+    def setActivity(self, var, activity):
+        """
+        Set the activity of a variable, as a multiple of what each
+        conflict involving it adds at this point.
+        """
+        self._activity[var] = activity*self._increment
+        self._reorder = True
+
+    def addClause(self, lits):
+        """
+        Add a clause, which must hold in every solution. Return False
+        if that makes the problem unsatisfiable.
+        """
+        if not self._ok:
+            return False
+        self._cancel(0)
+        clause = []
+        seen = {}
+        for lit in lits:
+            if -lit in seen:
+                return True
+            if lit in seen:
+                continue
+            value = self._litValue(lit)
+            if value is True:
+                return True
+            if value is None:
+                seen[lit] = True
+                clause.append(lit)
+        if not clause:
+            self._ok = False
+        elif len(clause) == 1:
+            self._assign(clause[0], None)
+            self._ok = self._propagate() is None
+        else:
+            self._watch(clause)
+        return self._ok
+
+    def solve(self, assumptions=()):
+        """
+        Look for a solution where all the given literals hold. Return
+        True if one is found, and then getValue() tells what it is.
+        Otherwise getCore() tells which assumptions can't hold together.
+        """
+        self._model = None
+        self._core = []
+        if not self._ok:
+            return False
+        self._cancel(0)
+        if self._reorder:
+            activity = self._activity
+            self._order = [(-activity[x], x) for x in range(1, len(activity))]
+            heapq.heapify(self._order)
+            self._reorder = False
+        restart = RESTARTFIRST
+        conflicts = 0
+        while True:
+            conflict = self._propagate()
+            if conflict is not None:
+                self._conflicts += 1
+                conflicts += 1
+                if not self._limits:
+                    self._ok = False
+                    return False
+                learned, level = self._analyze(conflict)
+                self._cancel(level)
+                if len(learned) == 1:
+                    self._assign(learned[0], None)
+                else:
+                    self._watch(learned)
+                    self._assign(learned[0], learned)
+                self._increment /= ACTIVITYDECAY
+                continue
+            if conflicts >= restart:
+                conflicts = 0
+                restart *= RESTARTGROWTH
+                self._cancel(0)
+                continue
+            lit = None
+            while len(self._limits) < len(assumptions):
+                lit = assumptions[len(self._limits)]
+                value = self._litValue(lit)
+                if value is True:
+                    # Already holds, so open an empty level for it.
+                    self._limits.append(len(self._trail))
+                    lit = None
+                elif value is False:
+                    self._core = self._analyzeFinal(lit)
+                    self._cancel(0)
+                    return False
+                else:
+                    break
+            if lit is None:
+                lit = self._pickLiteral()
+                if lit is None:
+                    self._model = self._value[:]
+                    self._cancel(0)
+                    return True
+                self._decisions += 1
+            self._limits.append(len(self._trail))
+            self._assign(lit, None)
+
+    def getValue(self, var):
+        return self._model[var]
+
+    def getCore(self):
+        """
+        Return the assumptions which made the last solve() fail, or
+        an empty list if the problem has no solution at all.
+        """
+        return self._core
+
+    def getStats(self):
+        return {"conflicts": self._conflicts, "decisions": self._decisions}
+
+    def _litValue(self, lit):
+        if lit > 0:
+            return self._value[lit]
+        value = self._value[-lit]
+        if value is None:
+            return None
+        return not value
+
+    def _assign(self, lit, reason):
+        var = abs(lit)
+        self._value[var] = lit > 0
+        self._level[var] = len(self._limits)
+        self._reason[var] = reason
+        self._trail.append(lit)
+
+    def _watch(self, clause):
+        watches = self._watches
+        for lit in clause[:2]:
+            lst = watches.get(lit)
+            if lst is None:
+                watches[lit] = [clause]
+            else:
+                lst.append(clause)
+
+    def _cancel(self, level):
+        if len(self._limits) <= level:
+            return
+        limit = self._limits[level]
+        value = self._value
+        phase = self._phase
+        reason = self._reason
+        activity = self._activity
+        order = self._order
+        for lit in self._trail[limit:]:
+            var = abs(lit)
+            phase[var] = value[var]
+            value[var] = None
+            reason[var] = None
+            heapq.heappush(order, (-activity[var], var))
+        del self._trail[limit:]
+        del self._limits[level:]
+        self._qhead = len(self._trail)
+
+    def _propagate(self):
+        # Each clause watches two of its literals, kept as the first
+        # two, and is only looked at when one of them becomes false.
+        trail = self._trail
+        watches = self._watches
+        litValue = self._litValue
+        while self._qhead < len(trail):
+            falselit = -trail[self._qhead]
+            self._qhead += 1
+            lst = watches.get(falselit)
+            if not lst:
+                continue
+            kept = []
+            conflict = None
+            for clause in lst:
+                if conflict is not None:
+                    kept.append(clause)
+                    continue
+                if clause[0] == falselit:
+                    clause[0], clause[1] = clause[1], falselit
+                first = clause[0]
+                value = litValue(first)
+                if value is True:
+                    kept.append(clause)
+                    continue
+                for i in range(2, len(clause)):
+                    lit = clause[i]
+                    if litValue(lit) is not False:
+                        clause[1], clause[i] = lit, falselit
+                        other = watches.get(lit)
+                        if other is None:
+                            watches[lit] = [clause]
+                        else:
+                            other.append(clause)
+                        break
+                else:
+                    kept.append(clause)
+                    if value is False:
+                        conflict = clause
+                    else:
+                        self._assign(first, clause)
+            watches[falselit] = kept
+            if conflict is not None:
+                self._qhead = len(trail)
+                return conflict
+        return None
+
+    def _analyze(self, conflict):
+        # Resolve the conflict with the reasons of the literals
+        # assigned at the current level, until a single one is left.
+        level = self._level
+        reason = self._reason
+        trail = self._trail
+        current = len(self._limits)
+        seen = {}
+        learned = [None]
+        pending = 0
+        index = len(trail)-1
+        lit = None
+        clause = conflict
+        while True:
+            for other in clause:
+                var = abs(other)
+                if lit is not None and var == abs(lit):
+                    continue
+                if var not in seen and level[var] > 0:
+                    seen[var] = True
+                    self._bump(var)
+                    if level[var] == current:
+                        pending += 1
+                    else:
+                        learned.append(other)
+            while abs(trail[index]) not in seen:
+                index -= 1
+            lit = trail[index]
+            index -= 1
+            pending -= 1
+            if pending == 0:
+                break
+            clause = reason[abs(lit)]
+        learned[0] = -lit
+        if len(learned) == 1:
+            return learned, 0
+        best = 1
+        for i in range(2, len(learned)):
+            if level[abs(learned[i])] > level[abs(learned[best])]:
+                best = i
+        learned[1], learned[best] = learned[best], learned[1]
+        return learned, level[abs(learned[1])]
+
+    def _analyzeFinal(self, lit):
+        # Find the assumptions which forced lit to be false.
+        core = [lit]
+        if not self._limits:
+            return core
+        seen = {abs(lit): True}
+        reason = self._reason
+        level = self._level
+        for other in self._trail[self._limits[0]:][::-1]:
+            var = abs(other)
+            if var not in seen:
+                continue
+            clause = reason[var]
+            if clause is None:
+                core.append(other)
+            else:
+                for x in clause:
+                    if level[abs(x)] > 0:
+                        seen[abs(x)] = True
+        return core
+
+    def _bump(self, var):
+        activity = self._activity
+        activity[var] += self._increment
+        if activity[var] > 1e100:
+            for i in range(1, len(activity)):
+                activity[i] *= 1e-100
+            self._increment *= 1e-100
+            self._order = [(-activity[x], x) for x in range(1, len(activity))
+                           if self._value[x] is None]
+            heapq.heapify(self._order)
+        elif self._value[var] is None:
+            heapq.heappush(self._order, (-activity[var], var))
+
+    def _pickLiteral(self):
+        # Entries get stale as activities grow, so the ones for
+        # assigned variables or with an old activity are skipped.
+        order = self._order
+        value = self._value
+        activity = self._activity
+        while order:
+            negactivity, var = heapq.heappop(order)
+            if value[var] is None and -negactivity == activity[var]:
+                if self._phase[var]:
+                    return var
+                return -var
+        for var in range(1, len(value)):
+            if value[var] is None:
+                if self._phase[var]:
+                    return var
+                return -var
+        return None
@@ -26,6 +26,7 @@ from smart.util.distance import *
 import posixpath
 import string
 import sys
+import re
 
 class ShortURL(object):
     def __init__(self, maxlen):
@@ -108,6 +109,47 @@ def strToBool(s, default=False):
         return False
     return default
 
+_jsonescape = re.compile(u'["\\\\]|[^\x20-\x7e]')
+
+def _jsonEscape(match):
+    c = match.group()
+    if c == '"' or c == "\\":
+        return "\\"+c
+    n = ord(c)
+    if n > 0xffff:
+        n -= 0x10000
+        return "\\u%04x\\u%04x" % (0xd800+(n >> 10), 0xdc00+(n & 0x3ff))
+    return "\\u%04x" % n
+
+def dumpJSON(obj):
+    """
+    Encode obj, made of dicts, lists, tuples, strings, numbers, booleans
+    and None, as JSON. Keys of dicts are sorted, strings are taken as
+    UTF-8, and everything but printable ASCII is escaped, so that the
+    result is a plain ASCII string.
+    """
+    if obj is None:
+        return "null"
+    if obj is True:
+        return "true"
+    if obj is False:
+        return "false"
+    if isinstance(obj, dict):
+        keys = obj.keys()
+        keys.sort()
+        return "{%s}" % ", ".join(["%s: %s" % (dumpJSON(str(key)),
+                                               dumpJSON(obj[key]))
+                                   for key in keys])
+    if isinstance(obj, (list, tuple)):
+        return "[%s]" % ", ".join([dumpJSON(x) for x in obj])
+    if isinstance(obj, float):
+        return repr(obj)
+    if isinstance(obj, (int, long)):
+        return str(obj)
+    if not isinstance(obj, unicode):
+        obj = str(obj).decode("utf-8", "replace")
+    return '"%s"' % str(_jsonescape.sub(_jsonEscape, obj))
+
 def printColumns(lst, indent=0, spacing=2, width=80, out=None):
     maxstrlen = 0
     for item in lst:
@@ -0,0 +1,270 @@
+import unittest
+import os
+
+from smart.channel import createChannel
+from smart.progress import Progress
+from smart.fetcher import Fetcher
+from smart.cache import Cache
+from smart import *
+
+from tests import TESTDATADIR
+
+
+class IncrementalLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.debchannel = self.createChannel("deb", "deb-dir", "deb")
+        self.slackchannel = self.createChannel("slack", "slack-dir", "slack")
+
+    def createChannel(self, alias, type, dirname):
+        channel = createChannel(alias,
+                                {"type": type,
+                                 "path": os.path.join(TESTDATADIR, dirname)})
+        channel.fetch(Fetcher(), Progress())
+        return channel
+
+    def fullCache(self, *channels):
+        cache = Cache()
+        for channel in channels:
+            channel = self.createChannel(channel.getAlias(), channel.getType(),
+                                         os.path.basename(channel._path))
+            channel.addLoaders(cache)
+        cache.load()
+        return cache
+
+    def describe(self, cache):
+        result = []
+        for pkg in cache.getPackages():
+            result.append(("pkg", str(pkg), pkg.installed,
+                           sorted([str(x) for x in pkg.provides])))
+        for prv in cache.getProvides():
+            result.append(("prv", str(prv),
+                           sorted([str(x) for x in prv.packages]),
+                           sorted([str(x) for x in prv.requiredby]),
+                           sorted([str(x) for x in prv.upgradedby]),
+                           sorted([str(x) for x in prv.conflictedby])))
+        for kind, deps in (("req", cache.getRequires()),
+                           ("upg", cache.getUpgrades()),
+                           ("cnf", cache.getConflicts())):
+            for dep in deps:
+                result.append((kind, str(dep),
+                               sorted([str(x) for x in dep.packages]),
+                               sorted([str(x) for x in dep.providedby])))
+        result.sort()
+        return result
+
+    def test_add_loader(self):
+        cache = Cache()
+        self.debchannel.addLoaders(cache)
+        cache.load()
+        self.slackchannel.addLoaders(cache)
+        cache.load()
+        self.assertTrue(cache._linked)
+        self.assertEquals(self.describe(cache),
+                          self.describe(self.fullCache(self.debchannel,
+                                                       self.slackchannel)))
+
+    def test_remove_loader(self):
+        cache = Cache()
+        self.debchannel.addLoaders(cache)
+        self.slackchannel.addLoaders(cache)
+        cache.load()
+        self.slackchannel.removeLoaders()
+        cache.load()
+        self.assertEquals(self.describe(cache),
+                          self.describe(self.fullCache(self.debchannel)))
+        for pkg in cache.getPackages():
+            self.assertEquals(pkg.loaders.keys(),
+                              self.debchannel.getLoaders())
+
+    def test_replace_loader(self):
+        cache = Cache()
+        self.debchannel.addLoaders(cache)
+        self.slackchannel.addLoaders(cache)
+        cache.load()
+        before = self.describe(cache)
+        self.debchannel.removeLoaders()
+        self.debchannel.fetch(Fetcher(), Progress())
+        self.debchannel.addLoaders(cache)
+        cache.load()
+        self.assertEquals(self.describe(cache), before)
+        self.assertEquals(len(cache._objmap),
+                          len(self.fullCache(self.debchannel,
+                                             self.slackchannel)._objmap))
+
+    def test_remove_shared_loader(self):
+        otherchannel = self.createChannel("other", "deb-dir", "deb")
+        cache = Cache()
+        self.debchannel.addLoaders(cache)
+        otherchannel.addLoaders(cache)
+        cache.load()
+        before = self.describe(cache)
+        otherchannel.removeLoaders()
+        cache.load()
+        self.assertEquals(self.describe(cache), before)
+        for pkg in cache.getPackages():
+            self.assertEquals(pkg.loaders.keys(),
+                              self.debchannel.getLoaders())
+
+    def test_loaded_packages_force_full_link(self):
+        cache = Cache()
+        self.debchannel.addLoaders(cache)
+        cache.load()
+        othercache = Cache()
+        self.slackchannel.addLoaders(othercache)
+        othercache.load()
+        othercache.reset()
+        self.assertTrue(cache._linked)
+        self.slackchannel.addLoaders(cache)
+        self.assertFalse(cache._linked)
+        cache.load()
+        self.assertEquals(self.describe(cache),
+                          self.describe(self.fullCache(self.debchannel,
+                                                       self.slackchannel)))
+
+    def test_reset(self):
+        cache = Cache()
+        self.debchannel.addLoaders(cache)
+        cache.load()
+        cache.reset()
+        self.assertFalse(cache._linked)
+        self.assertEquals(cache._prvnames, {})
+        self.assertEquals(cache._reqnames, {})
+        cache.load()
+        self.assertEquals(self.describe(cache),
+                          self.describe(self.fullCache(self.debchannel)))
+
+
+class NameIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache()
+        for alias, type, dirname in (("deb", "deb-dir", "deb"),
+                                     ("slack", "slack-dir", "slack")):
+            channel = createChannel(alias,
+                                    {"type": type,
+                                     "path": os.path.join(TESTDATADIR,
+                                                          dirname)})
+            channel.fetch(Fetcher(), Progress())
+            channel.addLoaders(self.cache)
+        self.cache.load()
+
+    def getters(self):
+        cache = self.cache
+        return ((cache.getPackages, cache.getPackagesByNames),
+                (cache.getProvides, cache.getProvidesByNames),
+                (cache.getRequires, cache.getRequiresByNames),
+                (cache.getRecommends, cache.getRecommendsByNames),
+                (cache.getUpgrades, cache.getUpgradesByNames),
+                (cache.getConflicts, cache.getConflictsByNames))
+
+    def test_lookup_by_name(self):
+        for get, getbynames in self.getters():
+            objs = get()
+            self.assertTrue(objs)
+            for obj in objs:
+                self.assertEquals(get(obj.name),
+                                  [x for x in objs if x.name == obj.name])
+            self.assertEquals(get("unknown"), [])
+
+    def test_lookup_returns_copy(self):
+        name = self.cache.getPackages()[0].name
+        self.cache.getPackages(name).append(None)
+        self.assertTrue(None not in self.cache.getPackages(name))
+
+    def test_lookup_by_names(self):
+        for get, getbynames in self.getters():
+            names = [x.name for x in get()] + ["unknown"]
+            result = getbynames(names)
+            self.assertEquals(sorted(result.keys()),
+                              sorted(set(names[:-1])))
+            for name in result:
+                self.assertEquals(result[name], get(name))
+
+    def test_lookup_before_linking(self):
+        self.cache.reset()
+        self.cache._reload()
+        self.assertFalse(self.cache._linked)
+        self.test_lookup_by_name()
+        self.test_lookup_by_names()
+
+    def test_lookup_after_removing_loader(self):
+        loader = [x for x in self.cache._loaders
+                    if x.getChannel().getAlias() == "slack"][0]
+        loader.getChannel().removeLoaders()
+        self.cache.load()
+        for get, getbynames in self.getters():
+            objs = get()
+            for obj in objs:
+                self.assertEquals(get(obj.name),
+                                  [x for x in objs if x.name == obj.name])
+
+class ParallelLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.channels = []
+        for alias, type, dirname in (("deb", "deb-dir", "deb"),
+                                     ("slack", "slack-dir", "slack"),
+                                     ("other", "deb-dir", "deb")):
+            channel = createChannel(alias,
+                                    {"type": type,
+                                     "path": os.path.join(TESTDATADIR,
+                                                          dirname)})
+            channel.fetch(Fetcher(), Progress())
+            self.channels.append(channel)
+
+    def tearDown(self):
+        sysconf.remove("load-jobs")
+
+    def createCache(self):
+        cache = Cache()
+        for channel in self.channels:
+            channel.removeLoaders()
+            channel.fetch(Fetcher(), Progress())
+            channel.addLoaders(cache)
+        return cache
+
+    def loadCache(self, jobs):
+        sysconf.set("load-jobs", jobs)
+        cache = self.createCache()
+        cache.load()
+        return cache
+
+    def describe(self, cache):
+        result = []
+        for pkg in cache.getPackages():
+            infos = []
+            for loader in cache._loaders:
+                if loader in pkg.loaders:
+                    info = loader.getInfo(pkg)
+                    infos.append((loader.getChannel().getAlias(),
+                                  info.getSummary(), info.getURLs()))
+            result.append((str(pkg), pkg.installed, infos,
+                           [str(x) for x in pkg.provides],
+                           [str(x) for x in pkg.requires],
+                           [str(x) for x in pkg.upgrades],
+                           [str(x) for x in pkg.conflicts]))
+        for prv in cache.getProvides():
+            result.append((str(prv),
+                           [str(x) for x in prv.packages],
+                           [str(x) for x in prv.requiredby]))
+        return result
+
+    def test_same_as_serial(self):
+        self.assertEquals(self.describe(self.loadCache(3)),
+                          self.describe(self.loadCache(1)))
+
+    def test_failing_loader_is_loaded_by_parent(self):
+        expected = self.describe(self.loadCache(1))
+        cache = self.createCache()
+        loader = self.channels[0].getLoaders()[0]
+        load = loader.load
+        parent = os.getpid()
+        def failInWorker():
+            if os.getpid() != parent:
+                raise Error, "failed"
+            load()
+        loader.load = failInWorker
+        sysconf.set("load-jobs", 2)
+        cache.load()
+        self.assertEquals(self.describe(cache), expected)
@@ -0,0 +1,176 @@
+import tempfile
+import unittest
+import shutil
+import os
+
+from smart.channel import createChannel
+from smart.diskcache import DiskCache
+from smart.progress import Progress
+from smart.fetcher import Fetcher
+from smart.cache import Cache, Provides, StateVersionError
+from smart.searchindex import getPathIndex, getTextIndexes
+
+from tests import TESTDATADIR
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "cache")
+        self.channel = createChannel("alias",
+                                     {"type": "deb-dir",
+                                      "path": os.path.join(TESTDATADIR, "deb")})
+        self.channel.fetch(Fetcher(), Progress())
+        self.cache = Cache()
+        self.channel.addLoaders(self.cache)
+        self.cache.load()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def restore(self, diskcache):
+        channels, sysconfchannels = diskcache.load(self.path)
+        cache = Cache()
+        diskcache.materialize(cache, channels.values())
+        cache.reset()
+        cache.load()
+        return channels, cache
+
+    def describe(self, cache):
+        result = []
+        for pkg in cache.getPackages():
+            result.append((pkg.name, pkg.version,
+                           sorted([str(x) for x in pkg.provides]),
+                           sorted([str(x) for x in pkg.requires]),
+                           sorted([str(x) for x in pkg.upgrades]),
+                           sorted([str(x) for x in pkg.conflicts]),
+                           sorted([str(prvpkg) for req in pkg.requires
+                                               for prv in req.providedby
+                                               for prvpkg in prv.packages])))
+        result.sort()
+        return result
+
+    def test_save_and_load(self):
+        DiskCache(1).save(self.path, {"alias": self.channel}, {"alias": {}})
+        channels, cache = self.restore(DiskCache(1))
+        self.assertEquals(channels.keys(), ["alias"])
+        self.assertEquals(self.describe(cache), self.describe(self.cache))
+
+    def test_loader_state(self):
+        DiskCache(1).save(self.path, {"alias": self.channel}, {})
+        channels, cache = self.restore(DiskCache(1))
+        loader = channels["alias"].getLoaders()[0]
+        self.assertEquals(loader.getChannel(), channels["alias"])
+        self.assertEquals(loader.getCache(), cache)
+        pkg = sorted(loader.getPackages())[0]
+        self.assertEquals(loader.getInfo(pkg).getSummary(), "Summary1")
+
+    def test_search_index(self):
+        DiskCache(1).save(self.path, {"alias": self.channel}, {})
+        channels, cache = self.restore(DiskCache(1))
+        loader = channels["alias"].getLoaders()[0]
+        self.assertNotEquals(loader._searchindex, None)
+        names = sorted(set([pkg.name for pkg in loader.getPackages()]))
+        self.assertEquals(loader._searchindex.getPackageNames("", 100),
+                          names)
+        self.assertEquals(loader._searchindex._paths, None)
+        self.assertEquals(loader._searchindex._texts, None)
+
+    def test_search_index_saved_once_built(self):
+        DiskCache(1).save(self.path, {"alias": self.channel}, {})
+        data = open(self.path).read()
+        diskcache = DiskCache(1)
+        channels, sysconfchannels = diskcache.load(self.path)
+        diskcache.materialize(Cache(), channels.values())
+        loader = channels["alias"].getLoaders()[0]
+        getPathIndex(loader)
+        getTextIndexes(loader)
+        diskcache.save(self.path, channels, sysconfchannels)
+        self.assertNotEquals(open(self.path).read(), data)
+        channels, cache = self.restore(DiskCache(1))
+        loader = channels["alias"].getLoaders()[0]
+        self.assertNotEquals(loader._searchindex._paths, None)
+        self.assertNotEquals(loader._searchindex._texts, None)
+
+    def test_not_materialized_before_needed(self):
+        DiskCache(1).save(self.path, {"alias": self.channel}, {})
+        diskcache = DiskCache(1)
+        channels, sysconfchannels = diskcache.load(self.path)
+        loader = channels["alias"].getLoaders()[0]
+        self.assertEquals(loader.getPackages(), [])
+        self.assertEquals(loader.getCache(), None)
+        self.assertFalse(diskcache.materialize(Cache(), []))
+        self.assertEquals(loader.getPackages(), [])
+        self.assertTrue(diskcache.materialize(Cache(), channels.values()))
+        self.assertNotEquals(loader.getPackages(), [])
+
+    def test_links(self):
+        DiskCache(1).save(self.path, {"alias": self.channel}, {})
+        diskcache = DiskCache(1)
+        channels, sysconfchannels = diskcache.load(self.path)
+        cache = Cache()
+        diskcache.materialize(cache, channels.values())
+        self.assertTrue(cache._linked)
+        self.assertEquals(self.describe(cache), self.describe(self.cache))
+        cache.load()
+        self.assertEquals(self.describe(cache), self.describe(self.cache))
+
+    def test_links_need_an_empty_cache(self):
+        DiskCache(1).save(self.path, {"alias": self.channel}, {})
+        diskcache = DiskCache(1)
+        channels, sysconfchannels = diskcache.load(self.path)
+        other = createChannel("other",
+                              {"type": "deb-dir",
+                               "path": os.path.join(TESTDATADIR, "deb")})
+        other.fetch(Fetcher(), Progress())
+        cache = Cache()
+        other.addLoaders(cache)
+        cache.load()
+        diskcache.materialize(cache, channels.values())
+        self.assertFalse(cache._linked)
+        cache.load()
+        self.assertEquals(self.describe(cache), self.describe(self.cache))
+
+    def test_links_not_saved_for_unlinked_cache(self):
+        self.cache.reset()
+        DiskCache(1).save(self.path, {"alias": self.channel}, {})
+        diskcache = DiskCache(1)
+        channels, sysconfchannels = diskcache.load(self.path)
+        cache = Cache()
+        diskcache.materialize(cache, channels.values())
+        self.assertFalse(cache._linked)
+
+    def test_unchanged_sections_are_copied(self):
+        DiskCache(1).save(self.path, {"alias": self.channel}, {})
+        data = open(self.path).read()
+        diskcache = DiskCache(1)
+        channels, sysconfchannels = diskcache.load(self.path)
+        diskcache.save(self.path, channels, sysconfchannels)
+        self.assertEquals(open(self.path).read(), data)
+        # Materialized loaders are still backed by the same section.
+        diskcache.materialize(Cache(), channels.values())
+        diskcache.save(self.path, channels, sysconfchannels)
+        self.assertEquals(open(self.path).read(), data)
+
+    def test_file_provides_are_saved(self):
+        DiskCache(1).save(self.path, {"alias": self.channel}, {})
+        diskcache = DiskCache(1)
+        channels, sysconfchannels = diskcache.load(self.path)
+        cache = Cache()
+        diskcache.materialize(cache, channels.values())
+        loader = channels["alias"].getLoaders()[0]
+        pkg = sorted(loader.getPackages())[0]
+        loader.buildFileProvides(pkg, (Provides, "/bin/name", None))
+        diskcache.save(self.path, channels, sysconfchannels)
+        channels, cache = self.restore(DiskCache(1))
+        pkg = sorted(cache.getPackages())[0]
+        self.assertTrue("/bin/name" in [x.name for x in pkg.provides])
+
+    def test_state_version(self):
+        DiskCache(1).save(self.path, {"alias": self.channel}, {})
+        self.assertRaises(StateVersionError, DiskCache(2).load, self.path)
+
+    def test_invalid_file(self):
+        open(self.path, "w").write("not a cache")
+        self.assertRaises(StateVersionError, DiskCache(1).load, self.path)
@@ -1,4 +1,5 @@
 import BaseHTTPServer
+import SocketServer
 import threading
 import unittest
 import socket
@@ -6,13 +7,20 @@ import signal
 import time
 import os
 
+try:
+    from hashlib import sha256
+except ImportError:
+    from smart.util.sha256 import sha256
+
 from smart.progress import Progress
 from smart.interface import Interface
 from smart.fetcher import Fetcher
-from smart.const import VERSION, SUCCEEDED, FAILED
+from smart.uncompress import GZipHandler
+from smart.const import VERSION, SUCCEEDED, FAILED, NEVER
 from smart import fetcher, sysconf, iface
 
 from tests.mocker import MockerTestCase
+from tests import TESTDATADIR
 
 
 PORT = 43543
@@ -28,6 +36,11 @@ class HTTPServer(BaseHTTPServer.HTTPServer):
             BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
 
 
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+
 class FetcherTest(MockerTestCase):
 
     def setUp(self):
@@ -126,6 +139,57 @@ class FetcherTest(MockerTestCase):
         item = self.fetcher.getItem(URL)
         self.assertEquals(item.getFailedReason(), u"File not found")
 
+    def test_conditional_request(self):
+        self.fetcher.setCaching(NEVER)
+        lastmodified = "Mon, 01 Jun 2009 12:00:00 GMT"
+        def handler(request):
+            request.send_response(200)
+            request.send_header("Content-Length", "6")
+            request.send_header("ETag", '"abc"')
+            request.send_header("Last-Modified", lastmodified)
+            request.end_headers()
+            request.wfile.write("Hello!")
+        self.start_server(handler)
+        self.fetcher.enqueue(URL)
+        self.fetcher.run(progress=Progress())
+        self.wait_for_server()
+        localpath = self.fetcher.getItem(URL).getTargetPath()
+        self.fetcher.reset()
+
+        headers = {}
+        def handler(request):
+            headers.update(request.headers)
+            request.send_response(304)
+            request.end_headers()
+        self.start_server(handler)
+        self.fetcher.enqueue(URL)
+        self.fetcher.run(progress=Progress())
+        self.wait_for_server()
+        item = self.fetcher.getItem(URL)
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        self.assertEquals(item.getTargetPath(), localpath)
+        self.assertEquals(open(localpath).read(), "Hello!")
+        self.assertEquals(headers.get("if-none-match"), '"abc"')
+        self.assertEquals(headers.get("if-modified-since"), lastmodified)
+
+    def test_conditional_request_ignores_stale_validators(self):
+        self.fetcher.setCaching(NEVER)
+        localpath = self.fetcher.getLocalPath(self.fetcher.enqueue(URL))
+        open(localpath, "w").write("Hello!")
+        open(localpath+".validators", "w").write("size: 3\nmtime: 0\n"
+                                                 "etag: \"abc\"\n")
+        headers = {}
+        def handler(request):
+            headers.update(request.headers)
+            request.send_response(304)
+            request.end_headers()
+        self.start_server(handler)
+        self.fetcher.run(progress=Progress())
+        self.wait_for_server()
+        self.assertEquals(self.fetcher.getItem(URL).getStatus(), SUCCEEDED)
+        self.assertTrue("if-none-match" not in headers)
+        self.assertTrue("if-modified-since" in headers)
+
     def test_timeout(self):
         timeout = 3
         sleep_time = 6
@@ -172,3 +236,345 @@ class FetcherTest(MockerTestCase):
         
         self.assertTrue(elapsed_time >= bytes / rate_limit)
     
+
+    def test_clone_shares_active_downloads(self):
+        sysconf.set("max-active-downloads", 2, soft=True)
+        self.fetcher.resetActiveDownloads()
+        clone1 = self.fetcher.clone()
+        clone2 = self.fetcher.clone()
+        self.assertTrue(clone1.changeActiveDownloads(+1))
+        self.assertTrue(clone2.changeActiveDownloads(+1))
+        self.assertFalse(clone1.changeActiveDownloads(+1))
+        self.assertEquals(self.fetcher.getActiveDownloads(), 2)
+        clone2.changeActiveDownloads(-1)
+        self.assertTrue(clone1.changeActiveDownloads(+1))
+
+    def test_clone_runs_in_parallel(self):
+        def handler(request):
+            request.send_header("Content-Length", "6")
+            request.wfile.write("Hello!")
+        self.start_server(handler)
+        self.fetcher.resetActiveDownloads()
+        clone = self.fetcher.clone()
+        self.assertEquals(clone.getLocalPathPrefix(), self.local_path + "/")
+        clone.enqueue(URL)
+        thread = threading.Thread(target=clone.run,
+                                  kwargs={"progress": Progress()})
+        thread.start()
+        thread.join()
+        self.assertEquals(clone.getItem(URL).getStatus(), SUCCEEDED)
+        self.assertEquals(self.fetcher.getItem(URL), None)
+        self.assertEquals(self.fetcher.getActiveDownloads(), 0)
+
+    def test_stream_uncompress(self):
+        data = open(os.path.join(TESTDATADIR, "uncompress/test.gz")).read()
+        orig = open(os.path.join(TESTDATADIR, "uncompress/test.txt")).read()
+        def handler(request):
+            request.send_response(200)
+            request.send_header("Content-Length", str(len(data)))
+            request.end_headers()
+            request.wfile.write(data)
+        self.start_server(handler)
+        uncompressed = []
+        def uncompress(self, localpath):
+            uncompressed.append(localpath)
+        GZipHandler.uncompress, original = uncompress, GZipHandler.uncompress
+        sysconf.set("stream-uncompress", True)
+        try:
+            url = URL[:-4]+".gz"
+            self.fetcher.enqueue(url, uncomp=True,
+                                 uncomp_sha256=sha256(orig).hexdigest())
+            self.fetcher.run(progress=Progress())
+        finally:
+            GZipHandler.uncompress = original
+            sysconf.remove("stream-uncompress")
+        self.assertEquals(uncompressed, [])
+        item = self.fetcher.getItem(url)
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        self.assertEquals(item.getTargetPath(),
+                          os.path.join(self.local_path, "filename"))
+        self.assertEquals(open(item.getTargetPath()).read(), orig)
+
+    def test_stream_uncompress_invalid(self):
+        data = open(os.path.join(TESTDATADIR, "uncompress/test.gz")).read()
+        def handler(request):
+            request.send_response(200)
+            request.send_header("Content-Length", str(len(data)))
+            request.end_headers()
+            request.wfile.write(data)
+        self.start_server(handler)
+        uncompressed = []
+        def uncompress(self, localpath):
+            uncompressed.append(localpath)
+        GZipHandler.uncompress, original = uncompress, GZipHandler.uncompress
+        sysconf.set("stream-uncompress", True)
+        try:
+            url = URL[:-4]+".gz"
+            self.fetcher.enqueue(url, uncomp=True,
+                                 uncomp_sha256=sha256("").hexdigest())
+            self.fetcher.run(progress=Progress())
+        finally:
+            GZipHandler.uncompress = original
+            sysconf.remove("stream-uncompress")
+        # The streamed output didn't validate, so it was dropped, and
+        # the regular uncompress step was taken.
+        localpath = os.path.join(self.local_path, "filename.gz")
+        self.assertEquals(uncompressed, [localpath])
+        self.assertEquals(os.listdir(self.local_path), ["filename.gz"])
+
+    def test_digests_computed_while_downloading(self):
+        def handler(request):
+            request.send_response(200)
+            request.send_header("Content-Length", "6")
+            request.end_headers()
+            request.wfile.write("Hello!")
+        self.start_server(handler)
+        read = []
+        def getFileDigests(path, names):
+            read.append(path)
+            return original(path, names)
+        fetcher.getFileDigests, original = (getFileDigests,
+                                            fetcher.getFileDigests)
+        try:
+            self.fetcher.enqueue(URL, size=6,
+                                 sha256=sha256("Hello!").hexdigest())
+            self.fetcher.run(progress=Progress())
+        finally:
+            fetcher.getFileDigests = original
+        self.assertEquals(self.fetcher.getItem(URL).getStatus(), SUCCEEDED)
+        self.assertEquals(read, [])
+
+    def test_run_blocks_until_items_change(self):
+        ticks = []
+        class Handler(fetcher.FetcherHandler):
+            def tick(self):
+                ticks.append(self._fetcher.time)
+                if self._queue:
+                    item = self._queue.pop()
+                    def finish():
+                        item.start()
+                        time.sleep(0.5)
+                        item.setSucceeded(self.getLocalPath(item))
+                    threading.Thread(target=finish).start()
+                    self.item = item
+                return self.item.getStatus() != SUCCEEDED
+        Fetcher.setHandler("test", Handler)
+        try:
+            self.fetcher.enqueue("test://host/filename.pkg")
+            self.fetcher.run(progress=Progress())
+        finally:
+            del Fetcher._registry["test"]
+        self.assertEquals(self.fetcher.getItem("test://host/filename.pkg")
+                                      .getStatus(), SUCCEEDED)
+        # Once when starting, once when the item starts running, and
+        # once when it succeeds. Polling would tick every 100ms.
+        self.assertTrue(len(ticks) <= 3, ticks)
+
+    def test_slot_release_wakes_up_clones(self):
+        self.fetcher.resetActiveDownloads()
+        clone = self.fetcher.clone()
+        clone._setRunning(True)
+        try:
+            self.assertTrue(clone.changeActiveDownloads(+1))
+            clone._woken = False
+            self.fetcher.changeActiveDownloads(-1)
+            self.assertTrue(clone._woken)
+            self.assertEquals(clone._waitEvents(10), [])
+            self.assertFalse(clone._woken)
+        finally:
+            clone._setRunning(False)
+
+
+class HTTPKeepAliveHandlerTest(MockerTestCase):
+
+    def setUp(self):
+        self.local_path = self.makeDir()
+        self.fetcher = Fetcher()
+        self.fetcher.setLocalPathPrefix(self.local_path + "/")
+        self.registry = Fetcher._registry.copy()
+        fetcher.enableHTTPKeepAlive()
+        fetcher.HTTPKeepAliveHandler._idle.clear()
+        self.connections = []
+        self.paths = []
+        signal.signal(signal.SIGPIPE, signal.SIG_IGN)
+
+    def tearDown(self):
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+        Fetcher._registry.clear()
+        Fetcher._registry.update(self.registry)
+        for conns in fetcher.HTTPKeepAliveHandler._idle.values():
+            for conn in conns:
+                conn.close()
+        fetcher.HTTPKeepAliveHandler._idle.clear()
+        sysconf.remove("http-connections-per-host")
+        if hasattr(self, "httpd"):
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def start_server(self, handler):
+        test = self
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def setup(self):
+                test.connections.append(self.client_address)
+                BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+            def do_GET(self):
+                test.paths.append(self.path)
+                return handler(self)
+            def log_message(self, format, *args):
+                pass
+        while True:
+            try:
+                self.httpd = ThreadingHTTPServer(("127.0.0.1", PORT+1),
+                                                 Handler)
+                break
+            except socket.error, error:
+                if "Address already in use" not in str(error):
+                    raise
+                time.sleep(1)
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def send(self, request, data, code=200, **headers):
+        request.send_response(code)
+        request.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+    def url(self, name):
+        return "http://127.0.0.1:%d/%s" % (PORT+1, name)
+
+    def test_handler_is_registered(self):
+        self.assertEquals(Fetcher._registry["http"],
+                          fetcher.HTTPKeepAliveHandler)
+        self.assertEquals(Fetcher._registry["https"],
+                          fetcher.HTTPKeepAliveHandler)
+
+    def test_reuses_connection(self):
+        sysconf.set("http-connections-per-host", 1)
+        def handler(request):
+            self.send(request, request.path)
+        self.start_server(handler)
+        urls = [self.url("file%d" % i) for i in range(5)]
+        for url in urls:
+            self.fetcher.enqueue(url)
+        self.fetcher.run(progress=Progress())
+        for i, url in enumerate(urls):
+            item = self.fetcher.getItem(url)
+            self.assertEquals(item.getStatus(), SUCCEEDED)
+            self.assertEquals(open(item.getTargetPath()).read(), "/file%d" % i)
+        self.assertEquals(len(self.connections), 1)
+        self.assertEquals(sorted(self.paths),
+                          ["/file%d" % i for i in range(5)])
+
+    def test_idle_connection_is_kept_between_runs(self):
+        def handler(request):
+            self.send(request, "Hello!")
+        self.start_server(handler)
+        self.fetcher.enqueue(self.url("file1"))
+        self.fetcher.run(progress=Progress())
+        self.fetcher.reset()
+        self.fetcher.enqueue(self.url("file2"))
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(self.fetcher.getItem(self.url("file2")).getStatus(),
+                          SUCCEEDED)
+        self.assertEquals(len(self.connections), 1)
+
+    def test_connections_per_host(self):
+        sysconf.set("http-connections-per-host", 2)
+        active = []
+        maxactive = []
+        lock = threading.Lock()
+        def handler(request):
+            lock.acquire()
+            active.append(request)
+            maxactive.append(len(active))
+            lock.release()
+            time.sleep(0.1)
+            lock.acquire()
+            active.remove(request)
+            lock.release()
+            self.send(request, "Hello!")
+        self.start_server(handler)
+        for i in range(6):
+            self.fetcher.enqueue(self.url("file%d" % i))
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(len(self.fetcher.getSucceededSet()), 6)
+        self.assertEquals(max(maxactive), 2)
+        self.assertEquals(len(self.connections), 2)
+
+    def test_server_closing_idle_connection(self):
+        def handler(request):
+            self.send(request, "Hello!")
+        self.start_server(handler)
+        self.fetcher.enqueue(self.url("file1"))
+        self.fetcher.run(progress=Progress())
+        for conns in fetcher.HTTPKeepAliveHandler._idle.values():
+            for conn in conns:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+        self.fetcher.reset()
+        self.fetcher.enqueue(self.url("file2"))
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(self.fetcher.getItem(self.url("file2")).getStatus(),
+                          SUCCEEDED)
+
+    def test_redirect(self):
+        def handler(request):
+            if request.path == "/old":
+                self.send(request, "", 302, Location="/new")
+            else:
+                self.send(request, "Hello!")
+        self.start_server(handler)
+        self.fetcher.enqueue(self.url("old"))
+        self.fetcher.run(progress=Progress())
+        item = self.fetcher.getItem(self.url("old"))
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        self.assertEquals(open(item.getTargetPath()).read(), "Hello!")
+        self.assertEquals(self.paths, ["/old", "/new"])
+        self.assertEquals(len(self.connections), 1)
+
+    def test_404_handling(self):
+        def handler(request):
+            self.send(request, "Not here", 404)
+        self.start_server(handler)
+        self.fetcher.enqueue(self.url("file"))
+        self.fetcher.run(progress=Progress())
+        item = self.fetcher.getItem(self.url("file"))
+        self.assertEquals(item.getFailedReason(), u"File not found")
+
+    def test_conditional_request(self):
+        self.fetcher.setCaching(NEVER)
+        codes = []
+        def handler(request):
+            if request.headers.get("if-none-match") == '"abc"':
+                codes.append(304)
+                self.send(request, "", 304)
+            else:
+                codes.append(200)
+                self.send(request, "Hello!", ETag='"abc"')
+        self.start_server(handler)
+        for i in range(2):
+            self.fetcher.reset()
+            self.fetcher.enqueue(self.url("file"))
+            self.fetcher.run(progress=Progress())
+            item = self.fetcher.getItem(self.url("file"))
+            self.assertEquals(item.getStatus(), SUCCEEDED)
+            self.assertEquals(open(item.getTargetPath()).read(), "Hello!")
+        self.assertEquals(codes, [200, 304])
+        self.assertEquals(len(self.connections), 1)
+
+    def test_resume(self):
+        open(os.path.join(self.local_path, "file.part"), "w").write("Hel")
+        def handler(request):
+            self.assertEquals(request.headers["range"], "bytes=3-")
+            self.send(request, "lo!", 206,
+                      **{"Content-Range": "bytes 3-5/6"})
+        self.start_server(handler)
+        self.fetcher.enqueue(self.url("file"), size=6)
+        self.fetcher.run(progress=Progress())
+        item = self.fetcher.getItem(self.url("file"))
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        self.assertEquals(open(item.getTargetPath()).read(), "Hello!")
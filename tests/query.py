@@ -0,0 +1,228 @@
+import tempfile
+import unittest
+import shutil
+import json
+import csv
+import os
+
+from smart.commands import query
+from smart.channel import createChannel, PackageChannel
+from smart.progress import Progress
+from smart.fetcher import Fetcher
+from smart.cache import Cache, Loader, Package, Provides, Requires
+from smart.cache import PackageInfo
+from smart.searchindex import getTextCandidates
+from smart import Error, pkgconf
+
+from tests import TESTDATADIR
+
+
+class TestControl(object):
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def getCache(self):
+        return self._cache
+
+
+class QueryOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "output")
+        channel = createChannel("alias",
+                                {"type": "deb-dir",
+                                 "path": os.path.join(TESTDATADIR, "deb")})
+        channel.fetch(Fetcher(), Progress())
+        self.cache = Cache()
+        channel.addLoaders(self.cache)
+        self.cache.load()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def query(self, *args):
+        opts = query.parse_options(list(args)+["--output", self.path])
+        query.main(TestControl(self.cache), opts, reloadchannels=False)
+        return open(self.path).read()
+
+    def test_json(self):
+        output = self.query("--format=json", "--fields=name,version,"
+                            "summary,installed,priority,channels,requires")
+        lines = output.splitlines()
+        self.assertEquals(len(lines), len(self.cache.getPackages()))
+        for line, pkg in zip(lines, self.cache.getPackages()):
+            info = pkg.loaders.keys()[0].getInfo(pkg)
+            requires = [str(x) for x in pkg.requires]
+            requires.sort()
+            record = json.loads(line)
+            self.assertEquals(record, {"name": pkg.name,
+                                       "version": pkg.version,
+                                       "summary": info.getSummary(),
+                                       "installed": False,
+                                       "priority": 0,
+                                       "channels": ["alias"],
+                                       "requires": requires})
+
+    def test_csv_show_options(self):
+        output = self.query("--format=csv", "--show-summary",
+                            "--show-provides", "--hide-version")
+        rows = list(csv.reader(output.splitlines()))
+        self.assertEquals(rows[0], ["name", "summary", "provides"])
+        self.assertEquals(len(rows), len(self.cache.getPackages())+1)
+        for row, pkg in zip(rows[1:], self.cache.getPackages()):
+            provides = [str(x) for x in pkg.provides]
+            provides.sort()
+            self.assertEquals(row[0], pkg.name)
+            self.assertEquals(row[2], ", ".join(provides))
+
+    def test_summary_builds_text_index(self):
+        loader = self.cache._loaders[0]
+        self.assertEquals(loader._searchindex, None)
+        output = self.query("--summary=summary1")
+        self.assertEquals(output.split(), ["name1_version1-release1"])
+        self.assertTrue(loader._searchindex._texts)
+        self.assertEquals([x.name for x in
+                           getTextCandidates(self.cache, "summary1")],
+                          ["name1"])
+        self.assertEquals([x.name for x in
+                           getTextCandidates(self.cache, "description2",
+                                             True)],
+                          ["name2"])
+
+    def test_unknown_field(self):
+        self.assertRaises(Error, self.query, "--format=json",
+                          "--fields=name,size")
+
+    def test_unknown_format(self):
+        self.assertRaises(Error, self.query, "--format=record")
+
+
+class TestPackage(Package):
+
+    def matches(self, relation, version):
+        return not relation
+
+
+class TestPackageInfo(PackageInfo):
+
+    def getSummary(self):
+        return u"Caf\xe9 \"%s\"\tbuilt\x01\n" % self._package.name
+
+
+class TestRequires(Requires):
+
+    def matches(self, prv):
+        return prv.name == self.name
+
+
+class FilterLoader(Loader):
+
+    def __init__(self, installed, packages):
+        Loader.__init__(self)
+        self.setInstalled(installed)
+        self._packagesargs = packages
+
+    def getChannel(self):
+        return PackageChannel("test", "test")
+
+    def getInfo(self, pkg):
+        return TestPackageInfo(pkg)
+
+    def load(self):
+        for name, version, provides, requires in self._packagesargs:
+            pkg = self.buildPackage((TestPackage, name, version),
+                                    [(Provides, x, version)
+                                     for x in [name]+provides],
+                                    [(TestRequires, x, None, None)
+                                     for x in requires], [], [])
+            pkg.loaders[self] = None
+
+
+class QueryFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "output")
+        self.cache = Cache()
+        self.cache.addLoader(FilterLoader(True,
+            [("app", "1", [], ["libfoo"]),
+             ("libfoo", "1", ["libfoo-extra"], []),
+             ("libfoo", "2", [], []),
+             ("tool", "1", [], [])]))
+        self.cache.addLoader(FilterLoader(False,
+            [("app", "2", [], ["libfoo"]),
+             ("foo-plugin", "1", [], ["app"])]))
+        self.cache.load()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        for flag in ("hold", "lock"):
+            pkgconf.clearFlag(flag)
+
+    def output(self, *args):
+        opts = query.parse_options(list(args)+["--output", self.path])
+        query.main(TestControl(self.cache), opts, reloadchannels=False)
+        return open(self.path).read()
+
+    def query(self, *args):
+        output = self.output("--format=csv", "--fields=name,version", *args)
+        rows = list(csv.reader(output.splitlines()))
+        result = ["%s-%s" % tuple(x) for x in rows[1:]]
+        result.sort()
+        return result
+
+    def test_installed_and_name(self):
+        # Name matching used to replace the installed packages with
+        # every package matching the name.
+        self.assertEquals(self.query("--installed", "--name=app"), ["app-1"])
+        self.assertEquals(self.query("--name=app"), ["app-1", "app-2"])
+
+    def test_leaves(self):
+        self.assertEquals(self.query("--leaves"), ["app-1", "tool-1"])
+
+    def test_dupes(self):
+        self.assertEquals(self.query("--dupes"), ["libfoo-1", "libfoo-2"])
+
+    def test_flags(self):
+        pkgconf.setFlag("hold", "app")
+        pkgconf.setFlag("hold", "tool")
+        pkgconf.setFlag("lock", "tool")
+        # Any of the flags is enough without name matching.
+        self.assertEquals(self.query("--flag=hold", "--flag=lock"),
+                          ["app-1", "app-2", "tool-1"])
+        self.assertEquals(self.query("--flag=lock"), ["tool-1"])
+
+    def test_flags_and_name(self):
+        pkgconf.setFlag("hold", "app")
+        pkgconf.setFlag("hold", "tool")
+        pkgconf.setFlag("lock", "tool")
+        self.assertEquals(self.query("--flag=hold", "--name=app"),
+                          ["app-1", "app-2"])
+        # Packages matched by name must have all the flags.
+        self.assertEquals(self.query("--flag=hold", "--flag=lock",
+                                     "--name=app"), [])
+        self.assertEquals(self.query("--flag=hold", "--flag=lock",
+                                     "--name=t*"), ["tool-1"])
+
+    def test_relation_globs(self):
+        self.assertEquals(self.query("--provides=libfoo*"),
+                          ["libfoo-1", "libfoo-2"])
+        self.assertEquals(self.query("--provides=*-extra"), ["libfoo-1"])
+        self.assertEquals(self.query("--requires=lib*"), ["app-1", "app-2"])
+        self.assertEquals(self.query("--requires=lib*", "--installed"),
+                          ["app-1"])
+
+    def test_provides_and_name(self):
+        # Name matching used to drop the --provides selection as well.
+        self.assertEquals(self.query("--requires=app", "--name=*"),
+                          ["foo-plugin-1"])
+
+    def test_json_escaping(self):
+        output = self.output("--format=json", "--fields=name,summary",
+                             "--name=tool")
+        self.assertEquals(output.decode("ascii").count("\n"), 1)
+        self.assertEquals(json.loads(output),
+                          {"name": "tool",
+                           "summary": u"Caf\xe9 \"tool\"\tbuilt\x01\n"})
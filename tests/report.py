@@ -0,0 +1,76 @@
+import unittest
+
+from smart.report import Report
+from smart.transaction import ChangeSet
+from smart.const import INSTALL, REMOVE
+from smart.channel import PackageChannel
+from smart.cache import Package, Provides, Depends, Upgrades
+from smart.cache import Loader, Cache
+
+
+class TestDepends(Depends):
+
+    def matches(self, prv):
+        return prv.name == self.name and prv.version < self.version
+
+class TestUpgrades(TestDepends, Upgrades):
+    pass
+
+class TestLoader(Loader):
+
+    def __init__(self, versions, installed):
+        Loader.__init__(self)
+        self._versions = versions
+        self._installed = installed
+
+    def getChannel(self):
+        return PackageChannel("dummy", "dummy")
+
+    def load(self):
+        for name in "AB":
+            for version in self._versions:
+                pkg = self.buildPackage((Package, name, version),
+                                        [(Provides, name, version)], [],
+                                        [(TestUpgrades, name, "<", version)],
+                                        [])
+                pkg.loaders[self] = None
+
+
+class ReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.addLoader(TestLoader(["1"], True))
+        self.loader = TestLoader(["2"], False)
+        self.cache.addLoader(self.loader)
+        self.cache.load()
+        self.pkgs = dict([("%s-%s" % (x.name, x.version), x)
+                          for x in self.cache.getPackages()])
+        self.changeset = ChangeSet(self.cache)
+        self.changeset.set(self.pkgs["A-1"], REMOVE)
+        self.changeset.set(self.pkgs["A-2"], INSTALL)
+
+    def test_compute(self):
+        report = Report(self.changeset)
+        report.compute()
+        self.assertEquals(report.upgraded,
+                          {self.pkgs["A-1"]: [self.pkgs["A-2"]]})
+        self.assertEquals(report.upgrading,
+                          {self.pkgs["A-2"]: [self.pkgs["A-1"]]})
+        self.assertEquals(report.installing, {})
+        self.assertEquals(report.notupgraded, {})
+
+    def test_compute_not_upgraded(self):
+        report = Report(self.changeset)
+        report.compute(notupgraded=True)
+        self.assertEquals(report.notupgraded,
+                          {self.pkgs["B-1"]: [self.pkgs["B-2"]]})
+
+    def test_not_upgraded_after_reload(self):
+        Report(self.changeset).compute(notupgraded=True)
+        self.cache.removeLoader(self.loader)
+        self.cache.load()
+        changeset = ChangeSet(self.cache)
+        report = Report(changeset)
+        report.computeNotUpgraded()
+        self.assertEquals(report.notupgraded, {})
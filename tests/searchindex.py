@@ -0,0 +1,212 @@
+import unittest
+import fnmatch
+import re
+
+from smart.searchindex import getSearchIndex, getMaxDistance
+from smart.searchindex import getPathIndex, getPathPackages
+from smart.searchindex import getTextIndexes, getTextCandidates
+from smart.searcher import Searcher
+from smart.channel import PackageChannel
+from smart.cache import Package, Provides, Requires, Loader, Cache
+from smart.cache import PackageInfo
+from smart.util.strtools import globdistance
+
+
+class TestPackageInfo(PackageInfo):
+
+    def getPathList(self):
+        name = self._package.name
+        return ["/bin/"+name, "/usr/share/doc/"+name+"/README",
+                "/usr/share/doc/"+name+"/"]
+
+    def getSummary(self):
+        return u"The %s program" % self._package.name.upper()
+
+    def getDescription(self):
+        return u"%s-%s, built\nfor [test] r\xe9sum\xe9s." % \
+               (self._package.name, self._package.version)
+
+
+class TestLoader(Loader):
+
+    def __init__(self, names):
+        Loader.__init__(self)
+        self._names = names
+
+    def getChannel(self):
+        return PackageChannel("dummy", "dummy")
+
+    def getInfo(self, pkg):
+        return TestPackageInfo(pkg)
+
+    def load(self):
+        for name in self._names:
+            for version in ("1.0-1", "2.0-1"):
+                pkg = self.buildPackage((Package, name, version),
+                                        [(Provides, name, version),
+                                         (Provides, "lib"+name, None)],
+                                        [(Requires, "/bin/"+name,
+                                          None, None)], [], [])
+                pkg.loaders[self] = None
+
+    def loadFileProvides(self, fndict):
+        for pkg in self._packages:
+            if pkg.name == "bash":
+                self.buildFileProvides(pkg, (Provides, "/bin/bash", None))
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache()
+        self.loader = TestLoader(["bash", "bind", "binutils", "dash",
+                                  "python", "python-gtk", "Pyrex", "zsh"])
+        self.cache.addLoader(self.loader)
+        self.cache.load()
+
+    def searchPath(self, s, cutoff, ignorecase=True):
+        searcher = Searcher()
+        searcher.ignorecase = ignorecase
+        searcher.addPath(s, cutoff)
+        self.cache.search(searcher)
+        return searcher._results
+
+    def scanPath(self, s, cutoff, ignorecase=True):
+        result = {}
+        for pkg in self.cache.getPackages():
+            for path in TestPackageInfo(pkg).getPathList():
+                _, ratio = globdistance(s, path, cutoff, ignorecase)
+                if ratio > result.get(pkg, 0):
+                    result[pkg] = ratio
+        return result
+
+    def search(self, s, cutoff, scan=False):
+        searcher = Searcher()
+        searcher.addNameVersion(s, cutoff)
+        searcher.addProvides(s, cutoff)
+        if scan:
+            for pkg in self.cache.getPackages():
+                pkg.search(searcher)
+            for prv in self.cache.getProvides():
+                prv.search(searcher)
+        else:
+            self.cache.search(searcher)
+        return searcher._results
+
+    def test_same_as_full_scan(self):
+        for s in ("bash", "bahs", "bash-1.0", "pyhton", "python-gtk-2",
+                  "pyrex", "libbind", "/bin/bsh", "bi*", "z?h", "x"):
+            for cutoff in (1.0, 0.9, 0.7, 0.5, 0.0, 1, 3):
+                self.assertEquals(self.search(s, cutoff),
+                                  self.search(s, cutoff, scan=True))
+
+    def test_suggestions(self):
+        result = self.search("pythn", 0.7)
+        self.assertEquals(sorted([str(x) for x in result]),
+                          ["python = 1.0-1", "python = 2.0-1",
+                           "python-1.0-1", "python-2.0-1"])
+
+    def test_max_distance(self):
+        for s in ("a", "bash", "python-gtk", "x"*30):
+            for cutoff in (1.0, 0.95, 0.7, 0.5, 0.1):
+                maxdistance = getMaxDistance(s, cutoff)
+                for length in range(1, 100):
+                    for b in (s[:length], s+"y"*length):
+                        res, ratio = globdistance(s, b, cutoff)
+                        if ratio:
+                            self.assertTrue(res <= maxdistance)
+        self.assertEquals(getMaxDistance("bash", 2), 2)
+        self.assertEquals(getMaxDistance("ba*", 1.0), None)
+        self.assertEquals(getMaxDistance("bash", 0.0), None)
+
+    def test_file_provides_are_indexed(self):
+        index = getSearchIndex(self.loader)
+        self.assertEquals(index.getProvidesNames("/bin/bash", 0),
+                          ["/bin/bash"])
+        self.loader.buildFileProvides(self.loader._packages[-1],
+                                      (Provides, "/bin/zsh", None))
+        self.assertEquals(index.getProvidesNames("/bin/zsh", 0),
+                          ["/bin/zsh"])
+
+    def test_reset_drops_index(self):
+        index = getSearchIndex(self.loader)
+        self.assertTrue(getSearchIndex(self.loader) is index)
+        self.cache.removeLoader(self.loader)
+        self.loader.reset()
+        self.assertEquals(self.loader._searchindex, None)
+        self.loader._names = ["ksh"]
+        self.cache.addLoader(self.loader)
+        self.cache.load()
+        self.assertEquals(sorted([str(x) for x in self.search("ksh", 1.0)]),
+                          ["ksh = 1.0-1", "ksh = 2.0-1",
+                           "ksh-1.0-1", "ksh-2.0-1"])
+
+    def test_path_search_same_as_full_scan(self):
+        for s in ("/bin/bash", "/BIN/BASH", "/bin/bsh", "/bin/ba*",
+                  "/usr/share/doc/zsh/", "/usr/share/doc/z?h/README",
+                  "/usr/share/dock/python/README", "/usr/lib", "bash"):
+            for cutoff in (1.0, 0.9, 0.7, 0.0, 1, 3):
+                for ignorecase in (True, False):
+                    self.assertEquals(self.searchPath(s, cutoff, ignorecase),
+                                      self.scanPath(s, cutoff, ignorecase))
+
+    def test_path_packages(self):
+        index = getPathIndex(self.loader)
+        packages = self.loader._packages
+        self.assertEquals([str(packages[i])
+                           for i in index.getPackages("/bin/zsh")],
+                          ["zsh-1.0-1", "zsh-2.0-1"])
+        self.assertEquals(index.getPackages("/bin/ksh"), [])
+        self.assertEquals(index.getPackages("/usr/share/doc/zsh"), [])
+        result = getPathPackages(self.cache,
+                                 lambda x: x.endswith("/python/README"))
+        self.assertEquals(sorted([str(x) for x in result]),
+                          ["python-1.0-1", "python-2.0-1"])
+
+    def test_path_index_state(self):
+        index = getPathIndex(self.loader)
+        copy = index.__class__()
+        copy.__setstate__(index.__getstate__())
+        for path in ("/bin/bash", "/usr/share/doc/dash/", "/bin/ksh"):
+            self.assertEquals(copy.getPackages(path), index.getPackages(path))
+        copy.__setstate__(copy.__class__().__getstate__())
+        self.assertEquals(copy.getPackages("/bin/bash"), [])
+
+    def test_text_candidates(self):
+        packages = self.cache.getPackages()
+        for pattern in ("bash", "BASH", "the bash", "program", "ash",
+                        "py*gtk", "p?thon", "[bd]ash", "[]ash", "[!b]ash",
+                        "1.0-1", "2.0", "built for", "[test]", "r\xe9s",
+                        "sum", "zsh-", "*", "-", "missing"):
+            for description in (False, True):
+                regex = fnmatch.translate(pattern)
+                regex = re.compile(regex[:regex.rindex("\\Z")], re.I)
+                matching = {}
+                for pkg in packages:
+                    info = self.loader.getInfo(pkg)
+                    if description:
+                        text = info.getDescription()
+                    else:
+                        text = info.getSummary()
+                    if regex.search(text):
+                        matching[pkg] = True
+                candidates = getTextCandidates(self.cache, pattern,
+                                               description)
+                if candidates is not None:
+                    self.assertTrue(self.loader._searchindex._texts)
+                    for pkg in matching:
+                        self.assertTrue(pkg in candidates)
+                self.loader._searchindex._texts = None
+        self.assertEquals(sorted([str(x) for x in
+                                  getTextCandidates(self.cache, "bash")]),
+                          ["bash-1.0-1", "bash-2.0-1"])
+        self.assertEquals(getTextCandidates(self.cache, "missing"), {})
+        self.assertEquals(getTextCandidates(self.cache, "*?"), None)
+
+    def test_text_index_state(self):
+        summaries, descriptions = getTextIndexes(self.loader)
+        copy = descriptions.__class__()
+        copy.__setstate__(descriptions.__getstate__())
+        for run in ("bash", "built", "1", "sum", "x"):
+            self.assertEquals(copy.getPackages(run),
+                              descriptions.getPackages(run))
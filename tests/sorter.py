@@ -1,4 +1,5 @@
 import unittest
+import random
 import sys
 
 from smart.sorter import ElementSorter, DisableError
@@ -239,3 +240,91 @@ class ElementSorterTest(unittest.TestCase):
             sorter.addSuccessor(i+1, i)
         sorter.addSuccessor(0, 5)
         self.assertEquals(sorter.getSorted(), [0, 1, 2, 3, 4, 5])
+
+    def test_getLoops_with_long_loop(self):
+        sorter = self.sorter
+        for i in range(5000):
+            sorter.addSuccessor(i, i+1)
+        sorter.addSuccessor(5000, 0)
+        loops = sorter.getLoops()
+        self.assertEquals(len(loops), 1)
+        self.assertEquals(len(loops[0][0]), 5001)
+        self.assertEquals(len(loops[0][1]), 5001)
+
+    def test_getLoops_with_self_loop(self):
+        sorter = self.sorter
+        sorter.addSuccessor(0, 0)
+        sorter.addSuccessor(0, 1)
+        self.assertEquals(sorter.getLoops(), [(set([0]), set([(0, 0)]))])
+
+    def test_getComponentOf_after_disableRelation(self):
+        sorter = self.sorter
+        sorter.addSuccessor(0, 1)
+        sorter.addSuccessor(1, 0)
+        sorter.addSuccessor(1, 2)
+        sorter.addSuccessor(2, 1)
+        sorter.addSuccessor(2, 3)
+        self.assertEquals(set(sorter.getComponentOf(0)), set([0, 1, 2]))
+        self.assertEquals(sorter.getComponentOf(3), [3])
+        sorter.disableRelation((2, 1))
+        self.assertEquals(set(sorter.getComponentOf(0)), set([0, 1]))
+        self.assertEquals(sorter.getComponentOf(2), [2])
+        sorter.enableRelation((2, 1))
+        self.assertEquals(set(sorter.getComponentOf(2)), set([0, 1, 2]))
+        self.assertEquals(len(sorter.getLoops()), 1)
+
+    def test_hasLoop(self):
+        sorter = self.sorter
+        sorter.addSuccessor(0, 1)
+        sorter.addSuccessor(1, 2)
+        sorter.addSuccessor(2, 0)
+        relations = set([(0, 1), (1, 2), (2, 0)])
+        self.assertTrue(sorter.hasLoop([0], relations))
+        relations.remove((2, 0))
+        self.assertFalse(sorter.hasLoop([0, 1, 2], relations))
+
+    def test_countRelationsInLoop(self):
+        sorter = self.sorter
+        sorter.addSuccessor(0, 1)
+        sorter.addSuccessor(1, 0, priority=1)
+        sorter.addSuccessor(2, 3)
+        sorter.addSuccessor(3, 2)
+        relations = set([(0, 1), (1, 0), (2, 3), (3, 2)])
+        self.assertEquals(sorter.countRelationsInLoop([0], relations), 2)
+        self.assertEquals(sorter.countRelationsInLoop([0, 2], relations), 4)
+        self.assertEquals(sorter.countRelationsInLoop([0, 2], relations, 0), 2)
+
+    def test_countRelationsInLoop_counts_whole_components(self):
+        sorter = self.sorter
+        relations = [(1, 2), (2, 0), (1, 0), (0, 2), (2, 1)]
+        for pred, succ in relations:
+            sorter.addSuccessor(pred, succ)
+        # All relations are in some loop, even if walking paths from
+        # 1 and 2 only finds four of them.
+        self.assertEquals(sorter.countRelationsInLoop([1, 2], relations), 5)
+
+    def test_breakLoops_prefers_relations_with_higher_priority(self):
+        # Relations of each priority and lower ones are only disabled
+        # when they make a loop by themselves, and each disabled one
+        # would recreate a loop if enabled again.
+        rand = random.Random(0)
+        for i in range(500):
+            sorter = ElementSorter()
+            size = rand.randint(2, 7)
+            for j in range(rand.randint(2, 14)):
+                pred = rand.randrange(size)
+                succ = rand.randrange(size)
+                if pred != succ:
+                    sorter.addSuccessor(pred, succ, rand.choice([0, 0, 1, 2]))
+            acyclic = []
+            for priority in range(3):
+                relations = set([x for x in sorter._priorities
+                                 if sorter._priorities[x] <= priority])
+                if not sorter.hasLoop(range(size), relations):
+                    acyclic.append(relations)
+            sorter.getSorted()
+            disabled = sorter._disabled
+            for relations in acyclic:
+                self.assertFalse(relations & disabled)
+            for pred, succ in disabled:
+                self.assertTrue(sorter.getPathData(succ, pred)[0])
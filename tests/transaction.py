@@ -0,0 +1,434 @@
+import unittest
+import tempfile
+import json
+import os
+
+from smart.transaction import CheckpointDict, ChangeSet, Transaction
+from smart.transaction import Failed, DependencyIndex, getDependencyIndex
+from smart.transaction import ChangeSetSplitter
+from smart.transaction import PolicyInstall, PolicyRemove, PolicyUpgrade
+from smart.checkpool import checkInParallel, splitWeights
+from smart.const import INSTALL, REMOVE, UPGRADE
+from smart.channel import PackageChannel
+from smart.cache import Package, Provides, Depends, Requires, Upgrades
+from smart.cache import Loader, Cache
+from smart import sysconf, Error
+
+
+class CheckpointDictTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dict = CheckpointDict({"a": 1, "b": 2})
+
+    def test_rollback(self):
+        self.dict.checkpoint()
+        self.dict["a"] = 3
+        self.dict["c"] = 4
+        del self.dict["b"]
+        self.dict.update({"d": 5})
+        self.dict.rollback()
+        self.assertEquals(self.dict, {"a": 1, "b": 2})
+
+    def test_get_changes(self):
+        self.dict.checkpoint()
+        self.dict["a"] = 3
+        self.dict["c"] = 4
+        del self.dict["b"]
+        changes = self.dict.getChanges()
+        self.dict.rollback()
+        self.assertEquals(changes, {"a": 3, "b": None, "c": 4})
+        self.dict.applyChanges(changes)
+        self.assertEquals(self.dict, {"a": 3, "c": 4})
+
+    def test_nested_checkpoints(self):
+        self.dict.checkpoint()
+        self.dict["a"] = 3
+        self.dict.checkpoint()
+        self.dict["a"] = 4
+        self.dict["c"] = 5
+        self.dict.commit()
+        self.assertEquals(self.dict.getChanges(), {"a": 4, "c": 5})
+        self.dict.checkpoint()
+        self.dict.clear()
+        self.dict.rollback()
+        self.assertEquals(self.dict, {"a": 4, "b": 2, "c": 5})
+        self.dict.rollback()
+        self.assertEquals(self.dict, {"a": 1, "b": 2})
+
+
+class ChangeSetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pkgs = [Package("pkg%d" % i, "1.0") for i in range(4)]
+        self.pkgs[0].installed = True
+        self.changeset = ChangeSet(None)
+        self.changeset.set(self.pkgs[0], REMOVE)
+        self.changeset.set(self.pkgs[1], INSTALL)
+        self.changeset.setRequested(self.pkgs[1], True)
+
+    def test_rollback_restores_requested(self):
+        changeset = self.changeset
+        changeset.checkpoint()
+        changeset.set(self.pkgs[1], REMOVE)
+        changeset.set(self.pkgs[2], INSTALL)
+        changeset.setRequested(self.pkgs[2], True)
+        self.assertFalse(changeset.getRequested(self.pkgs[1]))
+        changeset.rollback()
+        self.assertEquals(changeset, {self.pkgs[0]: REMOVE,
+                                      self.pkgs[1]: INSTALL})
+        self.assertTrue(changeset.getRequested(self.pkgs[1]))
+        self.assertFalse(changeset.getRequested(self.pkgs[2]))
+
+    def test_compare_changes_as_changesets(self):
+        changeset = self.changeset
+        alternatives = []
+        for ops in ([(self.pkgs[2], INSTALL)],
+                    [(self.pkgs[1], REMOVE)],
+                    [(self.pkgs[3], INSTALL)],
+                    [(self.pkgs[0], INSTALL), (self.pkgs[3], INSTALL)],
+                    []):
+            changeset.checkpoint()
+            for pkg, op in ops:
+                changeset.set(pkg, op)
+            alternatives.append((changeset.getChanges(), changeset.copy()))
+            changeset.rollback()
+        for changes1, changeset1 in alternatives:
+            for changes2, changeset2 in alternatives:
+                self.assertEquals(changeset.compareChanges(changes1, changes2),
+                                  cmp(dict(changeset1), dict(changeset2)))
+
+
+class TestDepends(Depends):
+
+    def matches(self, prv):
+        return prv.name == self.name and prv.version < self.version
+
+class TestUpgrades(TestDepends, Upgrades):
+    pass
+
+class TestLoader(Loader):
+
+    def __init__(self, versions, installed):
+        Loader.__init__(self)
+        self._versions = versions
+        self._installed = installed
+
+    def getChannel(self):
+        return PackageChannel("dummy", "dummy")
+
+    def load(self):
+        for name in "ABC":
+            for version in self._versions:
+                pkg = self.buildPackage((Package, name, version),
+                                        [(Provides, name, version)], [],
+                                        [(TestUpgrades, name, "<", version)],
+                                        [])
+                pkg.loaders[self] = None
+
+
+class PolicyWeightChangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.addLoader(TestLoader(["1"], True))
+        self.cache.addLoader(TestLoader(["2", "3"], False))
+        self.cache.load()
+        self.pkgs = sorted(self.cache.getPackages())
+
+    def check_weight_change(self, policy):
+        trans = Transaction(self.cache, policy)
+        for pkg in self.pkgs:
+            if pkg.installed:
+                trans.enqueue(pkg, UPGRADE)
+        policy = trans.getPolicy()
+        policy.runStarting()
+        try:
+            # Go over every combination of operations.
+            changesets = [ChangeSet(self.cache)]
+            for pkg in self.pkgs:
+                for changeset in changesets[:]:
+                    changeset = changeset.copy()
+                    changeset[pkg] = pkg.installed and REMOVE or INSTALL
+                    changesets.append(changeset)
+            for changeset in changesets:
+                weight = policy.getWeight(changeset)
+                for pkg in self.pkgs:
+                    changeset.checkpoint()
+                    if pkg in changeset:
+                        del changeset[pkg]
+                    else:
+                        changeset[pkg] = pkg.installed and REMOVE or INSTALL
+                    change = policy.getWeightChange(changeset,
+                                                    changeset.getPrevious())
+                    self.assertAlmostEquals(weight+change,
+                                            policy.getWeight(changeset))
+                    changeset.rollback()
+        finally:
+            policy.runFinished()
+
+    def test_install(self):
+        self.check_weight_change(PolicyInstall)
+
+    def test_remove(self):
+        self.check_weight_change(PolicyRemove)
+
+    def test_upgrade(self):
+        self.check_weight_change(PolicyUpgrade)
+
+
+class TestRequires(Requires):
+
+    def matches(self, prv):
+        return prv.name == self.name
+
+class ProvidersLoader(Loader):
+
+    def getChannel(self):
+        return PackageChannel("dummy", "dummy")
+
+    def load(self):
+        # C would provide both v1 and v2, but it can't be installed.
+        for name, provides, requires in (("A", [], ["v1"]),
+                                         ("B", [], ["v2"]),
+                                         ("C", ["v1", "v2"], ["missing"]),
+                                         ("X1", ["v1"], []),
+                                         ("X2", ["v2"], [])):
+            pkg = self.buildPackage((Package, name, "1"),
+                                    [(Provides, x, None)
+                                     for x in [name]+provides],
+                                    [(TestRequires, x, None, None)
+                                     for x in requires], [], [])
+            pkg.loaders[self] = None
+
+
+class RecommendsLoader(Loader):
+
+    def getChannel(self):
+        return PackageChannel("dummy", "dummy")
+
+    def load(self):
+        # R2 is recommended as well, but it can't be installed.
+        for name, requires, recommends in (("A", [], ["r1", "r2"]),
+                                           ("R1", [], []),
+                                           ("R2", ["missing"], [])):
+            pkg = self.buildPackage((Package, name, "1"),
+                                    [(Provides, name.lower(), None)],
+                                    [(TestRequires, x, None, None)
+                                     for x in requires], [], [],
+                                    [(TestRequires, x, None, None)
+                                     for x in recommends])
+            pkg.loaders[self] = None
+
+
+class DependencyIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.addLoader(ProvidersLoader())
+        self.cache.load()
+        self.pkgs = dict([(x.name, x) for x in self.cache.getPackages()])
+        self.index = DependencyIndex(self.cache)
+
+    def test_check(self):
+        pkgs = self.pkgs
+        self.assertFalse(self.index.check(pkgs.values(), pkgs.values()))
+        relateset = [pkgs[x] for x in ("A", "B", "X1", "X2")]
+        self.assertTrue(self.index.check(relateset, relateset))
+        self.assertFalse(self.index.check(relateset, relateset[:-1]))
+
+    def test_shared_until_loaded(self):
+        index = getDependencyIndex(self.cache)
+        self.assertTrue(getDependencyIndex(self.cache) is index)
+        self.cache.load()
+        self.assertFalse(getDependencyIndex(self.cache) is index)
+
+    def test_check_in_parallel(self):
+        pkgs = self.cache.getPackages()
+        relateset = [x for x in pkgs if x.name != "X2"]
+        sysconf.set("check-jobs", 3)
+        try:
+            self.assertFalse(self.index.check(pkgs, relateset))
+            checkset = [self.pkgs["A"], self.pkgs["X1"]]
+            self.assertTrue(self.index.check(checkset, relateset))
+            check = lambda start, end: [x for x in range(start, end)
+                                        if x % 3 == 0]
+            self.assertEquals(checkInParallel(check, [1]*10, 3, True),
+                              [0, 3, 6, 9])
+            self.assertEquals(checkInParallel(check, [1]*10, 3, False),
+                              [0, 3])
+        finally:
+            sysconf.remove("check-jobs")
+
+    def test_split_weights(self):
+        self.assertEquals(splitWeights([1]*10, 3), [(0, 4), (4, 7), (7, 10)])
+        self.assertEquals(splitWeights([5, 1, 1, 1, 1, 1], 2),
+                          [(0, 1), (1, 6)])
+        self.assertEquals(splitWeights([1, 1], 4), [(0, 1), (1, 2)])
+
+
+class ChangeSetSplitterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.addLoader(TestLoader(["1"], True))
+        self.cache.addLoader(TestLoader(["2"], False))
+        self.cache.load()
+        self.pkgs = dict([("%s-%s" % (x.name, x.version), x)
+                          for x in self.cache.getPackages()])
+        self.changeset = ChangeSet(self.cache)
+        for pkg in self.cache.getPackages():
+            self.changeset.set(pkg, pkg.installed and REMOVE or INSTALL)
+
+    def test_include_upgrade(self):
+        splitter = ChangeSetSplitter(self.changeset)
+        subset = ChangeSet(self.cache)
+        splitter.include(subset, self.pkgs["A-2"])
+        self.assertEquals(dict(subset), {self.pkgs["A-2"]: INSTALL,
+                                         self.pkgs["A-1"]: REMOVE})
+        # Only the package asked for stays locked.
+        self.assertTrue(splitter.getLocked(self.pkgs["A-2"]))
+        self.assertFalse(splitter.getLocked(self.pkgs["A-1"]))
+
+    def test_exclude_locked(self):
+        splitter = ChangeSetSplitter(self.changeset)
+        splitter.setLocked(self.pkgs["B-2"], True)
+        subset = self.changeset.copy()
+        self.assertRaises(Error, splitter.exclude, subset, self.pkgs["B-1"])
+        self.assertEquals(dict(subset), dict(self.changeset))
+        splitter.exclude(subset, self.pkgs["C-1"])
+        self.assertFalse(self.pkgs["C-1"] in subset)
+        self.assertFalse(self.pkgs["C-2"] in subset)
+
+
+class SolverProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.addLoader(TestLoader(["1"], True))
+        self.cache.addLoader(TestLoader(["2", "3"], False))
+        self.cache.load()
+        self.path = tempfile.mktemp()
+
+    def tearDown(self):
+        sysconf.remove("profile-solver")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def run_transaction(self):
+        trans = Transaction(self.cache, PolicyUpgrade)
+        for pkg in self.cache.getPackages():
+            if pkg.installed:
+                trans.enqueue(pkg, UPGRADE)
+        trans.run()
+        return trans
+
+    def test_disabled(self):
+        self.assertEquals(self.run_transaction().getProfile(), None)
+
+    def test_profile(self):
+        expected = dict(self.run_transaction().getChangeSet())
+        copy = ChangeSet.copy.im_func
+        sysconf.set("profile-solver", self.path)
+        trans = self.run_transaction()
+        self.assertEquals(dict(trans.getChangeSet()), expected)
+        self.assertFalse("_install" in trans.__dict__)
+        profile = trans.getProfile()
+        self.assertTrue(profile.getCounter("_install") > 0)
+        self.assertTrue(profile.getCounter("getWeight") > 0)
+        self.assertTrue(profile.getCounter("changeset-copy") > 0)
+        self.assertTrue(ChangeSet.copy.im_func is copy)
+        self.assertEquals(sum(profile.getDepths("_install").values()),
+                          profile.getCounter("_install"))
+        self.assertTrue(profile.getTime("run") >= profile.getTime("upgrade"))
+        self.run_transaction()
+        lines = open(self.path).readlines()
+        self.assertEquals(len(lines), 2)
+        data = json.loads(lines[0])
+        self.assertEquals(data["counters"]["_install"],
+                          profile.getCounter("_install"))
+        self.assertEquals(sorted(data.keys()),
+                          ["counters", "depths", "timers"])
+
+    def test_run_starting_fails(self):
+        class FailingPolicy(PolicyUpgrade):
+            def runStarting(self):
+                raise Error, "failed"
+        sysconf.set("profile-solver", True)
+        trans = Transaction(self.cache, FailingPolicy)
+        self.assertRaises(Error, trans.run)
+        self.assertFalse("_install" in trans.__dict__)
+        self.assertFalse("getWeight" in trans.getPolicy().__dict__)
+
+
+class SATResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        sysconf.set("transaction-solver", "sat")
+
+    def tearDown(self):
+        sysconf.remove("transaction-solver")
+
+    def test_providers(self):
+        cache = Cache()
+        cache.addLoader(ProvidersLoader())
+        cache.load()
+        trans = Transaction(cache, PolicyInstall)
+        for pkg in cache.getPackages():
+            if pkg.name in ("A", "B"):
+                trans.enqueue(pkg, INSTALL)
+        trans.run()
+        changeset = trans.getChangeSet()
+        self.assertEquals(sorted([x.name for x in changeset]),
+                          ["A", "B", "X1", "X2"])
+        self.assertEquals(sorted([x.name for x in changeset
+                                  if changeset.getRequested(x)]),
+                          ["A", "B"])
+
+    def test_unsatisfiable(self):
+        cache = Cache()
+        cache.addLoader(ProvidersLoader())
+        cache.load()
+        trans = Transaction(cache, PolicyInstall)
+        for pkg in cache.getPackages():
+            if pkg.name == "C":
+                trans.enqueue(pkg, INSTALL)
+        self.assertRaises(Failed, trans.run)
+
+    def run_recommends(self, solver):
+        sysconf.set("transaction-solver", solver)
+        cache = Cache()
+        cache.addLoader(RecommendsLoader())
+        cache.load()
+        trans = Transaction(cache, PolicyInstall)
+        for pkg in cache.getPackages("A"):
+            trans.enqueue(pkg, INSTALL)
+        trans.run()
+        return sorted([x.name for x in trans.getChangeSet()])
+
+    def test_recommends(self):
+        self.assertEquals(self.run_recommends("sat"), ["A", "R1"])
+        sysconf.set("ignore-all-recommends", 1)
+        try:
+            self.assertEquals(self.run_recommends("sat"), ["A"])
+        finally:
+            sysconf.remove("ignore-all-recommends")
+
+    def test_upgrade(self):
+        cache = Cache()
+        cache.addLoader(TestLoader(["1"], True))
+        cache.addLoader(TestLoader(["2", "3"], False))
+        cache.load()
+        changesets = []
+        for solver in ("heuristic", "sat"):
+            sysconf.set("transaction-solver", solver)
+            trans = Transaction(cache, PolicyUpgrade)
+            for pkg in cache.getPackages():
+                if pkg.installed:
+                    trans.enqueue(pkg, UPGRADE)
+            trans.run()
+            changesets.append(dict(trans.getChangeSet()))
+        self.assertEquals(sorted([(x.name, x.version, changesets[1][x])
+                                  for x in changesets[1]]),
+                          [("A", "3", INSTALL), ("B", "3", INSTALL),
+                           ("C", "3", INSTALL)])
+        self.assertEquals(changesets[0], changesets[1])
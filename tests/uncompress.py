@@ -1,7 +1,9 @@
 import unittest
 import os
 
-from smart.uncompress import Uncompressor
+from smart.uncompress import Uncompressor, StreamUncompressor
+from smart.util.filedigest import newDigest
+from smart import Error
 
 from tests import TESTDATADIR
 
@@ -44,3 +46,68 @@ class UncompressorTest(unittest.TestCase):
     def test_7zip(self):
         self.uncompress_file("%s/uncompress/test.7z" % TESTDATADIR)
 
+
+
+class StreamUncompressorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.orig = open("%s/uncompress/test.txt" % TESTDATADIR).read()
+        self.path = "%s/uncompress/test" % TESTDATADIR
+
+    def tearDown(self):
+        for path in (self.path, self.path+".part"):
+            if os.path.exists(path): os.unlink(path)
+
+    def stream(self, file, data, digests=("md5", "sha", "sha256")):
+        handler = Uncompressor().getHandler(file)
+        stream = StreamUncompressor(handler, file, digests)
+        self.assertEquals(stream.getTargetPath(), self.path)
+        for i in range(0, len(data), 7):
+            stream.write(data[i:i+7])
+        stream.close()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(os.path.isfile(stream.getPartPath()))
+        stream.commit()
+        return stream
+
+    def check_stream(self, file):
+        stream = self.stream(file, open(file).read())
+        self.assertEquals(open(self.path).read(), self.orig)
+        digests = stream.getDigests()
+        self.assertEquals(digests["size"], len(self.orig))
+        for name in ("md5", "sha", "sha256"):
+            digest = newDigest(name)
+            digest.update(self.orig)
+            self.assertEquals(digests[name], digest.hexdigest())
+
+    def test_gzip(self):
+        self.check_stream("%s/uncompress/test.gz" % TESTDATADIR)
+
+    def test_bzip2(self):
+        self.check_stream("%s/uncompress/test.bz2" % TESTDATADIR)
+
+    def test_concatenated_streams(self):
+        file = "%s/uncompress/test.gz" % TESTDATADIR
+        self.stream(file, open(file).read()*2)
+        self.assertEquals(open(self.path).read(), self.orig*2)
+
+    def test_broken_data(self):
+        file = "%s/uncompress/test.gz" % TESTDATADIR
+        self.assertRaises(Error, self.stream, file, "broken data")
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path+".part"))
+
+    def test_abort_after_close(self):
+        file = "%s/uncompress/test.gz" % TESTDATADIR
+        handler = Uncompressor().getHandler(file)
+        stream = StreamUncompressor(handler, file)
+        stream.write(open(file).read())
+        stream.close()
+        stream.abort()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path+".part"))
+
+    def test_zip_has_no_decompressor(self):
+        file = "%s/uncompress/test.zip" % TESTDATADIR
+        self.assertEquals(Uncompressor().getHandler(file).getDecompressor(),
+                          None)
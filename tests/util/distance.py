@@ -1,6 +1,6 @@
 from tests.mocker import MockerTestCase
 
-from smart.util.distance import globdistance
+from smart.util.distance import globdistance, filterprefixes
 
 
 class DistanceTestBase(MockerTestCase):
@@ -9,3 +9,11 @@ class DistanceTestBase(MockerTestCase):
         self.assertEquals(globdistance("", ""), (0, 1.0))
         self.assertEquals(globdistance("", "a"), (1, 0.0))
         self.assertEquals(globdistance("a", ""), (1, 0.0))
+
+    def test_filterprefixes(self):
+        names = ["bar", "foo", "foo-bar", "foobar", "fox", "zzzzz"]
+        self.assertEquals(filterprefixes("foo-1.0", names, 0), ["foo"])
+        self.assertEquals(filterprefixes("FOO-bar", names, 1),
+                          ["foo", "foo-bar", "foobar", "fox"])
+        self.assertEquals(filterprefixes("foo", names, -1), ["foo"])
+        self.assertEquals(filterprefixes("", names, 3), ["bar", "foo", "fox"])
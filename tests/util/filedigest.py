@@ -0,0 +1,83 @@
+import os
+
+from tests.mocker import MockerTestCase
+
+from smart.util import filedigest
+from smart.util.filedigest import getFileDigests, forgetFileDigests, newDigest
+
+
+class FileDigestTest(MockerTestCase):
+
+    def setUp(self):
+        self.path = self.makeFile("data"*1000)
+        self.expected = {"size": 4000}
+        for name in ("md5", "sha", "sha256"):
+            digest = newDigest(name)
+            digest.update("data"*1000)
+            self.expected[name] = digest.hexdigest()
+        forgetFileDigests()
+
+    def tearDown(self):
+        forgetFileDigests()
+
+    def test_all_digests(self):
+        self.assertEquals(getFileDigests(self.path, ["md5", "sha", "sha256"]),
+                          self.expected)
+
+    def test_requested_digests_only(self):
+        self.assertEquals(getFileDigests(self.path, ["sha"]),
+                          {"size": 4000, "sha": self.expected["sha"]})
+
+    def test_mmap(self):
+        filedigest.MMAPSIZE, mmapsize = 1, filedigest.MMAPSIZE
+        filedigest.MMAPCHUNK, mmapchunk = 1000, filedigest.MMAPCHUNK
+        try:
+            digests = getFileDigests(self.path, ["md5", "sha256"])
+        finally:
+            filedigest.MMAPSIZE = mmapsize
+            filedigest.MMAPCHUNK = mmapchunk
+        self.assertEquals(digests["md5"], self.expected["md5"])
+        self.assertEquals(digests["sha256"], self.expected["sha256"])
+
+    def test_single_pass_and_cached(self):
+        calls = []
+        compute = filedigest._computeDigests
+        def computeDigests(path, size, names):
+            calls.append(names)
+            return compute(path, size, names)
+        filedigest._computeDigests = computeDigests
+        try:
+            getFileDigests(self.path, ["md5", "sha256"])
+            getFileDigests(self.path, ["sha256", "md5"])
+            getFileDigests(self.path, ["md5", "sha"])
+        finally:
+            filedigest._computeDigests = compute
+        self.assertEquals(calls, [["md5", "sha256"], ["sha"]])
+
+    def test_changed_file_is_read_again(self):
+        getFileDigests(self.path, ["md5"])
+        self.makeFile("other", path=self.path)
+        digest = newDigest("md5")
+        digest.update("other")
+        self.assertEquals(getFileDigests(self.path, ["md5"]),
+                          {"size": 5, "md5": digest.hexdigest()})
+
+    def test_replaced_file_is_read_again(self):
+        getFileDigests(self.path, ["md5"])
+        st = os.stat(self.path)
+        partpath = self.makeFile("DATA"*1000)
+        os.utime(partpath, (st.st_atime, st.st_mtime))
+        os.rename(partpath, self.path)
+        digest = newDigest("md5")
+        digest.update("DATA"*1000)
+        self.assertEquals(getFileDigests(self.path, ["md5"]),
+                          {"size": 4000, "md5": digest.hexdigest()})
+
+    def test_cached_paths_are_bounded(self):
+        filedigest.MAXCACHED, maxcached = 2, filedigest.MAXCACHED
+        try:
+            for i in range(5):
+                getFileDigests(self.makeFile(str(i)), ["md5"])
+                self.assertTrue(len(filedigest._cache) <= 2)
+        finally:
+            filedigest.MAXCACHED = maxcached
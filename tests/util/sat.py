@@ -0,0 +1,99 @@
+import unittest
+import random
+
+from smart.util.sat import Solver
+
+
+def satisfiable(nvars, clauses, assumptions=()):
+    for bits in range(2**nvars):
+        values = [None]+[bool(bits & (1 << i)) for i in range(nvars)]
+        def holds(lit):
+            return values[abs(lit)] == (lit > 0)
+        if ([x for x in assumptions if holds(x)] == list(assumptions) and
+            [x for x in clauses if [y for y in x if holds(y)]] == clauses):
+            return True
+    return False
+
+
+class SolverTest(unittest.TestCase):
+
+    def solver(self, nvars, clauses):
+        solver = Solver()
+        for i in range(nvars):
+            solver.newVar()
+        for clause in clauses:
+            solver.addClause(clause)
+        return solver
+
+    def check_solution(self, solver, clauses, assumptions=()):
+        def holds(lit):
+            return solver.getValue(abs(lit)) == (lit > 0)
+        for clause in clauses:
+            self.assertTrue([x for x in clause if holds(x)], clause)
+        for lit in assumptions:
+            self.assertTrue(holds(lit))
+
+    def test_random(self):
+        r = random.Random(0)
+        for i in range(300):
+            nvars = r.randint(3, 10)
+            clauses = []
+            for j in range(r.randint(1, nvars*5)):
+                clause = [r.choice([-1, 1])*r.randint(1, nvars)
+                          for k in range(r.randint(1, 3))]
+                clauses.append(clause)
+            solver = self.solver(nvars, clauses)
+            expected = satisfiable(nvars, clauses)
+            self.assertEquals(solver.solve(), expected)
+            if expected:
+                self.check_solution(solver, clauses)
+
+    def test_random_assumptions(self):
+        r = random.Random(1)
+        for i in range(200):
+            nvars = r.randint(3, 10)
+            clauses = [[r.choice([-1, 1])*r.randint(1, nvars)
+                        for k in range(3)] for j in range(nvars*3)]
+            solver = self.solver(nvars, clauses)
+            for j in range(3):
+                assumptions = [r.choice([-1, 1])*x
+                               for x in r.sample(range(1, nvars+1), 3)]
+                result = solver.solve(assumptions)
+                self.assertEquals(result,
+                                  satisfiable(nvars, clauses, assumptions))
+                if result:
+                    self.check_solution(solver, clauses, assumptions)
+                else:
+                    core = solver.getCore()
+                    self.assertEquals([x for x in core
+                                       if x not in assumptions], [])
+                    self.assertFalse(satisfiable(nvars, clauses, core))
+
+    def test_pigeonhole(self):
+        # Five pigeons don't fit in four holes.
+        var = lambda pigeon, hole: pigeon*4+hole+1
+        clauses = [[var(p, h) for h in range(4)] for p in range(5)]
+        for h in range(4):
+            for p1 in range(5):
+                for p2 in range(p1+1, 5):
+                    clauses.append([-var(p1, h), -var(p2, h)])
+        solver = self.solver(20, clauses)
+        self.assertFalse(solver.solve())
+        self.assertEquals(solver.getCore(), [])
+
+    def test_phase(self):
+        solver = self.solver(3, [[1, 2, 3]])
+        solver.setPhase(2, True)
+        self.assertTrue(solver.solve())
+        self.assertEquals([solver.getValue(x) for x in (1, 2, 3)],
+                          [False, True, False])
+
+    def test_add_clause_after_solving(self):
+        solver = self.solver(2, [[1, 2]])
+        self.assertTrue(solver.solve([-1]))
+        self.assertTrue(solver.getValue(2))
+        self.assertFalse(solver.addClause([-2]) and solver.solve([-1]))
+        self.assertEquals(solver.getCore(), [-1])
+        self.assertTrue(solver.solve())
+        self.assertEquals((solver.getValue(1), solver.getValue(2)),
+                          (True, False))
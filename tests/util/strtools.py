@@ -0,0 +1,16 @@
+from tests.mocker import MockerTestCase
+
+from smart.util.strtools import dumpJSON
+
+
+class StrToolsTest(MockerTestCase):
+
+    def test_dump_json(self):
+        self.assertEquals(dumpJSON({"b": [1, 2L, 0.5], "a": (None, True,
+                                                             False)}),
+                          '{"a": [null, true, false], "b": [1, 2, 0.5]}')
+
+    def test_dump_json_escapes(self):
+        self.assertEquals(dumpJSON([u'a"\\\n\xe9\U0001d11e', "\t\xc3\xa9"]),
+                          r'["a\"\\\u000a\u00e9\ud834\udd1e", '
+                          r'"\u0009\u00e9"]')